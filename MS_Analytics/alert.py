@@ -36,8 +36,9 @@ class AlertManager:
                 logger.warning(f"Risk level is {risk_level} but no matching forecasts found")
                 return None
                 
-            # Get the earliest forecast with the highest risk
-            earliest_forecast = subset.iloc[0]
+            # Get the earliest forecast with the highest risk, over all devices
+            earliest_forecast = subset.sort_values('minutes_ahead', kind='stable').iloc[0]
+            device_id = earliest_forecast.get('device_id')
             
             # Determine what triggers the alert
             triggers = []
@@ -55,6 +56,8 @@ class AlertManager:
                 'alert_id': f"alert-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}",
                 'timestamp': datetime.datetime.now().isoformat(),
                 'risk_level': risk_level,
+                'device_id': device_id,
+                'devices_at_risk': int(subset['device_id'].nunique()) if 'device_id' in subset.columns else None,
                 'triggers': triggers,
                 'forecast_timestamp': earliest_forecast['forecast_timestamp'].isoformat(),
                 'minutes_ahead': int(earliest_forecast['minutes_ahead']),
@@ -75,7 +78,8 @@ class AlertManager:
                     {
                         'temperature': float(earliest_forecast['forecasted_temperature']),
                         'pressure': float(earliest_forecast['forecasted_pressure'])
-                    }
+                    },
+                    device_id
                 )
             }
             
@@ -86,7 +90,7 @@ class AlertManager:
             logger.error(f"Error generating alert: {e}")
             return None
     
-    def _generate_alert_message(self, risk_level, triggers, minutes_ahead, values):
+    def _generate_alert_message(self, risk_level, triggers, minutes_ahead, values, device_id=None):
         """Generate a human-readable alert message"""
         if risk_level == 'DANGER':
             prefix = "DANGER ALERT:"
@@ -111,8 +115,9 @@ class AlertManager:
                 trigger_texts.append(f"Pressure expected to reach concerning level of {pressure_val:.1f} PSI")
         
         time_text = f"in approximately {minutes_ahead} minutes."
+        device_text = f" at device {device_id}" if device_id is not None else ""
         
-        return f"{prefix} {'; '.join(trigger_texts)} {time_text}"
+        return f"{prefix} {'; '.join(trigger_texts)}{device_text} {time_text}"
     
     def should_send_alert(self, risk_level, triggers):
         """Determine if we should send an alert based on cooldown periods"""
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark of fleet-wide linear trend fitting in prediction.py.
+
+Compares one sklearn LinearRegression per series (fit_linear_trend) with the
+vectorised fits over a padded matrix (batch_least_squares) and over ragged
+series (fit_linear_trends, as used by PredictionEngine):
+
+    python benchmark.py --series 5000 --points 288
+    python benchmark.py --series 20000 --points 60 --missing 0.2 --json -
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+
+import prediction
+
+
+def synthetic_series(args):
+    """Readings every --interval seconds with a random trend per series;
+    --missing of the points are masked out."""
+    rng = np.random.default_rng(args.seed)
+    now = time.time()
+    times = now - np.arange(args.points)[::-1] * args.interval
+    times = np.broadcast_to(times, (args.series, args.points)).copy()
+    slopes = rng.normal(0, 0.01, (args.series, 1))
+    values = 25.0 + slopes * (times - now) / 60.0 + rng.normal(0, 0.2, times.shape)
+    mask = rng.random(times.shape) >= args.missing
+    # Keep at least one point per series
+    mask[:, -1] = True
+    return times, values, mask
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(args):
+    times, values, mask = synthetic_series(args)
+    series = [
+        ((f"device_{i}", "temperature"), times[i][mask[i]], values[i][mask[i]])
+        for i in range(args.series)
+    ]
+
+    def per_series():
+        return [(key, prediction.fit_linear_trend(t, v)) for key, t, v in series[:args.sklearn_series]]
+
+    def padded():
+        # Minutes before each series' newest point, as fit_linear_trend uses
+        origins = np.where(mask, times, -np.inf).max(axis=1, keepdims=True)
+        return prediction.batch_least_squares((times - origins) / 60.0, values, mask)
+
+    sklearn_s, reference = timed(per_series, 1)
+    padded_s, (intercept, slope, count) = timed(padded, args.repeat)
+    ragged_s, trends = timed(lambda: prediction.fit_linear_trends(series), args.repeat)
+
+    # Agreement of the vectorised fits with sklearn on the series fitted by both
+    checked = len(reference)
+    slope_error = max(abs(model.slope - slope[i]) for i, (_, model) in enumerate(reference))
+    ragged_error = max(abs(model.slope - trends[i][1].slope) for i, (_, model) in enumerate(reference))
+
+    # sklearn is timed on a subset; scale it to the whole fleet
+    sklearn_fleet_s = sklearn_s * args.series / checked
+    return {
+        "series": args.series,
+        "points": args.points,
+        "missing": args.missing,
+        "sklearn_per_series_ms": round(sklearn_fleet_s * 1000, 2),
+        "sklearn_series_timed": checked,
+        "padded_ms": round(padded_s * 1000, 2),
+        "ragged_ms": round(ragged_s * 1000, 2),
+        "speedup_padded": round(sklearn_fleet_s / padded_s, 1),
+        "speedup_ragged": round(sklearn_fleet_s / ragged_s, 1),
+        "max_slope_difference": float(max(slope_error, ragged_error))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Linear trend fitting benchmark')
+    parser.add_argument('--series', type=int, default=5000)
+    parser.add_argument('--points', type=int, default=288, help='Points per series before masking')
+    parser.add_argument('--interval', type=float, default=300, help='Seconds between points')
+    parser.add_argument('--missing', type=float, default=0.1, help='Share of points masked out')
+    parser.add_argument('--sklearn-series', type=int, default=1000,
+                        help='Series fitted with sklearn (scaled up to --series)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help='Write results to this file ("-" for stdout)')
+    args = parser.parse_args()
+    args.sklearn_series = max(1, min(args.sklearn_series, args.series))
+
+    results = {"config": vars(args).copy(), "python": platform.python_version(),
+               "numpy": np.__version__, "result": run(args)}
+
+    if args.json_path == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    result = results["result"]
+    print(f"{result['series']} series x {result['points']} points ({result['missing']:.0%} missing)")
+    print(f"  sklearn per series: {result['sklearn_per_series_ms']:.1f} ms "
+          f"(timed on {result['sklearn_series_timed']} series)")
+    print(f"  padded matrix:      {result['padded_ms']:.2f} ms ({result['speedup_padded']}x)")
+    print(f"  ragged series:      {result['ragged_ms']:.2f} ms ({result['speedup_ragged']}x)")
+    print(f"  max slope difference vs sklearn: {result['max_slope_difference']:.2e}")
+
+
+if __name__ == "__main__":
+    main()
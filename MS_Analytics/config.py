@@ -29,12 +29,45 @@ MQTT_PORT = 1883
 MQTT_CLIENT_ID = "analytics_service_client"
 MQTT_USERNAME = None
 MQTT_PASSWORD = None
+SENSOR_DATA_TOPIC = "sensor/readings"
 
 # Analytics settings
 PREDICTION_INTERVAL_MINUTES = 5
 FORECAST_HORIZON_MINUTES = 30
 ANALYSIS_FREQUENCY_SECONDS = 60  # How often to run analysis
 DATA_HISTORY_HOURS = 24  # How much historical data to use for predictions
+# The last DATA_HISTORY_HOURS of readings are cached locally and each run only
+# fetches readings from WINDOW_FETCH_OVERLAP_SECONDS before the newest cached
+# one on (readings stored later than that are missed); after
+# WINDOW_MAX_GAP_SECONDS without a successful fetch the cache is rebuilt from
+# a full fetch instead
+WINDOW_FETCH_OVERLAP_SECONDS = 2 * ANALYSIS_FREQUENCY_SECONDS
+WINDOW_MAX_GAP_SECONDS = 10 * ANALYSIS_FREQUENCY_SECONDS
+
+# "poll": new readings are fetched from the time series DB every run;
+# "stream": readings are received directly from the message broker and the
+# time series DB is only read to fill the window at startup (or while the
+# broker cannot be reached). Streamed readings are taken up every
+# STREAM_ANALYSIS_INTERVAL_SECONDS; at most STREAM_BUFFER_SIZE wait in between
+INGESTION_MODE = os.environ.get("INGESTION_MODE", "poll")
+STREAM_ANALYSIS_INTERVAL_SECONDS = 5
+STREAM_BUFFER_SIZE = 100000
+
+# "online": trend models are updated point by point with the readings that
+# arrived since the last run; "batch": models are refit on the whole history every run
+PREDICTION_MODE = "online"
+ONLINE_HALF_LIFE_MINUTES = 60  # A reading's weight in the online trend halves every half-life
+# Full refits on DATA_HISTORY_HOURS of data only validate the online models;
+# models that drifted further than the tolerance (forecast at the horizon,
+# in sensor units) are rebuilt from that history
+ONLINE_VALIDATION_INTERVAL_MINUTES = 60
+ONLINE_VALIDATION_TOLERANCE = 0.5
+
+# Forecast models are kept per (device_id, sensor_type) and created on a
+# device's first reading; beyond MAX_DEVICE_MODELS the least recently
+# updated ones are dropped
+MAX_DEVICE_MODELS = 20000
+MIN_DEVICE_SAMPLES = 10  # Readings a device needs before it is forecast
 
 # Safety thresholds
 TEMPERATURE_WARNING_THRESHOLD = 26.5
@@ -11,17 +11,27 @@ import cherrypy
 import config
 from prediction import PredictionEngine
 from alert import AlertManager
+from sensor_window import SensorWindow
+from sensor_stream import SensorStream
 import registration
 
 # Set up global objects
 prediction_engine = PredictionEngine()
 alert_manager = AlertManager()
+# Last DATA_HISTORY_HOURS of readings, refreshed incrementally every run
+sensor_window = SensorWindow(hours=config.DATA_HISTORY_HOURS)
+# Readings from the message broker in "stream" ingestion mode, else None
+sensor_stream = None
 last_analysis_time = None
 latest_forecast = None
 latest_risk_level = 'NORMAL'
+latest_device_risk = {}
+# Online mode: last validation of the online models against the whole window
+last_validation_time = None
 
-def fetch_sensor_data(hours=24):
-    """Fetch historical sensor data from the time series database"""
+def fetch_sensor_data(hours=24, since=None):
+    """Fetch historical sensor data from the time series database,
+    from `hours` ago or, if given, from the `since` timestamp on"""
     try:
         # If we haven't found the timeseries service from Resource Catalog yet
         if not config.TIMESERIES_DB_API_URL:
@@ -32,9 +42,13 @@ def fetch_sensor_data(hours=24):
             else:
                 logger.error("Failed to discover Time Series DB API URL from Resource Catalog")
                 return None
-        # Calculate the time range for the query
-        end_time = datetime.datetime.now().isoformat()
-        start_time = (datetime.datetime.now() - datetime.timedelta(hours=hours)).isoformat()
+        # Calculate the time range for the query, in UTC like the DB's timestamps
+        now = datetime.datetime.now(datetime.timezone.utc)
+        end_time = now.isoformat()
+        if since is not None:
+            start_time = since.tz_convert('UTC').isoformat()
+        else:
+            start_time = (now - datetime.timedelta(hours=hours)).isoformat()
         
         # Make the request to the time series DB API
         url = f"{config.TIMESERIES_DB_API_URL}/all_seneor_data"
@@ -51,6 +65,9 @@ def fetch_sensor_data(hours=24):
             if 'data' in data and len(data['data']) > 0:
                 logger.info(f"Fetched {len(data['data'])} sensor readings from time series DB")
                 return data['data']
+            elif since is not None:
+                # Nothing new since the last run
+                return []
             else:
                 logger.warning("No sensor data returned from time series DB")
                 return None
@@ -65,26 +82,85 @@ def fetch_sensor_data(hours=24):
         logger.error(f"Unexpected error fetching sensor data: {e}")
         return None
 
+def ingest_sensor_data():
+    """Add the readings that arrived since the last run to the sensor window.
+    
+    While the stream is connected, streamed readings are used once the window
+    has been filled from the time series DB; if that backfill fails, the
+    window is started from the streamed readings instead. Without the stream
+    the readings are fetched from the time series DB. Returns the new
+    readings, or None on error.
+    """
+    if sensor_stream is None or not sensor_stream.connected:
+        return sensor_window.refresh(fetch_sensor_data)
+    if sensor_window.high_water_mark is None:
+        backfill = sensor_window.refresh(fetch_sensor_data)
+        if backfill is not None:
+            return backfill
+        logger.warning("Time series DB backfill failed, starting the sensor window from streamed readings")
+    return sensor_window.append(sensor_stream.drain())
+
+def update_online_models():
+    """Feed the readings that arrived since the last run to the online models.
+    
+    Every ONLINE_VALIDATION_INTERVAL_MINUTES, and whenever the sensor window
+    was rebuilt, the models are validated or rebuilt against the whole window.
+    """
+    global last_validation_time
+    
+    now = datetime.datetime.now()
+    validation_due = last_validation_time is None or \
+        now - last_validation_time >= datetime.timedelta(minutes=config.ONLINE_VALIDATION_INTERVAL_MINUTES)
+    
+    first_run = sensor_window.high_water_mark is None
+    rebuilds = sensor_window.rebuilds
+    new_df = ingest_sensor_data()
+    if new_df is None:
+        return False
+    
+    # A (re)built window is returned whole as new readings, most of which the
+    # models have already seen: rebuild the models from it instead
+    rebuilt = first_run or sensor_window.rebuilds != rebuilds
+    if not rebuilt and not new_df.empty and not prediction_engine.update_online_models(new_df):
+        return False
+    if validation_due or rebuilt:
+        if not len(sensor_window):
+            return True
+        if prediction_engine.validate_online_models(sensor_window.frame(), rebuild=rebuilt) is None:
+            return False
+        last_validation_time = now
+    return True
+
 def run_analysis():
     """Run the full analysis pipeline: fetch data, predict, evaluate risk, send alerts"""
-    global last_analysis_time, latest_forecast, latest_risk_level
+    global last_analysis_time, latest_forecast, latest_risk_level, latest_device_risk
     
     try:
         logger.info("Starting analysis run")
         
-        # Fetch historical sensor data
-        sensor_data = fetch_sensor_data(hours=config.DATA_HISTORY_HOURS)
-        if not sensor_data or len(sensor_data) < 10:  # Need enough data points for prediction
-            logger.warning("Insufficient sensor data for analysis")
-            return False
-        
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(sensor_data)
-        
-        # Train the prediction models
-        if not prediction_engine.train_models(df):
-            logger.error("Failed to train prediction models")
-            return False
+        if prediction_engine.mode == "online":
+            # Update the models with the new readings only
+            if not update_online_models():
+                logger.error("Failed to update online prediction models")
+                return False
+            if not prediction_engine.ready_devices():
+                logger.warning("Insufficient sensor data for analysis")
+                return False
+        else:
+            # Fetch the new sensor data into the window of historical data
+            if ingest_sensor_data() is None:
+                logger.error("Failed to fetch sensor data")
+                return False
+            if len(sensor_window) < 10:  # Need enough data points for prediction
+                logger.warning("Insufficient sensor data for analysis")
+                return False
+            
+            df = sensor_window.frame()
+            
+            # Train the prediction models
+            if not prediction_engine.train_models(df):
+                logger.error("Failed to train prediction models")
+                return False
         
         # Make predictions
         forecast_data = prediction_engine.predict_future_values(
@@ -101,6 +177,7 @@ def run_analysis():
         # Store the latest results
         latest_forecast = forecast_with_risk
         latest_risk_level = risk_level
+        latest_device_risk = prediction_engine.device_risk(forecast_with_risk)
         last_analysis_time = datetime.datetime.now()
         
         # Generate and send alerts if needed
@@ -109,7 +186,7 @@ def run_analysis():
             if alert_result:
                 logger.info(f"Alert sent for {risk_level} risk level")
         
-        logger.info(f"Analysis completed successfully. Risk level: {risk_level}")
+        logger.info(f"Analysis completed successfully for {len(latest_device_risk)} devices. Risk level: {risk_level}")
         return True
         
     except Exception as e:
@@ -125,7 +202,10 @@ def analysis_worker():
             logger.error(f"Error in analysis worker: {e}")
         
         # Sleep for the configured interval
-        time.sleep(config.ANALYSIS_FREQUENCY_SECONDS)
+        if sensor_stream is not None:
+            time.sleep(config.STREAM_ANALYSIS_INTERVAL_SECONDS)
+        else:
+            time.sleep(config.ANALYSIS_FREQUENCY_SECONDS)
 
 class AnalyticsAPI:
     """CherryPy REST API for Analytics service"""
@@ -137,13 +217,15 @@ class AnalyticsAPI:
         return {
             "status": "healthy",
             "service": config.SERVICE_NAME,
+            "sensor_window": sensor_window.get_status(),
+            "sensor_stream": sensor_stream.get_status() if sensor_stream is not None else None,
             "timestamp": datetime.datetime.now().isoformat()
         }
     
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def forecast(self):
-        """Endpoint to get the latest forecast data"""
+    def forecast(self, device_id=None):
+        """Endpoint to get the latest forecast data, of all devices or one device"""
         if latest_forecast is None:
             cherrypy.response.status = 404
             return {
@@ -153,6 +235,8 @@ class AnalyticsAPI:
         
         # Convert DataFrame to dict for JSON serialization
         df = latest_forecast.copy()
+        if device_id is not None:
+            df = df[df['device_id'] == device_id]
         # Convert any datetime columns to ISO format strings
         df['forecast_timestamp'] = df['forecast_timestamp'].astype(str)
         # Convert DataFrame to dict for JSON serialization
@@ -163,6 +247,7 @@ class AnalyticsAPI:
             "data": {
                 "forecast": forecast_dict,
                 "risk_level": latest_risk_level,
+                "device_risk": latest_device_risk if device_id is None else {device_id: latest_device_risk.get(device_id)},
                 "generated_at": last_analysis_time.isoformat() if last_analysis_time else None,
                 "config": {
                     "temperature_warning_threshold": config.TEMPERATURE_WARNING_THRESHOLD,
@@ -196,10 +281,19 @@ class AnalyticsAPI:
 
 def main():
     """Main entry point for the application"""
+    global sensor_stream
     try:
         # Register with Resource Catalog
         registration.start_registration(background=True)
         
+        if config.INGESTION_MODE == "stream":
+            # Subscribe before the first run fills the window from the time
+            # series DB, so no reading falls between the two
+            sensor_stream = SensorStream()
+            if not sensor_stream.start():
+                logger.error("Sensor streaming unavailable, polling the time series DB instead")
+                sensor_stream = None
+        
         # Start the background analysis worker
         analysis_thread = threading.Thread(target=analysis_worker, daemon=True)
         analysis_thread.start()
@@ -232,6 +326,8 @@ def main():
         logger.info("Shutting down analytics service")
         # Update status to offline before exiting
         registration.update_status("offline")
+        if sensor_stream is not None:
+            sensor_stream.stop()
         cherrypy.engine.exit()
 
 if __name__ == "__main__":
@@ -5,17 +5,319 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 import datetime
 import logging
+import math
+import time
+from dateutil.tz import tzlocal
+from collections import OrderedDict
 import config
 
 # Setup logging
 logger = logging.getLogger('prediction')
 
+SENSOR_TYPES = ('temperature', 'pressure')
+
+# Online trends move their time origin forward once it is this many minutes
+# behind, so the time sums stay small
+REBASE_MINUTES = 24 * 60
+
+
+def utc_timestamps(timestamps):
+    """A timestamp column in UTC. Naive timestamps are local time, as sensors
+    and the time series DB queries stamp them with datetime.now()"""
+    timestamps = pd.to_datetime(pd.Series(timestamps), format='ISO8601')
+    if timestamps.dt.tz is None:
+        # Repeated hours at the end of DST are taken as standard time
+        timestamps = timestamps.dt.tz_localize(tzlocal(), ambiguous=np.zeros(len(timestamps), dtype=bool),
+                                               nonexistent='shift_forward')
+    return timestamps.dt.tz_convert('UTC')
+
+
+def epoch_seconds(timestamps):
+    """Seconds since the epoch of a timestamp column (naive timestamps are local time)"""
+    timestamps = utc_timestamps(timestamps)
+    return ((timestamps - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+class OnlineTrend:
+    """Exponentially weighted least-squares line through (time, value) points.
+
+    Only the decayed weighted sums of the regression are kept, so adding a
+    point and forecasting are both O(1). A point's weight halves every
+    half_life minutes; times are minutes since self.origin (epoch seconds).
+    """
+    
+    __slots__ = ('decay', 'origin', 'last_time', 'count',
+                 'sum_w', 'sum_t', 'sum_v', 'sum_tt', 'sum_tv')
+    
+    def __init__(self, half_life_minutes=None):
+        self.decay = math.log(2) / (half_life_minutes or config.ONLINE_HALF_LIFE_MINUTES)
+        self.origin = None
+        self.last_time = 0.0
+        self.count = 0
+        self.sum_w = self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+    
+    @classmethod
+    def from_points(cls, timestamps, values, half_life_minutes=None):
+        """Fit a trend on all points at once, as if they had been added one by one
+        (one series per call, the reference for fit_online_trends)"""
+        trend = cls(half_life_minutes)
+        timestamps = np.asarray(timestamps, dtype=float)
+        values = np.asarray(values, dtype=float)
+        valid = ~(np.isnan(timestamps) | np.isnan(values))
+        timestamps, values = timestamps[valid], values[valid]
+        if not len(timestamps):
+            return trend
+        trend.origin = float(timestamps.max())
+        # Origin at the newest point, so every t <= 0 and its weight is exp(decay * t)
+        t = (timestamps - trend.origin) / 60.0
+        w = np.exp(trend.decay * t)
+        trend.count = len(t)
+        trend.sum_w = float(w.sum())
+        trend.sum_t = float((w * t).sum())
+        trend.sum_v = float((w * values).sum())
+        trend.sum_tt = float((w * t * t).sum())
+        trend.sum_tv = float((w * t * values).sum())
+        return trend
+    
+    def update(self, timestamp, value):
+        if self.origin is None:
+            self.origin = timestamp
+        t = (timestamp - self.origin) / 60.0
+        if t >= self.last_time:
+            # Age everything seen so far to the new point's time
+            factor = math.exp(-self.decay * (t - self.last_time))
+            self.sum_w *= factor
+            self.sum_t *= factor
+            self.sum_v *= factor
+            self.sum_tt *= factor
+            self.sum_tv *= factor
+            self.last_time = t
+            weight = 1.0
+        else:
+            # Late point: weighted by its age instead
+            weight = math.exp(-self.decay * (self.last_time - t))
+        self.sum_w += weight
+        self.sum_t += weight * t
+        self.sum_v += weight * value
+        self.sum_tt += weight * t * t
+        self.sum_tv += weight * t * value
+        self.count += 1
+        if self.last_time > REBASE_MINUTES:
+            self._rebase(self.last_time)
+    
+    def _rebase(self, shift):
+        """Move the origin shift minutes forward; the fitted line does not change"""
+        self.sum_tt += -2 * shift * self.sum_t + shift * shift * self.sum_w
+        self.sum_tv -= shift * self.sum_v
+        self.sum_t -= shift * self.sum_w
+        self.origin += shift * 60.0
+        self.last_time -= shift
+    
+    def coefficients(self):
+        """(intercept at the origin, slope per minute), or None without data"""
+        if self.count == 0 or self.sum_w <= 0:
+            return None
+        denominator = self.sum_w * self.sum_tt - self.sum_t * self.sum_t
+        if abs(denominator) <= 1e-12 * max(1.0, self.sum_w * self.sum_tt):
+            # All weight on one instant: no trend, only a level
+            return self.sum_v / self.sum_w, 0.0
+        slope = (self.sum_w * self.sum_tv - self.sum_t * self.sum_v) / denominator
+        return (self.sum_v - slope * self.sum_t) / self.sum_w, slope
+    
+    def predict(self, timestamp):
+        coefficients = self.coefficients()
+        if coefficients is None:
+            return None
+        intercept, slope = coefficients
+        return intercept + slope * (timestamp - self.origin) / 60.0
+
+class LinearTrend:
+    """Least-squares line fitted on a full history; predicts like an OnlineTrend"""
+    
+    __slots__ = ('origin', 'intercept', 'slope', 'count')
+    
+    def __init__(self, origin, intercept, slope, count):
+        self.origin = origin
+        self.intercept = intercept
+        self.slope = slope
+        self.count = count
+    
+    def coefficients(self):
+        return self.intercept, self.slope
+    
+    def predict(self, timestamp):
+        return self.intercept + self.slope * (timestamp - self.origin) / 60.0
+
+
+def fit_linear_trend(timestamps, values):
+    """Unweighted fit of values against minutes before the newest point, one
+    series per call (the reference for fit_linear_trends)"""
+    origin = float(timestamps.max())
+    X = ((timestamps - origin) / 60.0).reshape(-1, 1)
+    model = LinearRegression().fit(X, values)
+    return LinearTrend(origin, float(model.intercept_), float(model.coef_[0]), len(values))
+
+
+def segment_least_squares(times, values, segments, n_segments):
+    """Least-squares intercept and slope of many ragged series in one pass.
+    
+    times, values and segments are flat arrays holding every point of every
+    series, segments being the index of the series a point belongs to.
+    Returns (intercept, slope, count) arrays of length n_segments; series
+    with a single point get slope 0, empty series NaN.
+    """
+    segments = np.asarray(segments, dtype=np.intp)
+    count = np.bincount(segments, minlength=n_segments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centred sums, so large time offsets do not cancel out
+        mean_t = np.bincount(segments, times, n_segments) / count
+        mean_v = np.bincount(segments, values, n_segments) / count
+        dt = times - mean_t[segments]
+        dv = values - mean_v[segments]
+        sxx = np.bincount(segments, dt * dt, n_segments)
+        sxy = np.bincount(segments, dt * dv, n_segments)
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+    slope[count == 0] = np.nan
+    return mean_v - slope * mean_t, slope, count
+
+
+def batch_least_squares(times, values, mask=None):
+    """Least-squares intercept and slope of every row of a padded
+    (series, points) matrix in one pass; mask marks the points that exist
+    (by default those where both time and value are finite).
+    Returns (intercept, slope, count) like segment_least_squares."""
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if mask is None:
+        mask = np.isfinite(times) & np.isfinite(values)
+    count = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_t = np.where(mask, times, 0.0).sum(axis=1) / count
+        mean_v = np.where(mask, values, 0.0).sum(axis=1) / count
+        dt = np.where(mask, times - mean_t[:, np.newaxis], 0.0)
+        dv = np.where(mask, values - mean_v[:, np.newaxis], 0.0)
+        sxx = np.einsum('ij,ij->i', dt, dt)
+        sxy = np.einsum('ij,ij->i', dt, dv)
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+    slope[count == 0] = np.nan
+    return mean_v - slope * mean_t, slope, count
+
+
+def fit_linear_trends(series):
+    """fit_linear_trend for [(key, timestamps, values), ...] in one vectorised pass"""
+    series = [item for item in series if len(item[1])]
+    if not series:
+        return []
+    lengths = np.array([len(timestamps) for _, timestamps, _ in series])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    segments = np.repeat(np.arange(len(series)), lengths)
+    times = np.concatenate([timestamps for _, timestamps, _ in series]).astype(float)
+    values = np.concatenate([series_values for _, _, series_values in series]).astype(float)
+    
+    valid = ~np.isnan(values)
+    # Each series' newest valid reading is its origin
+    origins = np.maximum.reduceat(np.where(valid, times, -np.inf), offsets)
+    intercept, slope, count = segment_least_squares(
+        ((times - origins[segments]) / 60.0)[valid], values[valid], segments[valid], len(series)
+    )
+    return [
+        (key, LinearTrend(float(origins[i]), float(intercept[i]), float(slope[i]), int(count[i])))
+        for i, (key, _, _) in enumerate(series) if count[i]
+    ]
+
+
+def fit_online_trends(series, half_life_minutes=None):
+    """OnlineTrend.from_points for [(key, timestamps, values), ...] in one
+    vectorised pass: the weighted sums of every series are segment sums"""
+    series = [item for item in series if len(item[1])]
+    if not series:
+        return []
+    lengths = np.array([len(timestamps) for _, timestamps, _ in series])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    segments = np.repeat(np.arange(len(series)), lengths)
+    times = np.concatenate([timestamps for _, timestamps, _ in series]).astype(float)
+    values = np.concatenate([series_values for _, _, series_values in series]).astype(float)
+    
+    valid = ~(np.isnan(times) | np.isnan(values))
+    origins = np.maximum.reduceat(np.where(valid, times, -np.inf), offsets)
+    times, values, segments = times[valid], values[valid], segments[valid]
+    decay = math.log(2) / (half_life_minutes or config.ONLINE_HALF_LIFE_MINUTES)
+    # Origin at each series' newest point, so every t <= 0 and its weight is exp(decay * t)
+    t = (times - origins[segments]) / 60.0
+    w = np.exp(decay * t)
+    n = len(series)
+    count = np.bincount(segments, minlength=n)
+    sum_w = np.bincount(segments, w, n)
+    sum_t = np.bincount(segments, w * t, n)
+    sum_v = np.bincount(segments, w * values, n)
+    sum_tt = np.bincount(segments, w * t * t, n)
+    sum_tv = np.bincount(segments, w * t * values, n)
+    
+    results = []
+    for i, (key, _, _) in enumerate(series):
+        if not count[i]:
+            continue
+        trend = OnlineTrend(half_life_minutes)
+        trend.origin = float(origins[i])
+        trend.count = int(count[i])
+        trend.sum_w = float(sum_w[i])
+        trend.sum_t = float(sum_t[i])
+        trend.sum_v = float(sum_v[i])
+        trend.sum_tt = float(sum_tt[i])
+        trend.sum_tv = float(sum_tv[i])
+        results.append((key, trend))
+    return results
+
+
+class ModelRegistry:
+    """Forecast models keyed by (device_id, sensor_type), least recently updated first.
+    
+    Models are created on a device's first reading; beyond max_models the
+    least recently updated one is dropped, so silent devices free their slot.
+    """
+    
+    def __init__(self, max_models=None):
+        self.max_models = max_models or config.MAX_DEVICE_MODELS
+        self.models = OrderedDict()
+        self.evicted = 0
+    
+    def get(self, key):
+        return self.models.get(key)
+    
+    def get_or_create(self, key, factory):
+        model = self.models.get(key)
+        if model is None:
+            model = self.models[key] = factory()
+            self._evict()
+        else:
+            self.models.move_to_end(key)
+        return model
+    
+    def put(self, key, model):
+        self.models[key] = model
+        self.models.move_to_end(key)
+        self._evict()
+    
+    def _evict(self):
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+            self.evicted += 1
+    
+    def items(self):
+        return self.models.items()
+    
+    def __len__(self):
+        return len(self.models)
+
+
 class PredictionEngine:
     """Handles predictions of temperature and pressure based on historical data"""
     
-    def __init__(self):
-        self.temp_model = None
-        self.pressure_model = None
+    def __init__(self, mode=None):
+        # "online" or "batch", see config.PREDICTION_MODE
+        self.mode = mode or config.PREDICTION_MODE
+        # One model per (device_id, sensor_type)
+        self.models = ModelRegistry()
         
     def preprocess_data(self, data):
         """Preprocess the sensor data for prediction analysis"""
@@ -47,8 +349,29 @@ class PredictionEngine:
             logger.error(f"Error preprocessing data: {e}")
             return None
     
+    def _series(self, df):
+        """[(key, timestamps, values), ...] of every device and sensor type in df"""
+        timestamps = epoch_seconds(df['timestamp'])
+        if 'device_id' in df.columns:
+            device_ids = df['device_id'].astype(str).to_numpy()
+        else:
+            device_ids = np.full(len(df), 'unknown', dtype=object)
+        series = []
+        for device_id, rows in pd.Series(device_ids).groupby(device_ids, sort=False).indices.items():
+            for sensor_type in SENSOR_TYPES:
+                if sensor_type in df.columns:
+                    values = df[sensor_type].to_numpy(dtype=float)[rows]
+                    series.append(((device_id, sensor_type), timestamps[rows], values))
+        return series
+    
+    def _refit(self, series):
+        """Full refits of many series in one vectorised pass"""
+        if self.mode == "online":
+            return fit_online_trends(series)
+        return fit_linear_trends(series)
+    
     def train_models(self, historical_data):
-        """Train prediction models using historical sensor data"""
+        """Train one prediction model per device and sensor type on historical sensor data"""
         try:
             df = self.preprocess_data(historical_data)
             if df is None or df.empty:
@@ -60,52 +383,110 @@ class PredictionEngine:
                 logger.error(f"Missing required columns in data. Available columns: {df.columns}")
                 return False
             
-            # Features for prediction (time-based)
-            X = df[['minutes_elapsed']].values
-            
-            # Train temperature model
-            y_temp = df['temperature'].values
-            self.temp_model = LinearRegression()
-            self.temp_model.fit(X, y_temp)
-            logger.info("Temperature prediction model trained")
-            
-            # Train pressure model
-            y_pressure = df['pressure'].values
-            self.pressure_model = LinearRegression()
-            self.pressure_model.fit(X, y_pressure)
-            logger.info("Pressure prediction model trained")
+            results = self._refit(self._series(df))
+            for key, model in results:
+                self.models.put(key, model)
+            logger.info(f"Trained {len(results)} prediction models on {len(df)} readings")
             
             return True
         except Exception as e:
             logger.error(f"Error training prediction models: {e}")
             return False
     
-    def predict_future_values(self, minutes_ahead=30):
-        """Predict temperature and pressure values for the specified time ahead"""
-        if self.temp_model is None or self.pressure_model is None:
-            logger.error("Models not trained yet")
+    def update_online_models(self, new_data):
+        """Add readings to the online models, one O(1) update per reading"""
+        try:
+            df = self.preprocess_data(new_data)
+            if df is None:
+                return False
+            
+            for key, timestamps, values in self._series(df):
+                model = self.models.get_or_create(key, OnlineTrend)
+                for timestamp, value in zip(timestamps, values):
+                    if not math.isnan(value):
+                        model.update(timestamp, value)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating online models: {e}")
+            return False
+    
+    def validate_online_models(self, historical_data, minutes_ahead=None, rebuild=False):
+        """Refit every online model on the full history and compare forecasts.
+        
+        Models that do not exist yet or deviate by more than
+        config.ONLINE_VALIDATION_TOLERANCE are replaced by the refit; with
+        rebuild=True every model is replaced.
+        Returns {"models", "rebuilt", "max_deviation"}, or None on error.
+        """
+        minutes_ahead = minutes_ahead or config.FORECAST_HORIZON_MINUTES
+        try:
+            df = self.preprocess_data(historical_data)
+            if df is None or df.empty:
+                logger.error("No valid data for validating online models")
+                return None
+            
+            target = time.time() + minutes_ahead * 60
+            report = {"models": 0, "rebuilt": 0, "max_deviation": 0.0}
+            for key, refit in self._refit(self._series(df)):
+                model = self.models.get(key)
+                deviation = None
+                if model is not None and model.count:
+                    deviation = abs(model.predict(target) - refit.predict(target))
+                    report["max_deviation"] = max(report["max_deviation"], deviation)
+                if rebuild or deviation is None or deviation > config.ONLINE_VALIDATION_TOLERANCE:
+                    self.models.put(key, refit)
+                    report["rebuilt"] += 1
+                report["models"] += 1
+            
+            logger.info(f"Online models {'rebuilt from' if rebuild else 'validated against'} {len(df)} readings: {report}")
+            return report
+        except Exception as e:
+            logger.error(f"Error validating online models: {e}")
+            return None
+    
+    def ready_devices(self):
+        """Devices with a model of every sensor type fitted on enough readings"""
+        counts = {}
+        for (device_id, sensor_type), model in self.models.items():
+            if model.count >= config.MIN_DEVICE_SAMPLES:
+                counts[device_id] = counts.get(device_id, 0) + 1
+        return [device_id for device_id, count in counts.items() if count == len(SENSOR_TYPES)]
+    
+    def predict_future_values(self, minutes_ahead=30, device_ids=None):
+        """Predict temperature and pressure values of each device for the specified time ahead"""
+        ready = self.ready_devices()
+        if device_ids is not None:
+            wanted = set(device_ids)
+            ready = [device_id for device_id in ready if device_id in wanted]
+        if not ready:
+            logger.error("No device has enough readings for a forecast yet")
             return None
         
         try:
-            # Create feature array for future prediction points
             # For simplicity, we'll predict at 5-minute intervals
-            intervals = range(5, minutes_ahead + 1, 5)
-            future_X = np.array(intervals).reshape(-1, 1)
+            intervals = np.arange(5, minutes_ahead + 1, 5)
+            now = time.time()
             
-            # Predict future values
-            future_temp = self.temp_model.predict(future_X)
-            future_pressure = self.pressure_model.predict(future_X)
+            # Evaluate every device's line at every interval at once
+            forecasts = {}
+            for sensor_type in SENSOR_TYPES:
+                lines = np.array([
+                    (model.origin, *model.coefficients())
+                    for model in (self.models.get((device_id, sensor_type)) for device_id in ready)
+                ])
+                minutes = (now + intervals[np.newaxis, :] * 60 - lines[:, :1]) / 60.0
+                forecasts[f'forecasted_{sensor_type}'] = (lines[:, 1:2] + lines[:, 2:3] * minutes).ravel()
             
-            # Create a result DataFrame with predictions
+            # Create a result DataFrame with predictions, one row per device and interval
             result = pd.DataFrame({
-                'minutes_ahead': intervals,
-                'forecasted_temperature': future_temp,
-                'forecasted_pressure': future_pressure
+                'device_id': np.repeat(ready, len(intervals)),
+                'minutes_ahead': np.tile(intervals, len(ready)),
+                **forecasts
             })
             
             # Add forecast timestamps
-            now = datetime.datetime.now()
-            result['forecast_timestamp'] = [now + datetime.timedelta(minutes=m) for m in intervals]
+            result['forecast_timestamp'] = pd.Timestamp(datetime.datetime.now()) + \
+                pd.to_timedelta(result['minutes_ahead'], unit='m')
             
             return result
         except Exception as e:
@@ -171,4 +552,12 @@ class PredictionEngine:
             return result, max_risk
         except Exception as e:
             logger.error(f"Error evaluating risk: {e}")
-            return None, 'UNKNOWN'
\ No newline at end of file
+            return None, 'UNKNOWN'
+    
+    def device_risk(self, risk_data):
+        """Highest risk level of each device in an evaluated forecast"""
+        if risk_data is None or 'device_id' not in risk_data.columns:
+            return {}
+        names = {level: name for name, level in config.ALERT_LEVELS.items()}
+        levels = risk_data.groupby('device_id')['risk_level'].max()
+        return {device_id: names[level] for device_id, level in levels.items()}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import logging
+import datetime
+from collections import deque
+import config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from MessageBroker.client import MQTTClient, stable_client_id
+    from MessageBroker import topics
+except ImportError:
+    print("Could not import MQTT client. Sensor streaming is unavailable.")
+    MQTTClient = None
+    stable_client_id = None
+    topics = None
+
+logger = logging.getLogger('sensor_stream')
+
+
+class SensorStream:
+    """Sensor readings received directly from the message broker.
+
+    The MQTT thread only flattens each reading into a row like those of the
+    time series DB ({timestamp, device_id, temperature, pressure}) and buffers
+    it; the analysis thread takes the buffered rows with drain(), so the
+    prediction models are only ever touched by that thread. Beyond
+    STREAM_BUFFER_SIZE rows the oldest ones are dropped.
+    """
+
+    def __init__(self, buffer_size=None):
+        self.buffer = deque(maxlen=buffer_size or config.STREAM_BUFFER_SIZE)
+        self.client = None
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.connected
+
+    def start(self):
+        if MQTTClient is None:
+            logger.error("MessageBroker client is not available, cannot stream sensor data")
+            return False
+        try:
+            self.client = MQTTClient(client_id=stable_client_id(config.MQTT_CLIENT_ID))
+            if not self.client.connect(host=config.MQTT_HOST, port=config.MQTT_PORT):
+                logger.error(f"Failed to connect to message broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
+                self.client = None
+                return False
+            self.client.start()
+            # Every instance needs every reading, so no consumer group
+            sensor_filter = topics.sensor_filter(root=config.SENSOR_DATA_TOPIC)
+            self.client.subscribe(sensor_filter, qos=1, callback=self.on_reading, decoded=True)
+            logger.info(f"Streaming sensor data from {sensor_filter}")
+            return True
+        except Exception as e:
+            logger.error(f"Error starting sensor stream: {e}")
+            self.client = None
+            return False
+
+    def stop(self):
+        if self.client is not None:
+            self.client.stop()
+            self.client = None
+
+    def on_reading(self, topic, payload, qos):
+        try:
+            # Payload is decoded by the broker client's codec layer; fall back
+            # to JSON parsing when it could not be decoded
+            if isinstance(payload, dict):
+                data = payload
+            else:
+                if isinstance(payload, bytes):
+                    payload = payload.decode('utf-8')
+                data = json.loads(payload)
+
+            row = {
+                "timestamp": data.get('timestamp', datetime.datetime.now().isoformat()),
+                "device_id": data.get('device_id', 'unknown')
+            }
+            for sensor_type, reading in (data.get('readings') or {}).items():
+                value = reading.get('value') if isinstance(reading, dict) else reading
+                if value is None:
+                    continue
+                try:
+                    row[sensor_type] = float(value)
+                except (ValueError, TypeError):
+                    # Keep the reading's other sensor values
+                    logger.warning(f"Invalid {sensor_type} value on {topic}: {value!r}")
+
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(row)
+            self.received += 1
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Invalid sensor reading on {topic}: {e}")
+
+    def drain(self):
+        """Take all buffered rows, oldest first"""
+        rows = []
+        while True:
+            try:
+                rows.append(self.buffer.popleft())
+            except IndexError:
+                return rows
+
+    def get_status(self):
+        return {
+            "connected": self.connected,
+            "buffered": len(self.buffer),
+            "received": self.received,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+from collections import deque
+import pandas as pd
+import config
+from prediction import utc_timestamps
+
+logger = logging.getLogger('sensor_window')
+
+
+class SensorWindow:
+    """Local sliding window over the last `hours` of sensor readings.
+
+    Readings are kept in timestamp order as DataFrame chunks, one per fetch,
+    so new readings are appended and old ones evicted without copying the
+    rest of the window. A refresh only asks the time series DB for readings
+    from overlap_seconds before the high-water mark (the newest timestamp
+    seen) on, so readings stored late are still picked up; readings already
+    in the window are recognised by (device_id, timestamp) and skipped. The
+    window is rebuilt from a full fetch on the first refresh, after a gap of
+    more than max_gap_seconds between successful refreshes, and when the
+    high-water mark has not advanced for that long (e.g. because the
+    incremental queries come back empty).
+
+    Readings streamed from the message broker are added with append();
+    chunks are then only roughly in order, since readings of different
+    devices can arrive out of order. The time series DB returns readings
+    aggregated into time buckets rather than the sensors' own timestamps,
+    so streamed readings cannot be matched with fetched ones: those up to
+    the newest fetched timestamp are taken as already fetched and skipped,
+    and likewise fetched readings up to the newest streamed one.
+    """
+
+    def __init__(self, hours=None, max_gap_seconds=None, overlap_seconds=None):
+        self.hours = hours or config.DATA_HISTORY_HOURS
+        self.max_gap_seconds = max_gap_seconds or config.WINDOW_MAX_GAP_SECONDS
+        self.overlap = pd.Timedelta(seconds=config.WINDOW_FETCH_OVERLAP_SECONDS
+                                    if overlap_seconds is None else overlap_seconds)
+        self.chunks = deque()
+        self.high_water_mark = None
+        # Newest timestamps fetched from the time series DB and streamed
+        self.fetched_until = None
+        self.streamed_until = None
+        self.last_refresh = None
+        # When the high-water mark last advanced
+        self.last_advance = None
+        self.rebuilds = 0
+        self._frame = None
+
+    def refresh(self, fetch):
+        """Bring the window up to date through fetch(hours=..., since=...).
+
+        Returns the readings not yet in the window as a DataFrame (all of
+        them on a rebuild), or None if the fetch failed.
+        """
+        previous = self.high_water_mark
+        now = time.monotonic()
+        rebuild = previous is None or now - self.last_refresh > self.max_gap_seconds \
+            or now - self.last_advance > self.max_gap_seconds
+        if previous is not None and rebuild and now - self.last_refresh <= self.max_gap_seconds:
+            logger.warning(f"Sensor window high-water mark stuck at {previous} for "
+                           f"{now - self.last_advance:.0f}s, rebuilding")
+        records = fetch(hours=self.hours) if rebuild else fetch(since=previous - self.overlap)
+        if records is None:
+            return None
+
+        chunk = self._to_frame(records)
+        if rebuild:
+            new = chunk
+            self.chunks = deque([chunk] if not chunk.empty else [])
+            self.streamed_until = None
+            self.rebuilds += 1
+            self._frame = None
+            logger.info(f"Sensor window rebuilt with {len(chunk)} readings")
+        else:
+            if self.streamed_until is not None:
+                chunk = chunk[chunk['timestamp'] > self.streamed_until]
+            new = self._unseen(chunk)
+            if not new.empty:
+                self.chunks.append(new)
+                self._frame = None
+
+        if not chunk.empty:
+            newest = chunk['timestamp'].iat[-1]
+            self.high_water_mark = newest if previous is None else max(previous, newest)
+            self.fetched_until = newest if self.fetched_until is None else max(self.fetched_until, newest)
+        if rebuild or self.high_water_mark != previous:
+            self.last_advance = now
+        self._evict()
+        self.last_refresh = now
+        return new
+
+    def append(self, records):
+        """Add streamed readings; those already in the window or covered by a
+        fetch from the time series DB are skipped. Returns the readings added
+        as a DataFrame."""
+        chunk = self._to_frame(records)
+        if self.fetched_until is not None and not chunk.empty:
+            chunk = chunk[chunk['timestamp'] > self.fetched_until]
+        chunk = self._unseen(chunk)
+        now = time.monotonic()
+        if not chunk.empty:
+            self.chunks.append(chunk)
+            self._frame = None
+            newest = chunk['timestamp'].iat[-1]
+            self.streamed_until = newest if self.streamed_until is None else max(self.streamed_until, newest)
+            if self.high_water_mark is None or newest > self.high_water_mark:
+                self.high_water_mark = newest
+                self.last_advance = now
+            self._evict()
+        self.last_refresh = now
+        return chunk
+
+    def _to_frame(self, records):
+        df = pd.DataFrame(records)
+        if df.empty or 'timestamp' not in df.columns:
+            return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns, UTC]')})
+        df['timestamp'] = utc_timestamps(df['timestamp'])
+        return df.sort_values('timestamp', kind='stable', ignore_index=True)
+
+    def _unseen(self, chunk):
+        """The rows of a sorted chunk whose (device_id, timestamp) is not in
+        the window yet; only window rows from the chunk's oldest timestamp on
+        are compared"""
+        if chunk.empty or not self.chunks:
+            return chunk
+        since = chunk['timestamp'].iat[0]
+        seen = [window_chunk.iloc[window_chunk['timestamp'].searchsorted(since):]
+                for window_chunk in self.chunks if window_chunk['timestamp'].iat[-1] >= since]
+        if not seen:
+            return chunk
+        seen = pd.concat(seen, ignore_index=True)
+        return chunk[~self._keys(chunk).isin(self._keys(seen))]
+
+    @staticmethod
+    def _keys(df):
+        device_ids = df['device_id'].astype(str) if 'device_id' in df.columns else pd.Series('', index=df.index)
+        return pd.MultiIndex.from_arrays([device_ids, df['timestamp']])
+
+    def _evict(self):
+        """Drop readings more than `hours` older than the high-water mark"""
+        if self.high_water_mark is None:
+            return
+        cutoff = self.high_water_mark - pd.Timedelta(hours=self.hours)
+        while self.chunks and self.chunks[0]['timestamp'].iat[-1] < cutoff:
+            self.chunks.popleft()
+            self._frame = None
+        if self.chunks:
+            start = self.chunks[0]['timestamp'].searchsorted(cutoff)
+            if start:
+                self.chunks[0] = self.chunks[0].iloc[start:]
+                self._frame = None
+
+    def frame(self):
+        """All readings in the window as one DataFrame, oldest first"""
+        if self._frame is None:
+            if not self.chunks:
+                return pd.DataFrame()
+            self._frame = pd.concat(self.chunks, ignore_index=True)
+            if not self._frame['timestamp'].is_monotonic_increasing:
+                self._frame = self._frame.sort_values('timestamp', kind='stable', ignore_index=True)
+            # Later refreshes append to the compacted window
+            self.chunks = deque([self._frame])
+        return self._frame
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def get_status(self):
+        return {
+            "readings": len(self),
+            "chunks": len(self.chunks),
+            "high_water_mark": self.high_water_mark.isoformat() if self.high_water_mark is not None else None,
+            "rebuilds": self.rebuilds
+        }
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from rule_conditions import SENSOR_VARIABLES
+
+logger = logging.getLogger('batch_evaluator')
+
+
+def _comparisons():
+    return {
+        ">": np.greater, ">=": np.greater_equal,
+        "<": np.less, "<=": np.less_equal,
+        "==": np.equal, "!=": np.not_equal,
+    }
+
+
+def _ranges(op, thresholds, readings):
+    """[lo, hi) index ranges of the sorted thresholds that each reading satisfies."""
+    left = np.searchsorted(thresholds, readings, side='left')
+    right = np.searchsorted(thresholds, readings, side='right')
+    first = np.zeros(len(readings), dtype=np.int64)
+    last = np.full(len(readings), len(thresholds), dtype=np.int64)
+    if op == ">":
+        return [(first, left)]
+    if op == ">=":
+        return [(first, right)]
+    if op == "<":
+        return [(right, last)]
+    if op == "<=":
+        return [(left, last)]
+    if op == "==":
+        return [(left, right)]
+    return [(first, left), (right, last)]
+
+
+class BatchEvaluator:
+    """Evaluates every threshold rule against the latest reading of every device at once.
+
+    Readings are written into a (devices x SENSOR_VARIABLES) array as they
+    arrive; evaluate() compares the rows updated since the previous call
+    against all threshold rules with array operations and returns the
+    triggered (device, rule) pairs. Global and sector rules are matched with
+    a vectorised bisection over their sorted thresholds, device rules one
+    element each. Matches then go through the rule engine's RuleStateTable,
+    so cooldown_scope and hysteresis apply as in per-message evaluation;
+    latched rules are released there by the per-message path.
+
+    Rows of devices removed with remove_device() are reused by new devices,
+    so the arrays stay as large as the most devices seen at once.
+
+    Rules that are not simple thresholds are left to RuleEngine.evaluate_rules.
+    """
+
+    def __init__(self, rule_engine, capacity=1024):
+        if np is None:
+            raise RuntimeError("numpy is required for batch rule evaluation")
+        self.rule_engine = rule_engine
+        self.lock = threading.Lock()
+        self.variables = {name: i for i, name in enumerate(SENSOR_VARIABLES)}
+
+        self.device_rows = {}
+        # Device of each row, None for free rows
+        self.device_ids = []
+        self.free_rows = []
+        self.sector_codes = {}
+        self.sector_ids = []
+        self.values = np.full((capacity, len(SENSOR_VARIABLES)), np.nan)
+        self.device_sectors = np.full(capacity, -1, dtype=np.int64)
+        # Variables written since the last evaluation, per device
+        self.updated = np.zeros((capacity, len(SENSOR_VARIABLES)), dtype=bool)
+
+        self._snapshot = None
+        # Bumped whenever a row changes hands, to re-resolve device rules
+        self._devices_version = 0
+        self._known_devices = 0
+        self._known_sectors = 0
+        self._matrix_rules = []
+        self._device_rules = []
+
+    # Readings
+
+    def update(self, device_id, sector_id, sensor_values):
+        with self.lock:
+            row = self.device_rows.get(device_id)
+            if row is None:
+                row = self._add_device(device_id)
+            self.device_sectors[row] = self._sector_code(sector_id)
+            for name, value in sensor_values.items():
+                column = self.variables.get(name)
+                if column is not None and isinstance(value, (int, float)) and value == value:
+                    self.values[row, column] = value
+                    self.updated[row, column] = True
+
+    def _add_device(self, device_id):
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.device_ids[row] = device_id
+        else:
+            row = len(self.device_ids)
+            if row == len(self.values):
+                self._grow(2 * row)
+            self.device_ids.append(device_id)
+        self.device_rows[device_id] = row
+        self._devices_version += 1
+        return row
+
+    def remove_device(self, device_id):
+        """Free the row of a device, e.g. once it was evicted or its sector lost."""
+        with self.lock:
+            row = self.device_rows.pop(device_id, None)
+            if row is None:
+                return False
+            self.device_ids[row] = None
+            self.values[row] = np.nan
+            self.updated[row] = False
+            self.device_sectors[row] = -1
+            self.free_rows.append(row)
+            self._devices_version += 1
+            return True
+
+    def _grow(self, capacity):
+        grown = len(self.values)
+        self.values = np.vstack([self.values, np.full((capacity - grown, self.values.shape[1]), np.nan)])
+        self.device_sectors = np.concatenate([self.device_sectors, np.full(capacity - grown, -1, dtype=np.int64)])
+        self.updated = np.vstack([self.updated, np.zeros((capacity - grown, self.updated.shape[1]), dtype=bool)])
+
+    def _sector_code(self, sector_id):
+        if sector_id is None:
+            return -1
+        code = self.sector_codes.get(sector_id)
+        if code is None:
+            code = self.sector_codes[sector_id] = len(self.sector_codes)
+            self.sector_ids.append(sector_id)
+        return code
+
+    # Rules
+
+    def _refresh_rules(self):
+        """Rebuild the rule arrays when the rule engine has swapped its snapshot."""
+        snapshot = self.rule_engine.snapshot
+        if snapshot is self._snapshot:
+            return
+        rules = [rule for rule in snapshot.rules if rule.compiled.threshold is not None]
+        matrix_rules = [rule for rule in rules if rule.device_id is None]
+        device_rules = [rule for rule in rules if rule.device_id is not None]
+
+        self._matrix_rules, self._device_rules = matrix_rules, device_rules
+        self._matrix_arrays = self._rule_arrays(matrix_rules)
+        self._device_arrays = self._rule_arrays(device_rules)
+        self._snapshot = snapshot
+
+    def _rule_arrays(self, rules):
+        """Rule columns grouped by operator, {op: (positions, variable columns, thresholds)},
+        and by variable and operator sorted by threshold, {(column, op): (thresholds, positions)}."""
+        by_op = {}
+        for position, rule in enumerate(rules):
+            variable, op, value = rule.compiled.threshold
+            by_op.setdefault(op, []).append((position, self.variables[variable], value))
+        arrays = {
+            op: tuple(np.array(column) for column in zip(*entries))
+            for op, entries in by_op.items()
+        }
+        intervals = {}
+        for op, entries in by_op.items():
+            for position, column, value in entries:
+                intervals.setdefault((column, op), []).append((value, position))
+        for key, entries in intervals.items():
+            entries.sort()
+            intervals[key] = (np.array([value for value, _ in entries], dtype=float),
+                              np.array([position for _, position in entries], dtype=np.int64))
+        return {
+            "ops": arrays,
+            "intervals": intervals,
+            "sector": np.array([self.sector_codes.get(rule.sector_id, -2) if rule.sector_id is not None else -1
+                                for rule in rules], dtype=np.int64),
+            "row": np.array([self.device_rows.get(rule.device_id, -1) for rule in rules], dtype=np.int64),
+        }
+
+    # Evaluation
+
+    def evaluate(self, now=None):
+        """Triggered rules of all devices updated since the last call, in the
+        format of RuleEngine.evaluate_rules."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            # Sector and device codes are resolved when the rule arrays are
+            # built, so rebuild when devices or sectors have changed since
+            if (self._snapshot is not None and
+                    (self._known_devices != self._devices_version or self._known_sectors != len(self.sector_codes))):
+                self._snapshot = None
+            self._refresh_rules()
+            self._known_devices, self._known_sectors = self._devices_version, len(self.sector_codes)
+
+            count = len(self.device_ids)
+            rows = np.flatnonzero(self.updated[:count].any(axis=1))
+            if rows.size == 0:
+                return []
+            fresh = self.updated[rows]
+            self.updated[rows] = False
+
+            pairs = self._evaluate_matrix(rows, fresh) + self._evaluate_device_rules(rows, fresh)
+            pairs.sort(key=lambda pair: (pair[0], pair[1].order))
+            states = self.rule_engine.states
+            pairs = [
+                (row, rule) for row, rule in pairs
+                if states.try_trigger(rule, self.device_ids[row], self._sector_id(row), now)
+            ]
+            triggered = []
+            sensor_data = {}
+            for row, rule in pairs:
+                if row not in sensor_data:
+                    sensor_data[row] = self._sensor_data(row)
+                triggered.append({
+                    "rule_id": rule.id,
+                    "action": rule.action,
+                    "device_id": self.device_ids[row],
+                    "sensor_data": sensor_data[row]
+                })
+
+        if pairs:
+            for _, rule in pairs:
+                rule.record_trigger()
+            logger.info(f"Batch evaluation of {len(rows)} devices triggered {len(pairs)} rules")
+        return triggered
+
+    def _sector_id(self, row):
+        code = self.device_sectors[row]
+        return self.sector_ids[code] if code >= 0 else None
+
+    def _evaluate_matrix(self, rows, fresh):
+        """Global and sector rules: thresholds of each (variable, operator) are
+        sorted, so the rules a reading triggers are one searchsorted range."""
+        rules = self._matrix_rules
+        if not rules:
+            return []
+        arrays = self._matrix_arrays
+        hit_rows, hit_rules = [], []
+        for (column, op), (thresholds, positions) in arrays["intervals"].items():
+            live = np.flatnonzero(fresh[:, column])
+            if live.size == 0:
+                continue
+            readings = self.values[rows[live], column]
+            for lo, hi in _ranges(op, thresholds, readings):
+                counts = hi - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                # Expand each [lo, hi) range into one entry per rule
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                hit_rows.append(np.repeat(live, counts))
+                hit_rules.append(positions[np.repeat(lo, counts) + offsets])
+        if not hit_rows:
+            return []
+
+        device_rows = rows[np.concatenate(hit_rows)]
+        hit_rules = np.concatenate(hit_rules)
+        # Sector rules only apply to devices of their sector
+        sectors = arrays["sector"][hit_rules]
+        keep = (sectors == -1) | (sectors == self.device_sectors[device_rows])
+        device_rows, hit_rules = device_rows[keep], hit_rules[keep]
+        return [(row, rules[i]) for row, i in zip(device_rows.tolist(), hit_rules.tolist())]
+
+    def _evaluate_device_rules(self, rows, fresh):
+        rules = self._device_rules
+        if not rules:
+            return []
+        arrays = self._device_arrays
+        rule_rows = arrays["row"]
+        # Map every device row to its position in rows, -1 if not updated
+        position_of = np.full(len(self.values), -1, dtype=np.int64)
+        position_of[rows] = np.arange(len(rows))
+
+        hits = np.zeros(len(rules), dtype=bool)
+        for op, (positions, columns, thresholds) in arrays["ops"].items():
+            targets = position_of[np.maximum(rule_rows[positions], 0)]
+            live = (rule_rows[positions] >= 0) & (targets >= 0)
+            live[live] = fresh[targets[live], columns[live]]
+            readings = np.full(len(positions), np.nan)
+            readings[live] = self.values[rule_rows[positions][live], columns[live]]
+            hits[positions] = _comparisons()[op](readings, thresholds) & live
+
+        positions = np.flatnonzero(hits)
+        return [(int(rule_rows[i]), rules[i]) for i in positions.tolist()]
+
+    def _sensor_data(self, row):
+        return {
+            name: float(self.values[row, column])
+            for name, column in self.variables.items()
+            if not np.isnan(self.values[row, column])
+        }
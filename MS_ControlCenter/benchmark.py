@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency benchmark for ControlLogic.process_sensor_data and the rule engine.
+
+Sensor readings are replayed through the real ControlLogic, with its MQTT
+handler replaced by an in-process stand-in that records published valve
+commands and alerts (and can answer them with valve statuses):
+
+    python benchmark.py --devices 5000 --messages 100000
+    python benchmark.py --rate 20000 --burst 500 --device-rules 2000
+    python benchmark.py --replay readings.jsonl --json results.json
+    python benchmark.py --compare results.json --max-regression 10
+
+Latency is measured from each message's scheduled arrival time, so with
+--rate/--burst it includes the time spent queued behind earlier messages.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import config
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class StandInMQTTHandler:
+    """Replaces MQTTHandler: counts what ControlLogic publishes instead of sending it."""
+
+    def __init__(self, control_logic=None, acknowledge=False):
+        self.control_logic = control_logic
+        self.acknowledge = acknowledge
+        self.valve_commands = 0
+        self.alerts = 0
+        self.spans = 0
+
+    def start(self):
+        return True
+
+    def stop(self):
+        return True
+
+    def set_sectors(self, sectors):
+        return True
+
+    def publish_valve_command(self, sector_id, action, command_id=None):
+        self.valve_commands += 1
+        if self.acknowledge and self.control_logic:
+            # Behave like a valve handler confirming the command right away
+            self.control_logic.process_valve_status({
+                "sector_id": sector_id,
+                "valve_state": "closed" if action == "close" else "open",
+                "command_id": command_id,
+                "timestamp": datetime.now().isoformat()
+            })
+        return True
+
+    def publish_alert(self, message, severity="warning"):
+        self.alerts += 1
+        return True
+
+    def publish_spans(self, topic, message):
+        self.spans += 1
+        return True
+
+    def publish_event(self, event, **details):
+        return True
+
+
+def synthetic_stream(args):
+    """Readings shaped like the sensor simulator's, with a share above the thresholds."""
+    rng = random.Random(args.seed)
+    devices = [(f"device_{i}", f"S{i % args.sectors}") for i in range(args.devices)]
+    timestamp = datetime.now().isoformat()
+    for i in range(args.messages):
+        device_id, sector_id = devices[i % len(devices)]
+        spike = rng.random() < args.spike_rate
+        temperature = round(rng.gauss(config.TEMPERATURE_THRESHOLD + 5 if spike else 25.0, 3.0), 2)
+        pressure = round(rng.gauss(1013.0, 10.0), 2)
+        yield {
+            "timestamp": timestamp,
+            "device_id": device_id,
+            "sector_id": sector_id,
+            "device_info": {"device_id": device_id, "sector_id": sector_id},
+            "readings": {
+                "temperature": {"value": temperature, "unit": "celsius"},
+                "pressure": {"value": pressure, "unit": "hPa"}
+            }
+        }
+
+
+def replay_stream(path, limit):
+    """Messages from a JSON-lines file: one payload per line, or {"topic": ..., "payload": ...}."""
+    count = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            message = json.loads(line)
+            if "payload" in message and "readings" not in message:
+                message = message["payload"]
+            yield message
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+def add_rules(control_logic, args):
+    rng = random.Random(args.seed)
+    for i in range(args.device_rules):
+        control_logic.add_rule({
+            "id": f"bench_device_{i}",
+            "description": "Benchmark per-device threshold rule",
+            "condition": f"pressure > {rng.uniform(1030, 1100):.1f}",
+            "action": "close_valve",
+            "device_id": f"device_{i % args.devices}"
+        })
+    for i in range(args.window_rules):
+        control_logic.add_rule({
+            "id": f"bench_window_{i}",
+            "description": "Benchmark rolling-window rule",
+            "condition": f"avg(temperature, {10 + i}s) > TEMPERATURE_THRESHOLD",
+            "action": "close_valve"
+        })
+
+
+def run(args, messages):
+    # Imported here so the config overrides in main() apply before ControlLogic reads them
+    from control_logic import ControlLogic
+
+    control_logic = ControlLogic()
+    control_logic.mqtt_handler = StandInMQTTHandler(control_logic, acknowledge=args.ack)
+    add_rules(control_logic, args)
+
+    for message in messages[:args.warmup]:
+        control_logic.process_sensor_data(message)
+
+    latencies = []
+    gc_before = [stats["collections"] for stats in gc.get_stats()]
+    if args.allocations:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+
+    interval = args.burst / args.rate if args.rate else 0
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        # Messages arrive in bursts of --burst every --burst/--rate seconds
+        arrival = start + (i // args.burst) * interval if args.rate else time.perf_counter()
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        control_logic.process_sensor_data(message)
+        if control_logic.batch_evaluator and (i + 1) % args.burst == 0:
+            control_logic.handle_triggered_rules(control_logic.batch_evaluator.evaluate())
+        latencies.append(time.perf_counter() - arrival)
+    elapsed = time.perf_counter() - start
+
+    allocations = None
+    if args.allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')[:5]
+        tracemalloc.stop()
+        allocations = {
+            "net_kib": round(current / 1024, 1),
+            "peak_kib": round(peak / 1024, 1),
+            "top": [str(stat) for stat in top]
+        }
+    gc_after = [stats["collections"] for stats in gc.get_stats()]
+
+    latencies_us = sorted(value * 1e6 for value in latencies)
+    handler = control_logic.mqtt_handler
+    return {
+        "messages": len(messages),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_msg_s": round(len(messages) / elapsed, 1) if elapsed else None,
+        "latency_us": {
+            "p50": round(percentile(latencies_us, 50), 1),
+            "p95": round(percentile(latencies_us, 95), 1),
+            "p99": round(percentile(latencies_us, 99), 1),
+            "max": round(latencies_us[-1], 1),
+            "mean": round(sum(latencies_us) / len(latencies_us), 1)
+        },
+        "published": {
+            "valve_commands": handler.valve_commands,
+            "alerts": handler.alerts
+        },
+        "rules": len(control_logic.rule_engine.rules),
+        "devices_tracked": len(control_logic.sensor_state),
+        "gc_collections": [after - before for before, after in zip(gc_before, gc_after)],
+        "allocations": allocations
+    }
+
+
+def version_info():
+    info = {"python": platform.python_version(), "timestamp": datetime.now().isoformat()}
+    try:
+        info["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info["commit"] = None
+    return info
+
+
+def compare(results, baseline_path, max_regression):
+    """Print changes against a previous result file; return False on a regression."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["result"]
+    result = results["result"]
+    checks = [
+        ("throughput_msg_s", baseline["throughput_msg_s"], result["throughput_msg_s"], True),
+        ("latency p99 us", baseline["latency_us"]["p99"], result["latency_us"]["p99"], False),
+    ]
+    ok = True
+    for name, before, after, higher_is_better in checks:
+        change = (after - before) / before * 100 if before else 0.0
+        regression = -change if higher_is_better else change
+        flag = ""
+        if max_regression is not None and regression > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name}: {before} -> {after} ({change:+.1f}%){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ControlLogic sensor processing benchmark')
+    parser.add_argument('--replay', help='JSON-lines file of recorded sensor/readings messages')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--sectors', type=int, default=10)
+    parser.add_argument('--spike-rate', type=float, default=0.01, help='Share of readings above the temperature threshold')
+    parser.add_argument('--device-rules', type=int, default=0, help='Extra per-device threshold rules')
+    parser.add_argument('--window-rules', type=int, default=0, help='Extra rolling-window rules')
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second (0 = as fast as possible)')
+    parser.add_argument('--burst', type=int, default=1, help='Messages arriving together at each tick of --rate')
+    parser.add_argument('--batch-interval', type=float, default=0,
+                        help='Enable batch rule evaluation, run after every --burst messages')
+    parser.add_argument('--ack', action='store_true', help='Answer valve commands with valve statuses')
+    parser.add_argument('--warmup', type=int, default=1000)
+    parser.add_argument('--allocations', action='store_true', help='Trace allocations (slows the run)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', dest='json_path', help='Write results to this file ("-" for stdout)')
+    parser.add_argument('--compare', help='Previous --json result to compare against')
+    parser.add_argument('--max-regression', type=float, help='Exit with status 1 if a metric regresses by more than this percentage')
+    args = parser.parse_args()
+    args.burst = max(1, args.burst)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    config.RULE_BATCH_INTERVAL = args.batch_interval
+    # Benchmark rules must not end up in the service's rules file
+    config.RULES_PERSISTENCE_ENABLED = False
+
+    if args.replay:
+        messages = list(replay_stream(args.replay, args.messages))
+    else:
+        messages = list(synthetic_stream(args))
+
+    results = {"config": vars(args).copy(), "version": version_info(), "result": run(args, messages)}
+
+    if args.json_path == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.json_path != '-':
+        result = results["result"]
+        latency = result["latency_us"]
+        print(f"{result['messages']} msgs, {result['throughput_msg_s']} msg/s, latency us "
+              f"p50={latency['p50']:.0f} p95={latency['p95']:.0f} p99={latency['p99']:.0f} max={latency['max']:.0f}, "
+              f"{result['published']['valve_commands']} valve commands, {result['published']['alerts']} alerts")
+        if result["allocations"]:
+            print(f"allocations: net {result['allocations']['net_kib']} KiB, peak {result['allocations']['peak_kib']} KiB")
+
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
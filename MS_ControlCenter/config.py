@@ -21,13 +21,71 @@ MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
 
 SENSOR_DATA_TOPIC = "sensor/readings"
+# Sectors whose readings this instance handles; empty for all sectors.
+# Rule windows, cooldowns and the latest-state store are kept per device, so
+# all readings of a device must reach the same instance: several instances
+# split the plant by sector (here or with PARTITIONING_ENABLED), never
+# through an MQTT consumer group, which hands out messages round-robin
+SENSOR_SECTORS = []
+
+# Partitioned deployment: instances join PARTITION_GROUP in the Resource
+# Catalog, which spreads PARTITION_SECTORS (as reported by all members) over
+# them and rebalances when an instance joins, leaves or stops sending
+# heartbeats. Each instance then only subscribes to its own sectors' readings,
+# replacing SENSOR_SECTORS
+PARTITIONING_ENABLED = False
+PARTITION_GROUP = "control_center"
+PARTITION_SECTORS = ["A", "B"]
+PARTITION_HEARTBEAT_INTERVAL = 10
+
+# Seconds between batch evaluations of threshold rules over the latest
+# readings of all devices (requires numpy); 0 evaluates every reading as it arrives
+RULE_BATCH_INTERVAL = 0.0
+
+# Default key of rule cooldowns: "device" (each device cools down on its own),
+# "sector" or "rule" (one cooldown for all devices); rules may override it
+# with "cooldown_scope", and set "cooldown" (seconds) and "hysteresis"
+RULE_COOLDOWN_SCOPE = "device"
+# Seconds after which cooldown/hysteresis state of a silent device is dropped
+RULE_STATE_TTL = 3600
+
+# Most readings kept per device in each rolling window of the rule
+# functions avg(), min(), max(), delta() and slope()
+RULE_WINDOW_MAX_SAMPLES = 512
+
+# Devices silent for longer than this many seconds are dropped from the
+# latest-state store; the store never holds more than the maximum
+SENSOR_STATE_TTL = 900
+SENSOR_STATE_MAX_DEVICES = 100000
+# Device states returned per page by /api/status (ControlLogic.get_status);
+# clients can ask for up to STATUS_MAX_PAGE_SIZE with ?limit=
+STATUS_PAGE_SIZE = 100
+STATUS_MAX_PAGE_SIZE = 1000
+
+# Seconds between exports of recorded latency spans to system/traces
+TRACE_EXPORT_INTERVAL = 5.0
 VALVE_CONTROL_TOPIC = "valve/control"
+# Seconds to wait for a valve status confirming a command before resending it,
+# and how many times it is resent; repeated requests in between are coalesced
+VALVE_COMMAND_ACK_TIMEOUT = 5.0
+VALVE_COMMAND_MAX_RETRIES = 3
 VALVE_STATUS_TOPIC = "valve/status"
 SYSTEM_EVENTS_TOPIC = "system/events"
+# Seconds between liveness pings on SYSTEM_EVENTS_TOPIC/ping
+PING_INTERVAL = 30
 
 TEMPERATURE_THRESHOLD = 75.0
 PRESSURE_THRESHOLD = 1050.0
 
+# Opt-in: rules are persisted here on every change and loaded at startup.
+# DEFAULT_RULES are then only used (and written out) when the file does not
+# exist yet, so later edits of DEFAULT_RULES are ignored until it is removed
+RULES_PERSISTENCE_ENABLED = False
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+# Conditions may also use rolling windows of a device's readings, e.g.
+# "avg(temperature, 30s) > TEMPERATURE_THRESHOLD", "delta(pressure, 10s) > 20"
+# or "above_for(temperature, TEMPERATURE_THRESHOLD, 20s)"; see rule_conditions
 DEFAULT_RULES = [
     {
         "id": "high_temperature",
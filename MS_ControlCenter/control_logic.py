@@ -9,25 +9,66 @@ import requests
 
 import config
 from rule_engine import RuleEngine
-from mqtt_handler import MQTTHandler
+from batch_evaluator import BatchEvaluator
+from valve_commands import PendingCommandTable
+from sensor_state import SensorStateStore
+from sector_ownership import SectorOwnership
+from registration import get_local_ip
+from mqtt_handler import MQTTHandler, tracing, topics
 
 logger = logging.getLogger('control_logic')
 
 class ControlLogic:
     def __init__(self):
         self.rule_engine = RuleEngine()
-        self.mqtt_handler = MQTTHandler(
-            sensor_callback=self.process_sensor_data,
-            valve_status_callback=self.process_valve_status
-        )
+        self.mqtt_handler = MQTTHandler(handlers={
+            "sensor_data": self.process_sensor_data,
+            "valve_status": self.process_valve_status
+        })
         self.valve_states = {}
-        self.sensor_data_cache = {}
+        self.valve_commands = PendingCommandTable()
+        self._stop_retries = threading.Event()
+        self._retry_thread = None
+        # Silent devices and those of lost sectors are evicted, together with
+        # their rule windows and batch evaluation rows
+        self.sensor_state = SensorStateStore(on_evict=self._forget_device)
+        self.tracer = tracing.SpanCollector("control_center")
+        self.batch_evaluator = None
+        self._batch_thread = None
+        self._stop_batch = threading.Event()
+        if config.RULE_BATCH_INTERVAL > 0:
+            try:
+                self.batch_evaluator = BatchEvaluator(self.rule_engine)
+            except RuntimeError as e:
+                logger.error(f"Batch rule evaluation disabled: {e}")
+        # Sectors this instance owns in a partitioned deployment; None handles every reading
+        self.owned_sectors = None
+        self.ownership = None
+        if config.PARTITIONING_ENABLED:
+            self.owned_sectors = frozenset()
+            self.ownership = SectorOwnership(
+                self.mqtt_handler.client_id,
+                on_change=self.set_owned_sectors,
+                endpoints={"status": f"http://{get_local_ip()}:{config.API_PORT}/api/status"}
+            )
         
     def start(self):
         logger.info("Starting Control Logic")
+        if self.ownership:
+            # Learn the owned sectors before subscribing to their readings
+            self.ownership.start()
+        if self.batch_evaluator and self._batch_thread is None:
+            self._batch_thread = threading.Thread(target=self._run_batch_evaluation, daemon=True)
+            self._batch_thread.start()
+        if self._retry_thread is None:
+            self._retry_thread = threading.Thread(target=self._run_command_retries, daemon=True)
+            self._retry_thread.start()
         mqtt_success = self.mqtt_handler.start()
         if mqtt_success:
             logger.info("MQTT handler connected successfully")
+            self.mqtt_handler.publish_event("control_center_start")
+            if self.tracer:
+                self.tracer.start_exporter(self.mqtt_handler.publish_spans, interval=config.TRACE_EXPORT_INTERVAL)
             return True
         else:
             logger.error("Failed to connect to MQTT broker, control logic will run with limited functionality")
@@ -35,15 +76,48 @@ class ControlLogic:
         
     def stop(self):
         logger.info("Stopping Control Logic")
+        self._stop_batch.set()
+        self._stop_retries.set()
+        if self.tracer:
+            self.tracer.stop_exporter()
+        if self.ownership:
+            self.ownership.stop()
+        self.mqtt_handler.publish_event("control_center_stop")
         return self.mqtt_handler.stop()
         
+    def _forget_device(self, device_id):
+        self.rule_engine.windows.remove_device(device_id)
+        if self.batch_evaluator:
+            self.batch_evaluator.remove_device(device_id)
+        
+    def set_owned_sectors(self, sectors):
+        """Switch to a new set of owned sectors, dropping the state of sectors
+        that were handed to another instance."""
+        sectors = frozenset(sectors)
+        lost = (self.owned_sectors or frozenset()) - sectors
+        self.owned_sectors = sectors
+        self.mqtt_handler.set_sectors(sectors)
+        for sector_id in lost:
+            self.sensor_state.remove_sector(sector_id)
+            self.valve_commands.forget_sector(sector_id)
+        logger.info(f"Now owning sectors {sorted(sectors)}" + (f", released {sorted(lost)}" if lost else ""))
+        
     def process_sensor_data(self, data):
+        trace_context = tracing.extract(data) if self.tracer else None
+        if trace_context:
+            self.tracer.record_transit("mqtt.sensor_to_control", trace_context)
+            tracing.activate(trace_context)
+            started = time.perf_counter()
         try:
             device_id = data.get('device_id', 'unknown')
             readings = data.get('readings', {})
             timestamp = data.get('timestamp', datetime.now().isoformat())
             
-            sector_id = data.get('sector_id', 'A')  # Default to sector A if not specified
+            # Sensors report their sector in device_info; default to sector A if not specified
+            sector_id = topics.reading_route(data)[0] or 'A'
+            if self.owned_sectors is not None and sector_id not in self.owned_sectors:
+                # In flight while the sector was handed to another instance
+                return
             
             temperature = readings.get('temperature', {}).get('value')
             pressure = readings.get('pressure', {}).get('value')
@@ -58,24 +132,36 @@ class ControlLogic:
             if pressure is not None:
                 sensor_values['pressure'] = pressure
                 
-            # Cache the sensor data
-            self.sensor_data_cache[device_id] = {
-                'sector_id': sector_id,
-                'timestamp': timestamp,
-                'values': sensor_values
-            }
+            # Keep the latest state of the device
+            self.sensor_state.update(device_id, sector_id, timestamp, sensor_values)
             
             logger.debug(f"Processing sensor data: Device {device_id}, Temp: {temperature}, Pressure: {pressure}")
             
-            # Evaluate rules based on sensor data
-            triggered_rules = self.rule_engine.evaluate_rules(device_id, sensor_values)
+            # Evaluate rules based on sensor data; in batch mode threshold rules
+            # are evaluated for all devices at once by _run_batch_evaluation
+            if self.batch_evaluator:
+                self.batch_evaluator.update(device_id, sector_id, sensor_values)
+                triggered_rules = self.rule_engine.evaluate_rules(device_id, sensor_values, sector_id, thresholds=False)
+            else:
+                triggered_rules = self.rule_engine.evaluate_rules(device_id, sensor_values, sector_id)
             
             # Process any triggered rules
             self.handle_triggered_rules(triggered_rules)
                 
         except Exception as e:
             logger.error(f"Error processing sensor data: {e}")
+        finally:
+            if trace_context:
+                tracing.activate(None)
+                self.tracer.record("control.process", (time.perf_counter() - started) * 1000, trace_context["trace_id"])
             
+    def _run_batch_evaluation(self):
+        while not self._stop_batch.wait(config.RULE_BATCH_INTERVAL):
+            try:
+                self.handle_triggered_rules(self.batch_evaluator.evaluate())
+            except Exception as e:
+                logger.error(f"Error in batch rule evaluation: {e}")
+
     def process_valve_status(self, data):
         try:
             sector_id = data.get('sector_id', 'unknown')
@@ -84,10 +170,20 @@ class ControlLogic:
             
             logger.info(f"Received valve status update: Sector {sector_id}, State: {valve_state}")
             
+            trace_context = tracing.extract(data) if self.tracer else None
+            if trace_context:
+                self.tracer.record_transit("mqtt.valve_status_to_control", trace_context)
+                self.tracer.record_since_origin("loop.end_to_end", trace_context)
+            
             self.valve_states[sector_id] = {
                 'state': valve_state,
                 'last_updated': timestamp
             }
+            
+            command = self.valve_commands.acknowledge(sector_id, valve_state, data.get('command_id'))
+            if command:
+                logger.debug(f"Valve command {command.command_id} for sector {sector_id} acknowledged "
+                             f"({command.coalesced} duplicate requests coalesced)")
                 
         except Exception as e:
             logger.error(f"Error processing valve status: {e}")
@@ -99,8 +195,8 @@ class ControlLogic:
             device_id = rule_data['device_id']
             sensor_data = rule_data['sensor_data']
             
-            # Get the sector ID from the cached data
-            sector_id = self.sensor_data_cache.get(device_id, {}).get('sector_id', 'A')
+            # Get the sector ID from the device's latest state
+            sector_id = self.sensor_state.sector_of(device_id) or 'A'
             
             logger.info(f"Handling triggered rule {rule_id} for device {device_id} in sector {sector_id}")
             
@@ -115,14 +211,15 @@ class ControlLogic:
     def close_valve(self, sector_id, rule_id, sensor_data):
         logger.info(f"Closing valve for sector {sector_id} due to rule {rule_id}")
         
-        # Check if the valve is already closed
+        # Nothing to send if the valve is already closed or a close command is in flight
         current_state = self.valve_states.get(sector_id, {}).get('state')
-        if current_state == 'closed':
-            logger.info(f"Valve for sector {sector_id} is already closed")
+        command = self.valve_commands.request(sector_id, "close", current_state)
+        if command is None:
+            logger.info(f"Valve for sector {sector_id} is already closed or closing")
             return True
             
         # Send command to close valve
-        success = self.mqtt_handler.publish_valve_command(sector_id, "close")
+        success = self.mqtt_handler.publish_valve_command(sector_id, "close", command.command_id)
         
         # Send alert about valve closure
         reason = self.generate_alert_message(rule_id, sensor_data)
@@ -136,14 +233,15 @@ class ControlLogic:
     def open_valve(self, sector_id, rule_id):
         logger.info(f"Opening valve for sector {sector_id} due to rule {rule_id}")
         
-        # Check if the valve is already open
+        # Nothing to send if the valve is already open or an open command is in flight
         current_state = self.valve_states.get(sector_id, {}).get('state')
-        if current_state == 'open':
-            logger.info(f"Valve for sector {sector_id} is already open")
+        command = self.valve_commands.request(sector_id, "open", current_state)
+        if command is None:
+            logger.info(f"Valve for sector {sector_id} is already open or opening")
             return True
             
         # Send command to open valve
-        success = self.mqtt_handler.publish_valve_command(sector_id, "open")
+        success = self.mqtt_handler.publish_valve_command(sector_id, "open", command.command_id)
         
         # Send alert about valve opening
         self.mqtt_handler.publish_alert(
@@ -153,6 +251,17 @@ class ControlLogic:
         
         return success
         
+    def _run_command_retries(self):
+        interval = min(1.0, config.VALVE_COMMAND_ACK_TIMEOUT / 2)
+        while not self._stop_retries.wait(interval):
+            try:
+                for command in self.valve_commands.due_retries():
+                    logger.warning(f"Retrying valve command {command.action} for sector {command.sector_id} "
+                                   f"(attempt {command.attempts})")
+                    self.mqtt_handler.publish_valve_command(command.sector_id, command.action, command.command_id)
+            except Exception as e:
+                logger.error(f"Error retrying valve commands: {e}")
+            
     def generate_alert_message(self, rule_id, sensor_data):
         if rule_id == 'high_temperature':
             return f"Temperature too high: {sensor_data.get('temperature', '?')}°C (threshold: {config.TEMPERATURE_THRESHOLD}°C)"
@@ -161,11 +270,18 @@ class ControlLogic:
         else:
             return f"Rule {rule_id} triggered"
             
-    def get_status(self):
+    def get_status(self, sector_id=None, offset=0, limit=config.STATUS_PAGE_SIZE):
+        """Service status with one page of device states, optionally of a single sector."""
         return {
             'valve_states': self.valve_states,
-            'sensor_data': self.sensor_data_cache,
-            'rules': self.rule_engine.get_rules()
+            'valve_commands': self.valve_commands.get_status(),
+            'sensor_summary': self.sensor_state.summary(),
+            'sensor_data': self.sensor_state.query(sector_id, offset, limit),
+            'partition': self.ownership.get_status() if self.ownership else None,
+            'rules_version': self.rule_engine.version,
+            'rules': self.rule_engine.get_rules(),
+            'rule_windows': self.rule_engine.windows.get_stats(),
+            'latency': self.tracer.summary() if self.tracer else {}
         }
         
     def add_rule(self, rule_config):
@@ -174,5 +290,11 @@ class ControlLogic:
     def remove_rule(self, rule_id):
         return self.rule_engine.remove_rule(rule_id)
         
+    def replace_rules(self, rule_configs):
+        return self.rule_engine.replace_rules(rule_configs)
+        
+    def reload_rules(self):
+        return self.rule_engine.reload_rules()
+        
     def get_rules(self):
         return self.rule_engine.get_rules()
\ No newline at end of file
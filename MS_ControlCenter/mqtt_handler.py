@@ -8,36 +8,40 @@ import logging
 from datetime import datetime
 import threading
 
-broker_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'messagebroker'))
-sys.path.insert(0, broker_path)
+# Add the parent directory to sys.path so MessageBroker can be found
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
 
 try:
-    from messagebroker.client import MQTTClient
-except ImportError:
-    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-    try:
-        from messagebroker.client import MQTTClient
-    except ImportError:
-        print("Could not import MQTT client. Running in standalone mode.")
-        MQTTClient = None
+    from MessageBroker.client import MQTTClient, stable_client_id
+    from MessageBroker import topics, tracing
+except ImportError as e:
+    # The Control Center cannot do anything without its MQTT connection
+    print(f"Error: Could not import message broker client from {os.path.join(parent_dir, 'MessageBroker')}: {e}")
+    sys.exit(1)
 
 import config
 
 logger = logging.getLogger('mqtt_handler')
 
 class MQTTHandler:
-    def __init__(self, sensor_callback=None, valve_status_callback=None):
+    """The Control Center's only MQTT connection.
+
+    Each message is decoded once by the client and passed to the handler
+    registered for its kind in the dispatch table:
+    "sensor_data" (sensor/readings/<sector>/<device>) and "valve_status".
+    """
+
+    def __init__(self, handlers=None):
         self.client = None
-        self.client_id = f"{config.MQTT_CLIENT_ID}_{int(time.time())}"
-        self.sensor_callback = sensor_callback
-        self.valve_status_callback = valve_status_callback
+        self.client_id = stable_client_id(config.MQTT_CLIENT_ID)
+        self.handlers = dict(handlers or {})
         self.running = False
+        # Owned sectors in a partitioned deployment; None uses config.SENSOR_SECTORS
+        self.sectors = None
+        self.sensor_filters = []
         
     def connect(self):
-        if MQTTClient is None:
-            logger.error("MQTTClient not available")
-            return False
-            
         try:
             self.client = MQTTClient(client_id=self.client_id)
             success = self.client.connect(
@@ -63,51 +67,76 @@ class MQTTHandler:
             
         logger.info("Subscribing to MQTT topics")
         
-        if self.sensor_callback:
-            self.client.subscribe(
-                config.SENSOR_DATA_TOPIC, 
-                qos=1, 
-                callback=self._on_sensor_data
-            )
-            logger.info(f"Subscribed to sensor data topic: {config.SENSOR_DATA_TOPIC}")
+        if "sensor_data" in self.handlers:
+            self.sensor_filters = []
+            for sensor_filter in self._sensor_filters():
+                self._subscribe_sensor_data(sensor_filter)
             
-        if self.valve_status_callback:
+        if "valve_status" in self.handlers:
             self.client.subscribe(
                 config.VALVE_STATUS_TOPIC,
                 qos=1,
-                callback=self._on_valve_status
+                callback=self._on_valve_status,
+                decoded=True
             )
             logger.info(f"Subscribed to valve status topic: {config.VALVE_STATUS_TOPIC}")
             
         return True
             
-    def _on_sensor_data(self, topic, payload, qos):
-        logger.debug(f"Received sensor data on topic {topic}")
-        try:
-            if isinstance(payload, bytes):
-                payload = payload.decode('utf-8')
-                
-            data = json.loads(payload)
+    def _sensor_filters(self):
+        if self.sectors is not None:
+            return [topics.sensor_filter(sector_id, root=config.SENSOR_DATA_TOPIC) for sector_id in sorted(self.sectors)]
+        # Only the configured sectors' readings, or every sector
+        return [topics.sensor_filter(sector_id, root=config.SENSOR_DATA_TOPIC)
+                for sector_id in config.SENSOR_SECTORS] or [topics.sensor_filter(root=config.SENSOR_DATA_TOPIC)]
+            
+    def _subscribe_sensor_data(self, sensor_filter):
+        # No consumer group: it would split one device's readings over instances
+        self.client.subscribe(
+            sensor_filter, 
+            qos=1, 
+            callback=self._on_sensor_data,
+            decoded=True
+        )
+        self.sensor_filters.append(sensor_filter)
+        logger.info(f"Subscribed to sensor data topic: {sensor_filter}")
+            
+    def set_sectors(self, sectors):
+        """Limit sensor data subscriptions to sectors, changing only the
+        subscriptions of sectors that were gained or lost."""
+        self.sectors = set(sectors)
+        if self.client is None or "sensor_data" not in self.handlers:
+            return True
             
-            if self.sensor_callback:
-                self.sensor_callback(data)
-        except Exception as e:
-            logger.error(f"Error processing sensor data: {e}")
+        wanted = self._sensor_filters()
+        for sensor_filter in [f for f in self.sensor_filters if f not in wanted]:
+            self.client.unsubscribe(sensor_filter)
+            self.sensor_filters.remove(sensor_filter)
+            logger.info(f"Unsubscribed from sensor data topic: {sensor_filter}")
+        for sensor_filter in wanted:
+            if sensor_filter not in self.sensor_filters:
+                self._subscribe_sensor_data(sensor_filter)
+        return True
+            
+    def _on_sensor_data(self, topic, payload, qos):
+        self._dispatch("sensor_data", topic, payload)
             
     def _on_valve_status(self, topic, payload, qos):
-        logger.debug(f"Received valve status on topic {topic}")
+        self._dispatch("valve_status", topic, payload)
+            
+    def _dispatch(self, kind, topic, payload):
+        logger.debug(f"Received {kind} on topic {topic}")
         try:
-            if isinstance(payload, bytes):
-                payload = payload.decode('utf-8')
-                
-            data = json.loads(payload)
+            # Subscriptions are decoded by the client; raw payloads only from legacy codecs
+            data = payload if isinstance(payload, dict) else json.loads(payload)
             
-            if self.valve_status_callback:
-                self.valve_status_callback(data)
+            handler = self.handlers.get(kind)
+            if handler:
+                handler(data)
         except Exception as e:
-            logger.error(f"Error processing valve status: {e}")
+            logger.error(f"Error processing {kind}: {e}")
             
-    def publish_valve_command(self, sector_id, action):
+    def publish_valve_command(self, sector_id, action, command_id=None):
         if self.client is None:
             logger.error("MQTT client not initialized")
             return False
@@ -118,15 +147,37 @@ class MQTTHandler:
             "timestamp": datetime.now().isoformat(),
             "source": "control_center"
         }
+        if command_id:
+            # Retries reuse the ID so the valve handler can drop duplicates
+            message["command_id"] = command_id
+        # Carries the trace of the reading that triggered the command
+        tracing.inject(message)
         
         logger.info(f"Publishing valve command: {action} for sector {sector_id}")
         
         return self.client.publish(
-            config.VALVE_CONTROL_TOPIC,
-            json.dumps(message),
+            topics.valve_control_topic(sector_id, root=config.VALVE_CONTROL_TOPIC),
+            message,
             qos=1
         )
         
+    def publish_spans(self, topic, message):
+        if self.client is None:
+            return False
+        return self.client.publish(topic, message, qos=0)
+        
+    def publish_event(self, event, topic=config.SYSTEM_EVENTS_TOPIC, qos=1, **details):
+        if self.client is None:
+            return False
+            
+        message = {
+            "event": event,
+            "timestamp": datetime.now().isoformat(),
+            "client_id": self.client_id,
+            **details
+        }
+        return self.client.publish(topic, message, qos=qos)
+        
     def publish_alert(self, message, severity="warning"):
         if self.client is None:
             logger.error("MQTT client not initialized")
@@ -143,7 +194,7 @@ class MQTTHandler:
         
         return self.client.publish(
             f"{config.SYSTEM_EVENTS_TOPIC}/alerts",
-            json.dumps(alert),
+            alert,
             qos=1
         )
         
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import re
+import ast
+
+import config
+
+# Sensor values a condition may reference
+SENSOR_VARIABLES = ("temperature", "pressure")
+
+# Named constants a condition may reference; folded in at compile time
+CONSTANTS = {
+    "TEMPERATURE_THRESHOLD": config.TEMPERATURE_THRESHOLD,
+    "PRESSURE_THRESHOLD": config.PRESSURE_THRESHOLD,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or,
+    ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+    ast.Compare, ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq,
+    ast.Name, ast.Load, ast.Constant,
+)
+
+# Rolling-window functions of one sensor variable and a duration,
+# e.g. "avg(temperature, 30s)", mapped to the RollingWindow method
+WINDOW_FUNCTIONS = {
+    "avg": "mean",
+    "min": "minimum",
+    "max": "maximum",
+    "delta": "delta",
+    "slope": "slope",
+}
+
+# Functions of a variable, a threshold and a duration,
+# e.g. "above_for(temperature, 75, 20s)"
+HOLD_FUNCTIONS = {"above_for": "above", "below_for": "below"}
+
+# Duration literals ("500ms", "30s", "5m", "1h"), rewritten to seconds before parsing
+_DURATION = re.compile(r'\b(\d+(?:\.\d+)?)(ms|s|m|h)\b')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# Reading dict and window trackers arguments of the compiled function
+_READING = "_r"
+_WINDOWS = "_w"
+
+
+class RuleConditionError(ValueError):
+    pass
+
+
+# Comparison operators of simple threshold conditions, and their mirror
+# image for conditions written with the constant first ("75 < temperature")
+THRESHOLD_OPERATORS = {ast.Gt: ">", ast.GtE: ">=", ast.Lt: "<", ast.LtE: "<=", ast.Eq: "==", ast.NotEq: "!="}
+MIRRORED_OPERATORS = {">": "<", ">=": "<=", "<": ">", "<=": ">=", "==": "==", "!=": "!="}
+
+
+class CompiledCondition:
+    """A validated rule condition compiled into a function of the reading dict
+    and the device's window trackers (see rule_windows.WindowStore).
+
+    variables lists the sensor values the condition reads; the function
+    must only be called with readings that contain all of them. threshold is
+    (variable, operator, value) for conditions of the form "variable <op> constant",
+    otherwise None. windows lists the tracker specs the condition uses.
+    """
+
+    __slots__ = ("source", "function", "variables", "threshold", "windows")
+
+    def __init__(self, source, function, variables, threshold=None, windows=()):
+        self.source = source
+        self.function = function
+        self.variables = variables
+        self.threshold = threshold
+        self.windows = windows
+
+    def __call__(self, reading, windows=None):
+        return self.function(reading, windows)
+
+
+def compile_condition(source, name="condition"):
+    """Parse, validate and compile a condition such as "temperature > TEMPERATURE_THRESHOLD".
+
+    Only arithmetic, comparisons, boolean operators, numeric literals,
+    SENSOR_VARIABLES, CONSTANTS, WINDOW_FUNCTIONS and HOLD_FUNCTIONS are
+    accepted; anything else raises RuleConditionError.
+    """
+    expression = _DURATION.sub(lambda m: repr(float(m.group(1)) * _DURATION_UNITS[m.group(2)]), source)
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise RuleConditionError(f"Invalid condition syntax in {name}: {e.msg}")
+
+    windows = []
+    function_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            spec = _window_spec(node, name)
+            if spec not in windows:
+                windows.append(spec)
+            function_names.add(id(node.func))
+
+    variables = []
+    for node in ast.walk(tree):
+        if id(node) in function_names:
+            continue
+        if not isinstance(node, _ALLOWED_NODES + (ast.Call,)):
+            raise RuleConditionError(f"Unsupported expression in {name}: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or
+                                               not isinstance(node.value, (int, float))):
+            raise RuleConditionError(f"Unsupported literal in {name}: {node.value!r}")
+        if isinstance(node, ast.Name):
+            if node.id in SENSOR_VARIABLES:
+                if node.id not in variables:
+                    variables.append(node.id)
+            elif node.id not in CONSTANTS:
+                raise RuleConditionError(f"Unknown name in {name}: {node.id}")
+
+    # Before binding, which rewrites the tree in place
+    threshold = _threshold(tree.body)
+    body = _Binder().visit(tree.body)
+    function_tree = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=_READING), ast.arg(arg=_WINDOWS)], kwonlyargs=[],
+                           kw_defaults=[], defaults=[ast.Constant(value=None)]),
+        body=body
+    ))
+    ast.fix_missing_locations(function_tree)
+    code = compile(function_tree, f"<rule {name}>", 'eval')
+    function = eval(code, {"__builtins__": {}})
+    return CompiledCondition(source, function, tuple(variables), threshold, tuple(windows))
+
+
+def _window_spec(node, name):
+    """Validate a function call and return the tracker spec it reads."""
+    function = node.func.id if isinstance(node.func, ast.Name) else None
+    if function not in WINDOW_FUNCTIONS and function not in HOLD_FUNCTIONS:
+        raise RuleConditionError(f"Unknown function in {name}: {function or type(node.func).__name__}")
+    arity = 2 if function in WINDOW_FUNCTIONS else 3
+    if node.keywords or len(node.args) != arity:
+        raise RuleConditionError(f"{function}() in {name} takes {arity} positional arguments")
+
+    variable = node.args[0]
+    if not (isinstance(variable, ast.Name) and variable.id in SENSOR_VARIABLES):
+        raise RuleConditionError(f"First argument of {function}() in {name} must be a sensor variable")
+    duration = _constant_value(node.args[-1])
+    if duration is None or duration < 0 or (function in WINDOW_FUNCTIONS and duration == 0):
+        raise RuleConditionError(f"Invalid duration for {function}() in {name}")
+
+    if function in WINDOW_FUNCTIONS:
+        return ("window", variable.id, duration)
+    threshold = _constant_value(node.args[1])
+    if threshold is None:
+        raise RuleConditionError(f"Threshold of {function}() in {name} must be a constant")
+    return (HOLD_FUNCTIONS[function], variable.id, threshold)
+
+
+def _threshold(node):
+    if not (isinstance(node, ast.Compare) and len(node.ops) == 1):
+        return None
+    op = THRESHOLD_OPERATORS.get(type(node.ops[0]))
+    left, right = node.left, node.comparators[0]
+    if isinstance(left, ast.Name) and left.id in SENSOR_VARIABLES:
+        value = _constant_value(right)
+        if value is not None:
+            return left.id, op, value
+    elif isinstance(right, ast.Name) and right.id in SENSOR_VARIABLES:
+        value = _constant_value(left)
+        if value is not None:
+            return right.id, MIRRORED_OPERATORS[op], value
+    return None
+
+
+def _constant_value(node):
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        return float(CONSTANTS[node.id])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _constant_value(node.operand)
+        if value is not None:
+            return -value if isinstance(node.op, ast.USub) else value
+    return None
+
+
+class _Binder(ast.NodeTransformer):
+    """Replace constants by their values, sensor variables by reading subscripts
+    and window functions by calls on the device's trackers."""
+
+    def visit_Call(self, node):
+        function = node.func.id
+        spec = _window_spec(node, "condition")
+        tracker = ast.Subscript(
+            value=ast.Name(id=_WINDOWS, ctx=ast.Load()),
+            slice=ast.Constant(value=spec),
+            ctx=ast.Load()
+        )
+        if function in WINDOW_FUNCTIONS:
+            method, args = WINDOW_FUNCTIONS[function], []
+        else:
+            method, args = "held_for", [ast.Constant(value=_constant_value(node.args[2]))]
+        call = ast.Call(
+            func=ast.Attribute(value=tracker, attr=method, ctx=ast.Load()),
+            args=args,
+            keywords=[]
+        )
+        return ast.copy_location(call, node)
+
+    def visit_Name(self, node):
+        if node.id in CONSTANTS:
+            return ast.copy_location(ast.Constant(value=CONSTANTS[node.id]), node)
+        lookup = ast.Subscript(
+            value=ast.Name(id=_READING, ctx=ast.Load()),
+            slice=ast.Constant(value=node.id),
+            ctx=ast.Load()
+        )
+        return ast.copy_location(lookup, node)
@@ -1,94 +1,282 @@
 #!/usr/bin/env python3
 
+import time
 import logging
+import itertools
+import threading
 import config
 import json
 from datetime import datetime
+from rule_conditions import compile_condition, RuleConditionError
+from rule_index import RuleIndex, GLOBAL_SCOPE
+from rule_windows import WindowStore
+from rule_state import RuleStateTable, COOLDOWN_SCOPES
+from rule_store import RuleStore
 
 logger = logging.getLogger('rule_engine')
 
+_rule_order = itertools.count()
+
 class Rule:
-    def __init__(self, rule_id, description, condition, action):
+    def __init__(self, rule_id, description, condition, action, device_id=None, sector_id=None,
+                 cooldown=60, cooldown_scope=config.RULE_COOLDOWN_SCOPE, hysteresis=None):
         self.id = rule_id
         self.description = description
         self.condition = condition
         self.action = action
+        self.device_id = device_id
+        self.sector_id = sector_id
         self.last_triggered = None
-        self.cooldown = 60
-
-    def evaluate(self, sensor_data):
-        temperature = sensor_data.get('temperature', 0)
-        pressure = sensor_data.get('pressure', 0)
-        
-        result = eval(self.condition, 
-                     {"temperature": temperature, 
-                      "pressure": pressure,
-                      "TEMPERATURE_THRESHOLD": config.TEMPERATURE_THRESHOLD,
-                      "PRESSURE_THRESHOLD": config.PRESSURE_THRESHOLD})
-        
-        if result:
-            current_time = datetime.now()
-            
-            if (self.last_triggered is None or 
-                (current_time - self.last_triggered).total_seconds() > self.cooldown):
-                self.last_triggered = current_time
-                return True
-            
-        return False
+        self.trigger_count = 0
+        self.cooldown = cooldown
+        # Cooldown and hysteresis are tracked per device, per sector or for the whole rule
+        if cooldown_scope not in COOLDOWN_SCOPES:
+            raise RuleConditionError(f"Invalid cooldown scope for {rule_id}: {cooldown_scope}")
+        self.cooldown_scope = cooldown_scope
+        # None: retrigger after every cooldown while the condition holds. Otherwise
+        # the rule only triggers again after the condition has released; for
+        # threshold conditions the value must move this far back past the threshold
+        self.hysteresis = hysteresis
+        # Raises RuleConditionError for conditions outside the allowed grammar
+        self.compiled = compile_condition(condition, rule_id)
+        # Triggered rules are reported in the order they were added
+        self.order = next(_rule_order)
+
+    @property
+    def scope(self):
+        if self.device_id is not None:
+            return ("device", self.device_id)
+        if self.sector_id is not None:
+            return ("sector", self.sector_id)
+        return GLOBAL_SCOPE
+
+    def evaluate(self, sensor_data, windows=None):
+        """Whether the condition holds; cooldowns are applied by RuleEngine."""
+        if not all(name in sensor_data for name in self.compiled.variables):
+            return False
+        return bool(self.compiled.function(sensor_data, windows))
+
+    def to_config(self):
+        rule_config = {
+            "id": self.id,
+            "description": self.description,
+            "condition": self.condition,
+            "action": self.action
+        }
+        for key, value, default in (("device_id", self.device_id, None), ("sector_id", self.sector_id, None),
+                                    ("cooldown", self.cooldown, 60),
+                                    ("cooldown_scope", self.cooldown_scope, config.RULE_COOLDOWN_SCOPE),
+                                    ("hysteresis", self.hysteresis, None)):
+            if value != default:
+                rule_config[key] = value
+        return rule_config
+
+    def record_trigger(self):
+        self.last_triggered = datetime.now()
+        self.trigger_count += 1
+
+
+class RuleSnapshot:
+    """Immutable, versioned view of the rule set.
+
+    RuleEngine replaces its snapshot as a whole on every change, so an
+    evaluation that read self.snapshot once sees a consistent rule list and
+    index without taking a lock.
+    """
+
+    __slots__ = ("version", "rules", "index", "by_id")
+
+    def __init__(self, version, rules, index):
+        self.version = version
+        self.rules = tuple(rules)
+        self.index = index
+        self.by_id = {rule.id: rule for rule in self.rules}
 
 
 class RuleEngine:
-    def __init__(self):
-        self.rules = []
-        self.load_default_rules()
-        
-    def load_default_rules(self):
-        for rule_config in config.DEFAULT_RULES:
-            rule = Rule(
-                rule_id=rule_config['id'],
-                description=rule_config['description'],
-                condition=rule_config['condition'],
-                action=rule_config['action']
-            )
-            self.rules.append(rule)
-        logger.info(f"Loaded {len(self.rules)} default rules")
-    
-    def add_rule(self, rule_config):
-        rule = Rule(
+    def __init__(self, store=None):
+        if store is None and config.RULES_PERSISTENCE_ENABLED:
+            store = RuleStore(config.RULES_FILE)
+        self.store = store
+        self.snapshot = RuleSnapshot(0, (), RuleIndex())
+        self.windows = WindowStore()
+        self.states = RuleStateTable()
+        # Serialises writers; readers only ever read self.snapshot
+        self.lock = threading.Lock()
+        self.load_rules()
+
+    @property
+    def rules(self):
+        return self.snapshot.rules
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def load_rules(self):
+        """Load the persisted rules, or config.DEFAULT_RULES if there are none."""
+        stored = self.store.load() if self.store else None
+        if stored is None:
+            version, rule_configs, source = 0, config.DEFAULT_RULES, "default"
+        else:
+            version, rule_configs = stored
+            source = self.store.path
+            self._warn_default_override(rule_configs, source)
+
+        candidates = []
+        for rule_config in rule_configs:
+            try:
+                candidates.append(self._create_rule(rule_config))
+            except (RuleConditionError, KeyError) as e:
+                logger.error(f"Skipping rule {rule_config.get('id')} from {source}: {e}")
+        with self.lock:
+            rules = self._keep_unchanged(candidates)
+            self._swap(rules, RuleIndex(rules), version=version, persist=stored is None)
+        logger.info(f"Loaded {len(rules)} rules from {source} (version {self.version})")
+
+    def _warn_default_override(self, rule_configs, source):
+        stored = {rule_config.get('id'): rule_config for rule_config in rule_configs}
+        differing = [rule['id'] for rule in config.DEFAULT_RULES
+                     if rule['id'] not in stored or
+                     any(stored[rule['id']].get(key) != value for key, value in rule.items())]
+        if differing or len(stored) != len(config.DEFAULT_RULES):
+            logger.warning(f"Rules persisted in {source} override config.DEFAULT_RULES "
+                           f"(differing default rules: {', '.join(differing) or 'none'}); "
+                           f"delete the file to use the configured defaults")
+
+    def reload_rules(self):
+        """Re-read the persisted rules, e.g. after the file was edited."""
+        if self.store is None:
+            return False
+        self.load_rules()
+        return True
+
+    def _create_rule(self, rule_config):
+        return Rule(
             rule_id=rule_config['id'],
             description=rule_config['description'],
             condition=rule_config['condition'],
-            action=rule_config['action']
+            action=rule_config['action'],
+            device_id=rule_config.get('device_id'),
+            sector_id=rule_config.get('sector_id'),
+            cooldown=rule_config.get('cooldown', 60),
+            cooldown_scope=rule_config.get('cooldown_scope', config.RULE_COOLDOWN_SCOPE),
+            hysteresis=rule_config.get('hysteresis')
         )
-        self.rules.append(rule)
-        logger.info(f"Added new rule: {rule.id}")
+
+    def _keep_unchanged(self, candidates):
+        """Reuse current Rule objects whose configuration is unchanged, keeping their state."""
+        current = self.snapshot.by_id
+        rules = []
+        for rule in candidates:
+            existing = current.get(rule.id)
+            rules.append(existing if existing and existing.to_config() == rule.to_config() else rule)
+        return rules
+
+    def _swap(self, rules, index, version=None, persist=True):
+        """Publish a new snapshot; called with self.lock held."""
+        old = self.snapshot
+        new = RuleSnapshot(old.version + 1 if version is None else version, rules, index)
+
+        old_rules = {id(rule): rule for rule in old.rules}
+        new_rules = {id(rule): rule for rule in new.rules}
+        for key, rule in new_rules.items():
+            if key not in old_rules:
+                self.windows.require(rule.compiled.windows)
+
+        self.snapshot = new
+
+        for key, rule in old_rules.items():
+            if key not in new_rules:
+                self.windows.release(rule.compiled.windows)
+                if rule.id not in new.by_id:
+                    self.states.forget_rule(rule.id)
+        if persist and self.store:
+            self.store.save(new.version, [rule.to_config() for rule in new.rules])
+        return new
+
+    def add_rule(self, rule_config):
+        """Add a rule, replacing any existing rule with the same ID."""
+        try:
+            rule = self._create_rule(rule_config)
+        except (RuleConditionError, KeyError) as e:
+            logger.error(f"Rejected rule {rule_config.get('id')}: {e}")
+            return None
+        with self.lock:
+            snapshot = self.snapshot
+            index = snapshot.index
+            existing = [other for other in snapshot.rules if other.id == rule.id]
+            if existing:
+                index = index.removed(existing)
+            rules = [other for other in snapshot.rules if other.id != rule.id] + [rule]
+            self._swap(rules, index.added(rule))
+        logger.info(f"{'Replaced' if existing else 'Added new'} rule: {rule.id} (version {self.version})")
         return rule.id
-        
+
     def remove_rule(self, rule_id):
-        initial_count = len(self.rules)
-        self.rules = [rule for rule in self.rules if rule.id != rule_id]
-        if len(self.rules) < initial_count:
-            logger.info(f"Removed rule: {rule_id}")
-            return True
-        return False
-    
+        with self.lock:
+            snapshot = self.snapshot
+            removed = [rule for rule in snapshot.rules if rule.id == rule_id]
+            if not removed:
+                return False
+            rules = [rule for rule in snapshot.rules if rule.id != rule_id]
+            self._swap(rules, snapshot.index.removed(removed))
+        logger.info(f"Removed rule: {rule_id} (version {self.version})")
+        return True
+
+    def replace_rules(self, rule_configs):
+        """Atomically replace the whole rule set; rejected if any rule is invalid.
+
+        Rules whose configuration is unchanged keep their trigger state.
+        """
+        try:
+            candidates = [self._create_rule(rule_config) for rule_config in rule_configs]
+        except (RuleConditionError, KeyError) as e:
+            logger.error(f"Rejected rule set: {e}")
+            return None
+        with self.lock:
+            rules = self._keep_unchanged(candidates)
+            self._swap(rules, RuleIndex(rules))
+        logger.info(f"Replaced rule set: {len(rules)} rules (version {self.version})")
+        return self.version
+
     def get_rules(self):
+        counts = self.states.get_counts()
+        no_state = {"cooling_down": 0, "latched": 0}
         return [
             {
                 "id": rule.id,
                 "description": rule.description,
                 "condition": rule.condition,
                 "action": rule.action,
-                "last_triggered": rule.last_triggered.isoformat() if rule.last_triggered else None
+                "device_id": rule.device_id,
+                "sector_id": rule.sector_id,
+                "cooldown": rule.cooldown,
+                "cooldown_scope": rule.cooldown_scope,
+                "hysteresis": rule.hysteresis,
+                "last_triggered": rule.last_triggered.isoformat() if rule.last_triggered else None,
+                "trigger_count": rule.trigger_count,
+                **counts.get(rule.id, no_state)
             }
-            for rule in self.rules
+            for rule in self.snapshot.rules
         ]
-    
-    def evaluate_rules(self, device_id, sensor_data):
+
+    def evaluate_rules(self, device_id, sensor_data, sector_id=None, thresholds=True):
+        """Run the rules that apply to this device and sector and whose
+        variables are all present in sensor_data."""
         triggered_rules = []
-        
-        for rule in self.rules:
-            if rule.evaluate(sensor_data):
+        now = time.monotonic()
+        windows = self.windows.update(device_id, sensor_data, now)
+
+        matched = self.snapshot.index.match(device_id, sector_id, sensor_data, thresholds, windows)
+        self.states.release(matched, device_id, sector_id, sensor_data, windows, now)
+        for rule in matched:
+            if self.states.try_trigger(rule, device_id, sector_id, now):
+                rule.record_trigger()
                 logger.info(f"Rule triggered: {rule.id} for device {device_id}")
                 triggered_rules.append({
                     "rule_id": rule.id,
@@ -96,5 +284,5 @@ class RuleEngine:
                     "device_id": device_id,
                     "sensor_data": sensor_data
                 })
-                
-        return triggered_rules
\ No newline at end of file
+
+        return triggered_rules
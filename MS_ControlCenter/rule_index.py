@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+from bisect import bisect_left, bisect_right
+
+GLOBAL_SCOPE = ("global", None)
+
+
+def rule_scopes(device_id, sector_id):
+    """Index buckets a reading from device_id in sector_id is matched against."""
+    scopes = [GLOBAL_SCOPE]
+    if device_id is not None:
+        scopes.append(("device", device_id))
+    if sector_id is not None:
+        scopes.append(("sector", sector_id))
+    return scopes
+
+
+class ThresholdIndex:
+    """Rules of the form "variable <op> value" for one variable and operator,
+    kept sorted by value so one reading finds every triggered rule by bisection."""
+
+    __slots__ = ("op", "values", "rules")
+
+    def __init__(self, op):
+        self.op = op
+        self.values = []
+        self.rules = []
+
+    def add(self, value, rule):
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.rules.insert(i, rule)
+
+    def copy(self):
+        index = ThresholdIndex(self.op)
+        index.values = list(self.values)
+        index.rules = list(self.rules)
+        return index
+
+    def without(self, rule):
+        index = ThresholdIndex(self.op)
+        for value, other in zip(self.values, self.rules):
+            if other is not rule:
+                index.values.append(value)
+                index.rules.append(other)
+        return index
+
+    def match(self, reading):
+        values, rules, op = self.values, self.rules, self.op
+        if op == ">":
+            return rules[:bisect_left(values, reading)]
+        if op == ">=":
+            return rules[:bisect_right(values, reading)]
+        if op == "<":
+            return rules[bisect_right(values, reading):]
+        if op == "<=":
+            return rules[bisect_left(values, reading):]
+        lo, hi = bisect_left(values, reading), bisect_right(values, reading)
+        if op == "==":
+            return rules[lo:hi]
+        return rules[:lo] + rules[hi:]
+
+
+class _ScopeBucket:
+    __slots__ = ("thresholds", "general")
+
+    def __init__(self):
+        # {variable: {op: ThresholdIndex}}
+        self.thresholds = {}
+        # {first variable: [rule, ...]} for every other condition;
+        # constant conditions are under None and checked for any reading
+        self.general = {}
+
+    def copy(self):
+        """Shallow copy; the lists and ThresholdIndex objects are shared."""
+        bucket = _ScopeBucket()
+        bucket.thresholds = {variable: dict(by_op) for variable, by_op in self.thresholds.items()}
+        bucket.general = dict(self.general)
+        return bucket
+
+    def add(self, rule, shared=False):
+        """Add rule; with shared=True the list it goes into is copied first."""
+        threshold = rule.compiled.threshold
+        if threshold is not None:
+            variable, op, value = threshold
+            by_op = self.thresholds.setdefault(variable, {})
+            index = by_op.get(op)
+            if index is None:
+                index = ThresholdIndex(op)
+            elif shared:
+                index = index.copy()
+            index.add(value, rule)
+            by_op[op] = index
+        else:
+            key = rule.compiled.variables[0] if rule.compiled.variables else None
+            rules = self.general.get(key, [])
+            if shared:
+                rules = list(rules)
+            rules.append(rule)
+            self.general[key] = rules
+
+    def remove(self, rule):
+        """Remove rule, replacing (never mutating) the list it was in."""
+        threshold = rule.compiled.threshold
+        if threshold is not None:
+            variable, op, _ = threshold
+            by_op = self.thresholds.get(variable, {})
+            if op in by_op:
+                by_op[op] = by_op[op].without(rule)
+        else:
+            key = rule.compiled.variables[0] if rule.compiled.variables else None
+            if key in self.general:
+                self.general[key] = [other for other in self.general[key] if other is not rule]
+
+
+class RuleIndex:
+    """Immutable lookup structure over a rule list.
+
+    Rules are bucketed by scope (global, device or sector) and by the sensor
+    variables they reference, so a reading only reaches rules whose variables
+    it carries. Changes go through added()/removed(), which return a new
+    index sharing everything but the lists the rule touches.
+    """
+
+    def __init__(self, rules=()):
+        self.buckets = {}
+        for rule in rules:
+            bucket = self.buckets.get(rule.scope)
+            if bucket is None:
+                bucket = self.buckets[rule.scope] = _ScopeBucket()
+            bucket.add(rule)
+
+    def added(self, rule):
+        index = RuleIndex()
+        index.buckets = dict(self.buckets)
+        bucket = self.buckets.get(rule.scope)
+        bucket = index.buckets[rule.scope] = bucket.copy() if bucket else _ScopeBucket()
+        bucket.add(rule, shared=True)
+        return index
+
+    def removed(self, rules):
+        index = RuleIndex()
+        index.buckets = dict(self.buckets)
+        for rule in rules:
+            if rule.scope in self.buckets:
+                if index.buckets[rule.scope] is self.buckets[rule.scope]:
+                    index.buckets[rule.scope] = self.buckets[rule.scope].copy()
+                index.buckets[rule.scope].remove(rule)
+        return index
+
+    def match(self, device_id, sector_id, reading, thresholds=True, windows=None):
+        """Rules whose conditions hold for reading, in rule order. windows are
+        the device's window trackers, for conditions using window functions.
+
+        thresholds=False skips the threshold rules, for callers that
+        evaluate those separately (see batch_evaluator).
+        """
+        matched = []
+        for scope in rule_scopes(device_id, sector_id):
+            bucket = self.buckets.get(scope)
+            if bucket is None:
+                continue
+
+            for variable, value in (reading.items() if thresholds else ()):
+                by_op = bucket.thresholds.get(variable)
+                if by_op is not None and isinstance(value, (int, float)):
+                    for index in by_op.values():
+                        matched.extend(index.match(value))
+
+            for variable in (None, *reading):
+                for rule in bucket.general.get(variable, ()):
+                    if all(name in reading for name in rule.compiled.variables) and rule.compiled.function(reading, windows):
+                        matched.append(rule)
+
+        matched.sort(key=lambda rule: rule.order)
+        return matched
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+import config
+from rule_index import rule_scopes
+
+# Keys cooldown and hysteresis state can be kept under
+COOLDOWN_SCOPES = ("device", "sector", "rule")
+
+
+class TriggerState:
+    __slots__ = ("rule", "last_triggered", "latched")
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.last_triggered = None
+        # Hysteresis: set when triggered, cleared once the condition has released
+        self.latched = False
+
+
+class RuleStateTable:
+    """Cooldown and hysteresis state per (rule, device), (rule, sector) or rule.
+
+    An entry only exists while it affects evaluation: it is dropped once its
+    cooldown has passed and it is not latched, and in any case after ttl
+    seconds without a trigger, so the table stays proportional to the
+    number of devices and sectors currently in alarm.
+    """
+
+    def __init__(self, ttl=config.RULE_STATE_TTL, sweep_interval=30.0):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.lock = threading.Lock()
+        # {("device", id) | ("sector", id) | ("rule", None): {rule_id: TriggerState}}
+        self.states = {}
+        self._next_sweep = 0.0
+
+    @staticmethod
+    def key(rule, device_id, sector_id):
+        if rule.cooldown_scope == "sector":
+            return ("sector", sector_id)
+        if rule.cooldown_scope == "rule":
+            return ("rule", None)
+        return ("device", device_id)
+
+    def try_trigger(self, rule, device_id, sector_id, now=None):
+        """Record a trigger of rule unless it is cooling down or latched for this key."""
+        now = time.monotonic() if now is None else now
+        key = self.key(rule, device_id, sector_id)
+        with self.lock:
+            rules = self.states.get(key)
+            if rules is None:
+                rules = self.states[key] = {}
+            state = rules.get(rule.id)
+            if state is None or state.rule is not rule:
+                state = rules[rule.id] = TriggerState(rule)
+            elif state.latched or now - state.last_triggered <= rule.cooldown:
+                return False
+            state.last_triggered = now
+            state.latched = rule.hysteresis is not None
+            return True
+
+    def release(self, matched, device_id, sector_id, reading, windows=None, now=None):
+        """Unlatch the rules of this device and sector that did not match
+        reading and have moved past their hysteresis band."""
+        now = time.monotonic() if now is None else now
+        matched_ids = {rule.id for rule in matched}
+        scopes = rule_scopes(device_id, sector_id)
+        with self.lock:
+            for key in (("device", device_id), ("sector", sector_id), ("rule", None)):
+                rules = self.states.get(key)
+                if not rules:
+                    continue
+                for rule_id, state in list(rules.items()):
+                    rule = state.rule
+                    if (state.latched and rule_id not in matched_ids and rule.scope in scopes and
+                            all(name in reading for name in rule.compiled.variables) and
+                            _released(rule, reading, windows)):
+                        state.latched = False
+                        if now - state.last_triggered > rule.cooldown:
+                            del rules[rule_id]
+                if not rules:
+                    del self.states[key]
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        for key in list(self.states):
+            rules = self.states[key]
+            for rule_id, state in list(rules.items()):
+                age = now - state.last_triggered
+                if age > self.ttl or (not state.latched and age > state.rule.cooldown):
+                    del rules[rule_id]
+            if not rules:
+                del self.states[key]
+
+    def forget_rule(self, rule_id):
+        with self.lock:
+            for key in list(self.states):
+                self.states[key].pop(rule_id, None)
+                if not self.states[key]:
+                    del self.states[key]
+
+    def get_counts(self, now=None):
+        """{rule_id: {"cooling_down": n, "latched": n}} over all keys."""
+        now = time.monotonic() if now is None else now
+        counts = {}
+        with self.lock:
+            for rules in self.states.values():
+                for rule_id, state in rules.items():
+                    rule_counts = counts.setdefault(rule_id, {"cooling_down": 0, "latched": 0})
+                    if state.latched:
+                        rule_counts["latched"] += 1
+                    elif now - state.last_triggered <= state.rule.cooldown:
+                        rule_counts["cooling_down"] += 1
+        return counts
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(rules) for rules in self.states.values())
+
+
+def _released(rule, reading, windows):
+    threshold = rule.compiled.threshold
+    if threshold is not None and rule.hysteresis:
+        variable, op, value = threshold
+        if op in (">", ">="):
+            return reading[variable] < value - rule.hysteresis
+        if op in ("<", "<="):
+            return reading[variable] > value + rule.hysteresis
+    return not rule.compiled.function(reading, windows)
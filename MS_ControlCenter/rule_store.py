@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger('rule_store')
+
+
+class RuleStore:
+    """Rule configurations persisted as one JSON document.
+
+    Every save rewrites the file through a temporary file and os.replace,
+    so a crash mid-write leaves the previous version in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return (version, rule_configs), or None if there is no usable file."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                document = json.load(f)
+            return int(document.get("version", 0)), list(document["rules"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Keep the unreadable file for inspection instead of overwriting it
+            corrupt_path = f"{self.path}.corrupt"
+            logger.error(f"Could not load rules from {self.path}: {e}; moving it to {corrupt_path}")
+            try:
+                os.replace(self.path, corrupt_path)
+            except OSError:
+                pass
+            return None
+
+    def save(self, version, rule_configs):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    "version": version,
+                    "saved_at": datetime.now().isoformat(),
+                    "rules": rule_configs
+                }, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError as e:
+            logger.error(f"Could not save rules to {self.path}: {e}")
+            return False
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+from collections import deque
+
+import config
+
+
+class RollingWindow:
+    """Readings of one variable over the last span seconds.
+
+    Sum, min, max and the least-squares slope are maintained incrementally,
+    so adding a reading and every query are O(1) (amortised for min/max,
+    which use monotonic deques).
+    """
+
+    __slots__ = ("span", "max_samples", "samples", "seq",
+                 "total", "base", "t_sum", "tt_sum", "tv_sum", "mins", "maxs")
+
+    def __init__(self, span, max_samples=512):
+        self.span = span
+        self.max_samples = max_samples
+        self.samples = deque()
+        self.seq = 0
+        self.mins = deque()
+        self.maxs = deque()
+        self._rebase(None)
+
+    def add(self, t, value):
+        while self.samples and (self.samples[0][0] <= t - self.span or len(self.samples) >= self.max_samples):
+            self._evict()
+
+        if self.base is None or t - self.base > 4 * self.span:
+            # Keep time offsets small so the slope sums do not lose precision
+            self._rebase(self.samples[0][0] if self.samples else t)
+
+        self.seq += 1
+        self.samples.append((t, value, self.seq))
+        self._accumulate(t, value, 1)
+        while self.mins and self.mins[-1][0] >= value:
+            self.mins.pop()
+        self.mins.append((value, self.seq))
+        while self.maxs and self.maxs[-1][0] <= value:
+            self.maxs.pop()
+        self.maxs.append((value, self.seq))
+
+    def _evict(self):
+        t, value, seq = self.samples.popleft()
+        self._accumulate(t, value, -1)
+        if self.mins and self.mins[0][1] == seq:
+            self.mins.popleft()
+        if self.maxs and self.maxs[0][1] == seq:
+            self.maxs.popleft()
+
+    def _accumulate(self, t, value, sign):
+        t -= self.base
+        self.total += sign * value
+        self.t_sum += sign * t
+        self.tt_sum += sign * t * t
+        self.tv_sum += sign * t * value
+
+    def _rebase(self, base):
+        self.base = base
+        self.total = self.t_sum = self.tt_sum = self.tv_sum = 0.0
+        for t, value, _ in self.samples:
+            self._accumulate(t, value, 1)
+
+    def mean(self):
+        return self.total / len(self.samples) if self.samples else 0.0
+
+    def minimum(self):
+        return self.mins[0][0] if self.mins else 0.0
+
+    def maximum(self):
+        return self.maxs[0][0] if self.maxs else 0.0
+
+    def delta(self):
+        """Change between the oldest and the newest reading in the window."""
+        return self.samples[-1][1] - self.samples[0][1] if self.samples else 0.0
+
+    def slope(self):
+        """Least-squares rate of change, in units per second."""
+        n = len(self.samples)
+        denominator = n * self.tt_sum - self.t_sum * self.t_sum
+        if n < 2 or denominator <= 1e-12:
+            return 0.0
+        return (n * self.tv_sum - self.t_sum * self.total) / denominator
+
+
+class ThresholdHold:
+    """How long a variable has been continuously above (or below) a threshold."""
+
+    __slots__ = ("above", "threshold", "since", "last")
+
+    def __init__(self, above, threshold):
+        self.above = above
+        self.threshold = threshold
+        self.since = None
+        self.last = None
+
+    def add(self, t, value):
+        holds = value > self.threshold if self.above else value < self.threshold
+        if not holds:
+            self.since = None
+        elif self.since is None:
+            self.since = t
+        self.last = t
+
+    def held_for(self, duration):
+        return self.since is not None and self.last - self.since >= duration
+
+
+def make_tracker(spec, max_samples):
+    kind, _, parameter = spec
+    if kind == "window":
+        return RollingWindow(parameter, max_samples)
+    return ThresholdHold(kind == "above", parameter)
+
+
+class WindowStore:
+    """Per-device trackers for the window specs referenced by the loaded rules.
+
+    A spec is ("window", variable, seconds), ("above", variable, threshold)
+    or ("below", variable, threshold), as listed in CompiledCondition.windows.
+    """
+
+    def __init__(self, max_samples=config.RULE_WINDOW_MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        # {spec: number of rules using it}
+        self.specs = {}
+        # {variable: [spec, ...]}
+        self.by_variable = {}
+        # {device_id: {spec: tracker}}
+        self.devices = {}
+
+    def require(self, specs):
+        with self.lock:
+            for spec in specs:
+                self.specs[spec] = self.specs.get(spec, 0) + 1
+            self._reindex()
+
+    def release(self, specs):
+        with self.lock:
+            for spec in specs:
+                count = self.specs.get(spec, 0) - 1
+                if count > 0:
+                    self.specs[spec] = count
+                else:
+                    self.specs.pop(spec, None)
+                    for trackers in self.devices.values():
+                        trackers.pop(spec, None)
+            self._reindex()
+
+    def _reindex(self):
+        by_variable = {}
+        for spec in self.specs:
+            by_variable.setdefault(spec[1], []).append(spec)
+        self.by_variable = by_variable
+
+    def update(self, device_id, reading, now=None):
+        """Add a reading to the device's trackers and return them for evaluation."""
+        if not self.by_variable:
+            return None
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            trackers = self.devices.get(device_id)
+            if trackers is None:
+                trackers = self.devices[device_id] = {}
+            for variable, value in reading.items():
+                for spec in self.by_variable.get(variable, ()):
+                    tracker = trackers.get(spec)
+                    if tracker is None:
+                        tracker = trackers[spec] = make_tracker(spec, self.max_samples)
+                    tracker.add(now, value)
+            return trackers
+
+    def remove_device(self, device_id):
+        with self.lock:
+            return self.devices.pop(device_id, None) is not None
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "specs": len(self.specs),
+                "devices": len(self.devices),
+                "samples": sum(
+                    len(tracker.samples)
+                    for trackers in self.devices.values()
+                    for tracker in trackers.values()
+                    if isinstance(tracker, RollingWindow)
+                )
+            }
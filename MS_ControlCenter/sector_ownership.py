@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import requests
+
+import config
+
+logger = logging.getLogger('sector_ownership')
+
+
+class SectorOwnership:
+    """Membership of this instance in the Control Center partition group.
+
+    Heartbeats to the Resource Catalog return the sectors this instance owns;
+    on_change(sectors) is called whenever that set changes. While the catalog
+    cannot be reached the last known ownership is kept.
+    """
+
+    def __init__(self, member_id, on_change, sectors=None, endpoints=None,
+                 group=config.PARTITION_GROUP, interval=config.PARTITION_HEARTBEAT_INTERVAL):
+        self.member_id = member_id
+        self.on_change = on_change
+        self.sectors = list(config.PARTITION_SECTORS if sectors is None else sectors)
+        self.endpoints = endpoints or {}
+        self.group = group
+        self.interval = interval
+        self.owned = frozenset()
+        self.version = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def heartbeat(self):
+        try:
+            response = requests.post(
+                f"{config.RESOURCE_CATALOG_URL}/join_partition",
+                json={
+                    "group": self.group,
+                    "member_id": self.member_id,
+                    "sectors": self.sectors,
+                    "endpoints": self.endpoints
+                },
+                timeout=5
+            )
+            data = response.json()
+            if response.status_code != 200 or data.get("status") != "success":
+                logger.error(f"Partition heartbeat failed: {data.get('message', response.status_code)}")
+                return False
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Partition heartbeat to {config.RESOURCE_CATALOG_URL} failed: {e}")
+            return False
+
+        partition = data["data"]
+        owned = frozenset(partition.get("owned_sectors", []))
+        self.version = partition.get("version")
+        if owned != self.owned:
+            logger.info(f"Sector ownership of {self.member_id} changed (version {self.version}): "
+                        f"{sorted(self.owned)} -> {sorted(owned)}")
+            self.owned = owned
+            self.on_change(owned)
+        return True
+
+    def leave(self):
+        try:
+            response = requests.post(
+                f"{config.RESOURCE_CATALOG_URL}/leave_partition",
+                json={"group": self.group, "member_id": self.member_id},
+                timeout=5
+            )
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Could not leave partition {self.group}: {e}")
+            return False
+
+    def start(self):
+        """Join the group (first heartbeat runs before returning) and keep renewing."""
+        self.heartbeat()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+        # Hand the sectors over now instead of after the catalog's member timeout
+        return self.leave()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.heartbeat()
+
+    def get_status(self):
+        return {
+            "member_id": self.member_id,
+            "group": self.group,
+            "version": self.version,
+            "owned_sectors": sorted(self.owned)
+        }
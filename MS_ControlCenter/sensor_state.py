@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+
+import config
+
+
+class DeviceState:
+    """Latest reading of one device."""
+
+    __slots__ = ("device_id", "sector_id", "timestamp", "last_seen", "temperature", "pressure")
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.sector_id = None
+        # Reading time reported by the device (epoch seconds)
+        self.timestamp = None
+        # Local monotonic time of the last update, for TTL eviction
+        self.last_seen = None
+        self.temperature = None
+        self.pressure = None
+
+    def values(self):
+        values = {}
+        if self.temperature is not None:
+            values['temperature'] = self.temperature
+        if self.pressure is not None:
+            values['pressure'] = self.pressure
+        return values
+
+    def to_dict(self):
+        return {
+            'device_id': self.device_id,
+            'sector_id': self.sector_id,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat() if self.timestamp else None,
+            'values': self.values()
+        }
+
+
+class SensorStateStore:
+    """Latest state per device, evicting devices silent for longer than ttl.
+
+    Devices are kept in order of their last update, so expired ones are
+    always at the front and eviction is O(1) per update. A per-sector index
+    serves filtered status queries without scanning the whole fleet.
+    """
+
+    def __init__(self, ttl=config.SENSOR_STATE_TTL, max_devices=config.SENSOR_STATE_MAX_DEVICES, on_evict=None):
+        self.ttl = ttl
+        self.max_devices = max_devices
+        self.on_evict = on_evict
+        self.devices = OrderedDict()
+        # {sector_id: {device_id: None}}, insertion ordered
+        self.sectors = {}
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def update(self, device_id, sector_id, timestamp, values, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None:
+                state = self.devices[device_id] = DeviceState(device_id)
+            else:
+                self.devices.move_to_end(device_id)
+            if state.sector_id != sector_id:
+                self._unindex(state)
+                state.sector_id = sector_id
+                self.sectors.setdefault(sector_id, {})[device_id] = None
+            state.timestamp = _epoch(timestamp)
+            state.last_seen = now
+            state.temperature = values.get('temperature')
+            state.pressure = values.get('pressure')
+            evicted = self._expire(now)
+
+        if self.on_evict:
+            for device_id in evicted:
+                self.on_evict(device_id)
+        return state
+
+    def _expire(self, now):
+        evicted = []
+        while self.devices:
+            device_id, state = next(iter(self.devices.items()))
+            if now - state.last_seen <= self.ttl and len(self.devices) <= self.max_devices:
+                break
+            del self.devices[device_id]
+            self._unindex(state)
+            evicted.append(device_id)
+        self.evicted += len(evicted)
+        return evicted
+
+    def remove_sector(self, sector_id):
+        """Drop all devices of a sector, e.g. once another instance owns it."""
+        with self.lock:
+            device_ids = list(self.sectors.pop(sector_id, {}))
+            for device_id in device_ids:
+                del self.devices[device_id]
+        if self.on_evict:
+            for device_id in device_ids:
+                self.on_evict(device_id)
+        return len(device_ids)
+
+    def _unindex(self, state):
+        sector = self.sectors.get(state.sector_id)
+        if sector is not None:
+            sector.pop(state.device_id, None)
+            if not sector:
+                del self.sectors[state.sector_id]
+
+    def get(self, device_id):
+        with self.lock:
+            return self.devices.get(device_id)
+
+    def sector_of(self, device_id, default=None):
+        state = self.get(device_id)
+        return state.sector_id if state is not None else default
+
+    def query(self, sector_id=None, offset=0, limit=config.STATUS_PAGE_SIZE):
+        """One page of device states, least recently updated first."""
+        offset = max(0, int(offset))
+        limit = max(0, int(limit))
+        with self.lock:
+            if sector_id is None:
+                total = len(self.devices)
+                page = list(islice(self.devices.values(), offset, offset + limit))
+            else:
+                device_ids = self.sectors.get(sector_id, {})
+                total = len(device_ids)
+                page = [self.devices[device_id] for device_id in islice(device_ids, offset, offset + limit)]
+            return {
+                'total': total,
+                'offset': offset,
+                'limit': limit,
+                'devices': [state.to_dict() for state in page]
+            }
+
+    def summary(self):
+        with self.lock:
+            return {
+                'devices': len(self.devices),
+                'evicted': self.evicted,
+                'sectors': {sector_id: len(device_ids) for sector_id, device_ids in self.sectors.items()}
+            }
+
+    def __len__(self):
+        return len(self.devices)
+
+
+def _epoch(timestamp):
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import time
+import uuid
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger('valve_commands')
+
+# Valve state reported in valve/status once an action has been carried out
+ACTION_STATES = {"close": "closed", "open": "open"}
+
+
+class PendingCommand:
+    __slots__ = ("sector_id", "action", "command_id", "issued_at", "sent_at", "attempts", "coalesced")
+
+    def __init__(self, sector_id, action, now):
+        self.sector_id = sector_id
+        self.action = action
+        # Idempotency key: retries carry the same ID so the valve actuates once
+        self.command_id = uuid.uuid4().hex
+        self.issued_at = now
+        self.sent_at = now
+        self.attempts = 1
+        self.coalesced = 0
+
+    def to_dict(self, now):
+        return {
+            "sector_id": self.sector_id,
+            "action": self.action,
+            "command_id": self.command_id,
+            "attempts": self.attempts,
+            "coalesced": self.coalesced,
+            "age": round(now - self.issued_at, 3)
+        }
+
+
+class PendingCommandTable:
+    """At most one in-flight valve command per sector.
+
+    A command stays pending until a valve status confirms it. Requests for
+    the same action while it is pending are coalesced into it; a request
+    for a different action supersedes it. Commands that are not confirmed
+    within ack_timeout are retried (with the same command_id) up to
+    max_retries times, then dropped.
+    """
+
+    def __init__(self, ack_timeout=config.VALVE_COMMAND_ACK_TIMEOUT,
+                 max_retries=config.VALVE_COMMAND_MAX_RETRIES):
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "issued": 0, "coalesced": 0, "superseded": 0,
+            "retried": 0, "acknowledged": 0, "expired": 0, "skipped": 0
+        }
+
+    def request(self, sector_id, action, current_state=None, now=None):
+        """Return a new PendingCommand to publish, or None when nothing needs to be sent."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            command = self.pending.get(sector_id)
+            if command is not None:
+                if command.action == action:
+                    command.coalesced += 1
+                    self.stats["coalesced"] += 1
+                    return None
+                self.stats["superseded"] += 1
+            elif current_state == ACTION_STATES.get(action):
+                self.stats["skipped"] += 1
+                return None
+
+            command = self.pending[sector_id] = PendingCommand(sector_id, action, now)
+            self.stats["issued"] += 1
+            return command
+
+    def acknowledge(self, sector_id, valve_state, command_id=None):
+        """Clear the sector's pending command if a status confirms it.
+
+        Statuses echo the command_id when the valve handler supports it;
+        otherwise a status reporting the command's target state confirms it.
+        """
+        with self.lock:
+            command = self.pending.get(sector_id)
+            if command is None:
+                return None
+            if command_id is not None:
+                confirmed = command_id == command.command_id
+            else:
+                confirmed = valve_state == ACTION_STATES.get(command.action)
+            if not confirmed:
+                return None
+            del self.pending[sector_id]
+            self.stats["acknowledged"] += 1
+            return command
+
+    def forget_sector(self, sector_id):
+        """Stop tracking (and retrying) the sector's pending command."""
+        with self.lock:
+            return self.pending.pop(sector_id, None)
+
+    def due_retries(self, now=None):
+        """Commands whose acknowledgement timed out and should be published again."""
+        now = time.monotonic() if now is None else now
+        retries = []
+        with self.lock:
+            for sector_id, command in list(self.pending.items()):
+                if now - command.sent_at < self.ack_timeout:
+                    continue
+                if command.attempts > self.max_retries:
+                    del self.pending[sector_id]
+                    self.stats["expired"] += 1
+                    logger.warning(f"Valve command {command.action} for sector {sector_id} "
+                                   f"was not acknowledged after {command.attempts} attempts")
+                    continue
+                command.attempts += 1
+                command.sent_at = now
+                self.stats["retried"] += 1
+                retries.append(command)
+        return retries
+
+    def get_status(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return {
+                "pending": [command.to_dict(now) for command in self.pending.values()],
+                "stats": dict(self.stats)
+            }
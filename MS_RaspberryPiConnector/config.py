@@ -22,9 +22,18 @@ USE_MQTT = True
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "sensor/readings"
+# Publish to MQTT_TOPIC/<sector>/<device> instead of the flat topic
+MQTT_HIERARCHICAL_TOPICS = True
 MQTT_CLIENT_ID = "raspberrypi_simulator"
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
+# Payload codec for sensor readings: "json", "msgpack" or "struct" (compact
+# fixed layout). Must match TOPIC_CODECS in MessageBroker/config.py
+MQTT_PAYLOAD_CODEC = "json"
+# Fraction of readings carrying a latency trace context (dropped by the
+# "struct" codec), and how often recorded spans are exported to system/traces
+TRACE_SAMPLE_RATE = 1.0
+TRACE_EXPORT_INTERVAL = 5.0
 
 # New message broker config for valve control
 VALVE_CONTROL_ENABLED = True
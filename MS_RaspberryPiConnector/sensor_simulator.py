@@ -7,9 +7,21 @@ import logging
 import requests
 from datetime import datetime
 import math
+import os
+import sys
 import config
 from storage import StorageManager
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'MessageBroker')))
+try:
+    import codec as payload_codec
+    import topics
+    import tracing
+except ImportError:
+    payload_codec = None
+    topics = None
+    tracing = None
+
 if config.USE_MQTT:
     try:
         import paho.mqtt.client as mqtt
@@ -33,6 +45,10 @@ class SensorSimulator:
         self.last_reading_time = None
         self.storage = StorageManager()
         self.phase = 0.0
+        self.payload_codec = None
+        self.tracer = tracing.SpanCollector("sensor_simulator") if tracing is not None else None
+        if payload_codec is not None:
+            self.payload_codec = payload_codec.get_codec(getattr(config, 'MQTT_PAYLOAD_CODEC', 'json'))
         if config.USE_MQTT:
             self.mqtt_client = mqtt.Client(client_id=config.MQTT_CLIENT_ID, protocol=mqtt.MQTTv311)
             if config.MQTT_USERNAME and config.MQTT_PASSWORD:
@@ -45,6 +61,11 @@ class SensorSimulator:
                 self.mqtt_client.connect(config.MQTT_BROKER, config.MQTT_PORT)
                 self.mqtt_client.loop_start()
                 logger.info(f"Connected to MQTT broker at {config.MQTT_BROKER}:{config.MQTT_PORT}")
+                if self.tracer:
+                    self.tracer.start_exporter(
+                        lambda topic, message: self.mqtt_client.publish(topic, json.dumps(message), qos=0),
+                        interval=getattr(config, 'TRACE_EXPORT_INTERVAL', 5.0)
+                    )
             except Exception as e:
                 logger.error(f"Failed to connect to MQTT broker: {e}")
                 config.USE_MQTT = False
@@ -118,6 +139,7 @@ class SensorSimulator:
         return round(pressure, 2)
 
     def get_sensor_readings(self, device_id=None):
+        origin_ns = time.time_ns()
         timestamp = datetime.now().isoformat()
         temperature = self.generate_temperature()
         pressure = self.generate_pressure()
@@ -162,6 +184,11 @@ class SensorSimulator:
             }
         }
         
+        if self.tracer:
+            trace_context = tracing.maybe_new_trace(getattr(config, 'TRACE_SAMPLE_RATE', 1.0), origin_ns)
+            if trace_context:
+                data[tracing.TRACE_FIELD] = trace_context
+        
         self.last_reading_time = timestamp
         logger.debug(f"Generated readings: Temp={temperature}°C, Pressure={pressure}hPa")
         return data
@@ -197,9 +224,25 @@ class SensorSimulator:
     
     def send_data_mqtt(self, data):
         try:
+            trace_context = tracing.extract(data) if self.tracer else None
+            if trace_context:
+                tracing.inject(data, trace_context)
+                self.tracer.record_since_origin("sensor.generate_to_publish", trace_context)
+            
+            topic = config.MQTT_TOPIC
+            if topics is not None and getattr(config, 'MQTT_HIERARCHICAL_TOPICS', False):
+                sector_id, device_id = topics.reading_route(data)
+                topic = topics.sensor_topic(sector_id, device_id, root=config.MQTT_TOPIC)
+            if self.payload_codec is not None:
+                # Content type is signalled through the topic suffix (MQTT v3.1.1)
+                payload, used_codec = payload_codec.encode(data, self.payload_codec)
+                topic = payload_codec.topic_with_suffix(topic, used_codec)
+            else:
+                payload = json.dumps(data)
+            
             result = self.mqtt_client.publish(
-                config.MQTT_TOPIC,
-                json.dumps(data),
+                topic,
+                payload,
                 qos=1
             )
             
@@ -3,6 +3,7 @@ import logging
 import threading
 import time
 from datetime import datetime
+from collections import OrderedDict
 import config as local_config  # Rename to avoid namespace conflicts
 from storage import StorageManager
 import sys
@@ -16,16 +17,20 @@ try:
     # Import the broker's config module explicitly for MQTT client
     from messagebroker import config as broker_config
     from messagebroker.client import MQTTClient
+    from messagebroker import topics, tracing
 except ImportError:
     # Fall back to direct import if the module structure is different
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     try:
         from messagebroker import config as broker_config
         from messagebroker.client import MQTTClient
+        from messagebroker import topics, tracing
     except ImportError:
         print("Warning: Could not import message broker client. Running in standalone mode.")
         broker_config = None
         MQTTClient = None
+        topics = None
+        tracing = None
 
 # Set up logging
 logger = logging.getLogger('valve_controller')
@@ -56,6 +61,14 @@ class ValveMessageHandler:
         # MQTT client for message broker
         self.broker_client = None
         
+        # Recently executed command IDs and the resulting state, so retried
+        # commands are confirmed again instead of actuating the valve twice
+        self.handled_commands = OrderedDict()
+        self.max_handled_commands = 1024
+        
+        # Latency spans for traced valve commands
+        self.tracer = tracing.SpanCollector("valve_handler") if tracing is not None else None
+        
         if self.broker_enabled and MQTTClient is not None:
             client_id = f"valve_handler_{int(time.time())}"
             # Ensure broker_config is properly referenced
@@ -92,9 +105,18 @@ class ValveMessageHandler:
                 success = self.broker_client.connect(host=self.broker_host, port=self.broker_port)
                 if success:
                     self.broker_client.start()
-                    # Subscribe to valve control topic
-                    self.broker_client.subscribe(self.control_topic, qos=1, callback=self._on_control_message)
-                    logger.info(f"Subscribed to valve control topic: {self.control_topic}")
+                    # Subscribe to the per-sector valve control topics
+                    control_filter = topics.valve_control_filter(root=self.control_topic)
+                    self.broker_client.subscribe(control_filter, qos=1, callback=self._on_control_message, decoded=True)
+                    logger.info(f"Subscribed to valve control topic: {control_filter}")
+                    # Answer correlated status requests from ValveControlClient.get_valve_status
+                    self.broker_client.serve(f"{self.status_topic}/request", self.handle_status_request)
+                    logger.info(f"Serving valve status requests on topic: {self.status_topic}/request")
+                    if self.tracer:
+                        self.tracer.start_exporter(
+                            lambda topic, message: self.broker_client.publish(topic, message, qos=0),
+                            interval=getattr(local_config, 'TRACE_EXPORT_INTERVAL', 5.0)
+                        )
                 else:
                     logger.error("Failed to connect to message broker")
             except Exception as e:
@@ -118,6 +140,8 @@ class ValveMessageHandler:
         self.running = False
         
         # Disconnect from message broker
+        if self.tracer:
+            self.tracer.stop_exporter()
         if self.broker_client:
             self.broker_client.stop()
             
@@ -140,12 +164,17 @@ class ValveMessageHandler:
         """Handle valve control messages received from message broker"""
         logger.info(f"Received valve control message on topic {topic}: {payload}")
         try:
-            # Decode JSON message if it's bytes
+            # Payload arrives already decoded by the broker client's codec layer
             if isinstance(payload, bytes):
                 payload = payload.decode('utf-8')
+            
+            sector_id = topics.parse_valve_control_topic(topic, root=self.control_topic)
+            if sector_id is None:
+                # e.g. valve/control/ack
+                return
+            if isinstance(payload, dict):
+                payload.setdefault('sector_id', sector_id)
                 
-            # Parse message and handle it
-            message = json.loads(payload)
             self.handle_message(payload)
         except Exception as e:
             logger.error(f"Error processing control message: {e}")
@@ -169,18 +198,24 @@ class ValveMessageHandler:
                 
             logger.info(f"Received valve control: Sector {sector_id}, Action {action}")
             
+            context = tracing.extract(payload) if self.tracer else None
+            if context:
+                self.tracer.record_transit("mqtt.control_to_valve", context)
+            
+            command_id = payload.get('command_id')
+            if command_id and command_id in self.handled_commands:
+                logger.info(f"Valve command {command_id} already executed, re-sending status")
+                return self.publish_valve_status(sector_id, self.handled_commands[command_id], context, command_id)
+            
             # Process the action
+            started = time.perf_counter()
             if action.lower() == 'open':
                 result = self.storage.open_valve(sector_id)
-                if result:
-                    self.publish_valve_status(sector_id, "open")
-                return result
+                state = "open"
                 
             elif action.lower() == 'close':
                 result = self.storage.close_valve(sector_id)
-                if result:
-                    self.publish_valve_status(sector_id, "closed")
-                return result
+                state = "closed"
                 
             elif action.lower() == 'partial':
                 percentage = payload.get('percentage', 50)  # Default to 50% if not specified
@@ -192,13 +227,23 @@ class ValveMessageHandler:
                     percentage = 50  # Default to 50% if invalid
                     
                 result = self.storage.set_valve_partial(sector_id, percentage)
-                if result:
-                    self.publish_valve_status(sector_id, f"partially_open_{percentage}%")
-                return result
+                state = f"partially_open_{percentage}%"
                 
             else:
                 logger.error(f"Invalid valve action: {action}")
                 return False
+            
+            if context:
+                self.tracer.record("valve.actuate", (time.perf_counter() - started) * 1000, context["trace_id"])
+                self.tracer.record_since_origin("loop.sensor_to_actuation", context)
+            
+            if result:
+                if command_id:
+                    self.handled_commands[command_id] = state
+                    while len(self.handled_commands) > self.max_handled_commands:
+                        self.handled_commands.popitem(last=False)
+                self.publish_valve_status(sector_id, state, context, command_id)
+            return result
                 
         except json.JSONDecodeError:
             logger.error("Failed to parse valve control message as JSON")
@@ -207,7 +252,30 @@ class ValveMessageHandler:
             logger.error(f"Error processing valve control message: {e}")
             return False
             
-    def publish_valve_status(self, sector_id, state):
+    def handle_status_request(self, request):
+        """Build the response for a valve status request"""
+        sector_id = request.get('sector_id')
+        try:
+            valve = self.storage.get_valve(sector_id)
+        except ValueError:
+            valve = None
+            
+        if not valve:
+            logger.warning(f"Valve status requested for unknown sector {sector_id}")
+            return {
+                "timestamp": datetime.now().isoformat(),
+                "sector_id": sector_id,
+                "error": "unknown sector"
+            }
+            
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "sector_id": sector_id,
+            "valve_state": valve.state,
+            "last_action": valve.last_action_timestamp
+        }
+            
+    def publish_valve_status(self, sector_id, state, trace_context=None, command_id=None):
         """Publish valve status update to the message broker"""
         try:
             valve = self.storage.get_valve(sector_id)
@@ -221,13 +289,17 @@ class ValveMessageHandler:
                 "valve_state": state,
                 "last_action": valve.last_action_timestamp
             }
+            if command_id:
+                status_message["command_id"] = command_id
+            if trace_context:
+                tracing.inject(status_message, trace_context)
             
             # Publish through message broker if connected
             if self.broker_client and self.broker_enabled:
                 logger.info(f"Publishing valve status to {self.status_topic}")
                 return self.broker_client.publish(
                     self.status_topic,
-                    json.dumps(status_message),
+                    status_message,
                     qos=1
                 )
             else:
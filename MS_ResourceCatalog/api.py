@@ -28,6 +28,9 @@ class ResourceCatalogAPI:
                 num_cleaned = self.storage.cleanup_stale_entries(timeout)
                 if num_cleaned > 0:
                     cherrypy.log(f"Marked {num_cleaned} stale entries as offline")
+                num_expired = self.storage.expire_partition_members(self.config.get("timeout", "partition_member"))
+                if num_expired > 0:
+                    cherrypy.log(f"Removed {num_expired} silent partition members and rebalanced their sectors")
             except Exception as e:
                 cherrypy.log.error(f"Error in cleanup worker: {e}")
             
@@ -274,6 +277,81 @@ class ResourceCatalogAPI:
         except Exception as e:
             return self._error(f"Error retrieving services: {e}")
     
+    # PARTITION ENDPOINTS
+    # Instances of a partitioned service (e.g. Control Center) share out the
+    # group's sectors; each heartbeat returns the sectors the instance owns
+    
+    def _partition_view(self, partition, member_id=None):
+        view = {
+            "version": partition["version"],
+            "sectors": partition["sectors"],
+            "members": sorted(partition["members"]),
+            "assignment": partition["assignment"]
+        }
+        if member_id is not None:
+            view["owned_sectors"] = sorted(
+                sector for sector, owner in partition["assignment"].items() if owner == member_id
+            )
+        return view
+    
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def partition(self, group=None, **params):
+        """Get the sector assignment of a partition group"""
+        if not group:
+            return self._error("Partition group is required", 400)
+        
+        try:
+            partition = self.storage.get_partition(group)
+            if partition:
+                return self._success(self._partition_view(partition))
+            else:
+                return self._error(f"Partition group {group} not found", 404)
+        except Exception as e:
+            return self._error(f"Error retrieving partition: {e}")
+    
+    @cherrypy.expose
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    def join_partition(self):
+        """Join a partition group or renew membership (heartbeat)"""
+        try:
+            data = cherrypy.request.json
+            
+            for field in ["group", "member_id"]:
+                if field not in data:
+                    return self._error(f"Missing required field: {field}")
+            
+            partition = self.storage.join_partition(
+                data["group"],
+                data["member_id"],
+                sectors=data.get("sectors", []),
+                endpoints=data.get("endpoints", {}),
+                member_timeout=self.config.get("timeout", "partition_member")
+            )
+            return self._success(self._partition_view(partition, data["member_id"]))
+        except Exception as e:
+            return self._error(f"Error joining partition: {e}")
+    
+    @cherrypy.expose
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    def leave_partition(self):
+        """Leave a partition group, handing its sectors to the remaining members"""
+        try:
+            data = cherrypy.request.json
+            
+            for field in ["group", "member_id"]:
+                if field not in data:
+                    return self._error(f"Missing required field: {field}")
+            
+            if self.storage.leave_partition(data["group"], data["member_id"]):
+                return self._success(None, f"{data['member_id']} left partition {data['group']}")
+            else:
+                return self._error(f"{data['member_id']} is not a member of partition {data['group']}", 404)
+        except Exception as e:
+            return self._error(f"Error leaving partition: {e}")
+    
 
     # sensors data endpoint for telegram bot 
     @cherrypy.expose
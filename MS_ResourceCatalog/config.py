@@ -15,7 +15,8 @@ DEFAULT_CONFIG = {
     },
     "timeout": {
         "device_offline": 300,  # 5 minutes
-        "cleanup_interval": 60  # 1 minute
+        "cleanup_interval": 60,  # 1 minute
+        "partition_member": 30  # members without a heartbeat lose their sectors
     },
     "logging": {
         "level": "INFO",
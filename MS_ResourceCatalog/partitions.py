@@ -0,0 +1,36 @@
+def assign_sectors(sectors, members, current=None):
+    """Spread sectors over members so that their counts differ by at most one.
+
+    Sectors stay with their current owner where the balance allows it, so a
+    member joining or leaving only moves the sectors it takes over or gives up.
+    Returns {sector_id: member_id}.
+    """
+    members = sorted(members)
+    if not members:
+        return {}
+    current = current or {}
+    sectors = sorted(sectors)
+    base, extra = divmod(len(sectors), len(members))
+    load = {member: 0 for member in members}
+    assignment = {}
+
+    # Keep sectors with a live owner, up to base each, then up to the extras
+    for sector in sectors:
+        owner = current.get(sector)
+        if owner in load and load[owner] < base:
+            assignment[sector] = owner
+            load[owner] += 1
+    for sector in sectors:
+        owner = current.get(sector)
+        if sector not in assignment and extra and owner in load and load[owner] == base:
+            assignment[sector] = owner
+            load[owner] += 1
+            extra -= 1
+
+    # Hand the rest to the least loaded members
+    for sector in sectors:
+        if sector not in assignment:
+            owner = min(members, key=lambda member: (load[member], member))
+            assignment[sector] = owner
+            load[owner] += 1
+    return assignment
@@ -1,8 +1,10 @@
 import json
 import os
 import time
+import threading
 from tinydb import TinyDB, Query
 from models import Device, Service
+from partitions import assign_sectors
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_DB_PATH = os.path.join(BASE_DIR, "catalog_db.json")
@@ -15,6 +17,8 @@ class StorageManager:
         os.makedirs(os.path.dirname(db_path) if os.path.dirname(db_path) else '.', exist_ok=True)
         self.db_path = db_path
         self.db = {}
+        # Partition membership is read-modify-write from concurrent requests
+        self.partition_lock = threading.Lock()
         self.load_db()
     
     def load_db(self):
@@ -135,4 +139,68 @@ class StorageManager:
                 self.update_service_status(service_id, "offline")
                 stale_count += 1
                 
-        return stale_count
\ No newline at end of file
+        return stale_count
+    
+    def get_partition(self, group):
+        with self.partition_lock:
+            partition = self.db.get("partitions", {}).get(group)
+            return json.loads(json.dumps(partition)) if partition else None
+    
+    def join_partition(self, group, member_id, sectors=None, endpoints=None, member_timeout=30):
+        """Record a heartbeat of member_id, rebalancing the group's sectors if
+        its membership or sector set changed; returns the partition."""
+        now = time.time()
+        with self.partition_lock:
+            partition = self.db.setdefault("partitions", {}).setdefault(
+                group, {"version": 0, "sectors": [], "members": {}, "assignment": {}}
+            )
+            changed = member_id not in partition["members"]
+            partition["members"][member_id] = {"last_seen": now, "endpoints": endpoints or {}}
+            
+            new_sectors = set(sectors or []) - set(partition["sectors"])
+            if new_sectors:
+                partition["sectors"] = sorted(set(partition["sectors"]) | new_sectors)
+                changed = True
+            
+            changed = self._expire_members(partition, now - member_timeout) or changed
+            if changed:
+                self._rebalance(partition)
+            self.save_db()
+            return json.loads(json.dumps(partition))
+    
+    def leave_partition(self, group, member_id):
+        with self.partition_lock:
+            partition = self.db.get("partitions", {}).get(group)
+            if not partition or member_id not in partition["members"]:
+                return False
+            del partition["members"][member_id]
+            self._rebalance(partition)
+            self.save_db()
+            return True
+    
+    def expire_partition_members(self, member_timeout=30):
+        """Drop members without a recent heartbeat and hand their sectors to the others."""
+        expired = 0
+        threshold = time.time() - member_timeout
+        with self.partition_lock:
+            for partition in self.db.get("partitions", {}).values():
+                before = len(partition["members"])
+                if self._expire_members(partition, threshold):
+                    self._rebalance(partition)
+                    expired += before - len(partition["members"])
+            if expired:
+                self.save_db()
+        return expired
+    
+    def _expire_members(self, partition, threshold):
+        stale = [member_id for member_id, member in partition["members"].items()
+                 if member["last_seen"] < threshold]
+        for member_id in stale:
+            del partition["members"][member_id]
+        return bool(stale)
+    
+    def _rebalance(self, partition):
+        assignment = assign_sectors(partition["sectors"], partition["members"], partition["assignment"])
+        if assignment != partition["assignment"]:
+            partition["assignment"] = assignment
+            partition["version"] += 1
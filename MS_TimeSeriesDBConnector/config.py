@@ -9,6 +9,9 @@ MQTT_KEEPALIVE = 60
 MQTT_CLIENT_ID = "timeseries_db_connector"
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
+# Instances in the same consumer group split incoming messages between them;
+# set SMARTBOLT_INSTANCE_ID when running several instances on one host
+MQTT_CONSUMER_GROUP = "timeseries_db_connector"
 
 # Topics to subscribe to
 SENSOR_DATA_TOPIC = "sensor/readings"
@@ -22,14 +22,16 @@ parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
 
 try:
-    from MessageBroker.client import MQTTClient
+    from MessageBroker.client import MQTTClient, stable_client_id
+    from MessageBroker import topics
 except ImportError:
     # Try an alternate path in case directory structure is different
     alt_broker_path = os.path.join(parent_dir, 'MessageBroker')
     if os.path.exists(alt_broker_path):
         sys.path.insert(0, alt_broker_path)
         try:
-            from MessageBroker.client import MQTTClient  # Direct import when path is added
+            from MessageBroker.client import MQTTClient, stable_client_id  # Direct import when path is added
+            from MessageBroker import topics
         except ImportError:
             print("Error: Could not import message broker client. Please ensure the MessageBroker module is available.")
             print(f"Tried paths: {parent_dir}, {alt_broker_path}")
@@ -70,7 +72,7 @@ class TimeSeriesConnector:
         
     def connect_to_broker(self):
         try:
-            client_id = f"timeseries_connector_{int(time.time())}"
+            client_id = stable_client_id(config.MQTT_CLIENT_ID)
             self.mqtt_client = MQTTClient(client_id=client_id)
             
             logger.info(f"Connecting to message broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
@@ -96,17 +98,21 @@ class TimeSeriesConnector:
             return False
             
         try:
+            sensor_filter = topics.sensor_filter(root=config.SENSOR_DATA_TOPIC)
             self.mqtt_client.subscribe(
-                config.SENSOR_DATA_TOPIC, 
+                sensor_filter, 
                 qos=1,
-                callback=self.process_sensor_data
+                callback=self.process_sensor_data,
+                decoded=True,
+                group=config.MQTT_CONSUMER_GROUP
             )
-            logger.info(f"Subscribed to sensor data topic: {config.SENSOR_DATA_TOPIC}")
+            logger.info(f"Subscribed to sensor data topic: {sensor_filter}")
             
             self.mqtt_client.subscribe(
                 config.VALVE_STATUS_TOPIC, 
                 qos=1,
-                callback=self.process_valve_status
+                callback=self.process_valve_status,
+                group=config.MQTT_CONSUMER_GROUP
             )
             logger.info(f"Subscribed to valve status topic: {config.VALVE_STATUS_TOPIC}")
             
@@ -180,12 +186,14 @@ class TimeSeriesConnector:
         """Process sensor data received from the message broker"""
         # print (f"@@@@@@@------- payload --------@@@@@@@@ {payload}")
         try:
-            # Convert payload from bytes to string if necessary
-            if isinstance(payload, bytes):
-                payload = payload.decode('utf-8')
-                
-            # Parse the JSON message
-            data = json.loads(payload)
+            # Payload is decoded by the broker client's codec layer; fall back
+            # to JSON parsing when it could not be decoded
+            if isinstance(payload, dict):
+                data = payload
+            else:
+                if isinstance(payload, bytes):
+                    payload = payload.decode('utf-8')
+                data = json.loads(payload)
             logger.debug(f"Received sensor data: {data}")
             
             timestamp = data.get('timestamp', datetime.now().isoformat())
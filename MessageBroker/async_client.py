@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+import logging
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+import paho.mqtt.client as mqtt
+
+try:
+    from messagebroker.client import broker_config, PayloadCodecMixin, ReceivedPayload
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from client import broker_config, PayloadCodecMixin, ReceivedPayload
+
+logger = logging.getLogger('mqtt_async_client')
+
+Message = namedtuple('Message', ['topic', 'payload', 'qos'])
+
+
+class MessageStream:
+    """Async iterator over messages matching a topic filter.
+
+    Created through AsyncMQTTClient.messages(); the subscription is made on
+    first iteration and the stream ends when it is closed or the client
+    disconnects. Closing the last stream of a topic that has no callbacks
+    also unsubscribes from it.
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, client, topic, qos=0, decoded=False, maxsize=1000):
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+        self.decoded = decoded
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.closed = False
+        self._subscribed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._subscribed:
+            self._subscribed = True
+            await self.client.subscribe(self.topic, qos=self.qos)
+
+        message = await self.queue.get()
+        if message is self._CLOSED:
+            raise StopAsyncIteration
+        return message
+
+    def matches(self, topic):
+        return self.topic == topic or mqtt.topic_matches_sub(self.topic, topic)
+
+    def _put(self, message):
+        if self.closed:
+            return
+        if self.queue.full():
+            # Slow consumer: keep the newest messages
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Message stream on {self.topic} is full, dropped {self.dropped} messages")
+        self.queue.put_nowait(message)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.client._remove_stream(self)
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(self._CLOSED)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AsyncMQTTClient(PayloadCodecMixin):
+    """asyncio counterpart of MQTTClient.
+
+    paho's socket is driven directly from the running event loop through
+    add_reader/add_writer, so no network or worker threads are started.
+    Callbacks may be plain functions or coroutine functions.
+    """
+
+    MISC_LOOP_INTERVAL = 1.0
+    MAX_RECONNECT_DELAY = 30
+
+    def __init__(self, client_id=None, clean_session=True):
+        if not client_id:
+            client_id = f"smartbolt_async_client_{int(time.time())}"
+
+        self.client_id = client_id
+        self.protocol_v5 = getattr(broker_config, 'MQTT_V5_ENABLED', False)
+        if self.protocol_v5:
+            self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        self.connected = False
+        self.last_connection_time = None
+        self.loop = None
+
+        self.subscriptions = {}
+        self.subscription_groups = {}
+        self.message_callbacks = {}
+        self.decoded_callbacks = set()
+        self.streams = []
+
+        self._init_codecs()
+
+        self._connect_future = None
+        self._pending_publishes = {}
+        self._pending_subscribes = {}
+        self._callback_tasks = set()
+        self._misc_task = None
+        self._closing = False
+        self._reconnect_delay = 1
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        mqtt_username = getattr(broker_config, 'MQTT_USERNAME', "")
+        mqtt_password = getattr(broker_config, 'MQTT_PASSWORD', "")
+        tls_enabled = getattr(broker_config, 'TLS_ENABLED', False)
+
+        if mqtt_username and mqtt_password:
+            self.client.username_pw_set(mqtt_username, mqtt_password)
+
+        if tls_enabled:
+            self.client.tls_set()
+
+    # Event loop integration
+
+    # paho's connect()/reconnect() block on DNS and the TCP handshake, so they
+    # run in the loop's executor and the socket callbacks they trigger are
+    # handed to the loop. Sockets are passed as file descriptors, since paho
+    # closes a socket right after its close callback.
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._watch_socket, sock.fileno())
+
+    def _watch_socket(self, fd):
+        self.loop.add_reader(fd, self.client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_reader, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock.fileno())
+
+    async def _misc_loop(self):
+        # Keepalive pings, retries and reconnection; everything else is
+        # driven by socket readiness
+        while not self._closing:
+            rc = self.client.loop_misc()
+            if rc == mqtt.MQTT_ERR_NO_CONN and not self._closing:
+                await self._reconnect()
+            await asyncio.sleep(self.MISC_LOOP_INTERVAL)
+
+    async def _reconnect(self):
+        await asyncio.sleep(self._reconnect_delay)
+        try:
+            logger.info("Reconnecting to MQTT broker")
+            await self.loop.run_in_executor(None, self.client.reconnect)
+            self._reconnect_delay = 1
+        except Exception as e:
+            logger.warning(f"Reconnect to MQTT broker failed: {e}")
+            self._reconnect_delay = min(self._reconnect_delay * 2, self.MAX_RECONNECT_DELAY)
+
+    # paho callbacks, all invoked from the event loop
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self.connected = True
+            self.last_connection_time = datetime.now()
+            logger.info(f"Connected to MQTT broker as {self.client_id}")
+
+            for topic, qos in self.subscriptions.items():
+                group = self.subscription_groups.get(topic)
+                self.client.subscribe([(broker_topic, qos) for broker_topic in self._broker_topics(topic, group)])
+                logger.debug(f"Resubscribed to {topic} with QoS {qos}")
+        else:
+            self.connected = False
+            logger.error(f"Failed to connect to MQTT broker with code: {rc}")
+
+        if self._connect_future is not None and not self._connect_future.done():
+            self._connect_future.set_result(rc == 0)
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if rc != 0:
+            logger.warning(f"Unexpected disconnection from MQTT broker with code: {rc}")
+        else:
+            logger.info("Disconnected from MQTT broker")
+
+    def _on_publish(self, client, userdata, mid, *args):
+        future = self._pending_publishes.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        future = self._pending_subscribes.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(granted_qos)
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            topic, codec = self._message_codec(msg)
+            message = ReceivedPayload(msg.payload, codec)
+
+            for sub_topic, callbacks in self.message_callbacks.items():
+                if sub_topic == topic or (('+' in sub_topic or '#' in sub_topic) and
+                                          mqtt.topic_matches_sub(sub_topic, topic)):
+                    for callback in callbacks:
+                        self._invoke(callback, topic, message.for_callback(callback in self.decoded_callbacks), msg.qos)
+
+            for stream in self.streams:
+                if stream.matches(topic):
+                    stream._put(Message(topic, message.for_callback(stream.decoded), msg.qos))
+        except Exception as e:
+            logger.error(f"Error handling message: {e}")
+
+    def _invoke(self, callback, topic, payload, qos):
+        try:
+            result = callback(topic, payload, qos)
+            if asyncio.iscoroutine(result):
+                task = self.loop.create_task(result)
+                self._callback_tasks.add(task)
+                task.add_done_callback(self._callback_done)
+        except Exception as e:
+            logger.error(f"Error in callback for topic {topic}: {e}")
+
+    def _callback_done(self, task):
+        self._callback_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error in async callback: {task.exception()}")
+
+    def _remove_stream(self, stream):
+        if stream in self.streams:
+            self.streams.remove(stream)
+        if not stream._subscribed or stream.topic in self.message_callbacks:
+            return
+        if any(other._subscribed and other.topic == stream.topic for other in self.streams):
+            return
+        self._unsubscribe(stream.topic)
+
+    def _unsubscribe(self, topic):
+        if topic in self.subscriptions:
+            del self.subscriptions[topic]
+        group = self.subscription_groups.pop(topic, None)
+
+        if topic in self.message_callbacks:
+            for callback in self.message_callbacks[topic]:
+                self.decoded_callbacks.discard(callback)
+            del self.message_callbacks[topic]
+
+        if self.connected:
+            result, _ = self.client.unsubscribe(self._broker_topics(topic, group))
+            return result == mqtt.MQTT_ERR_SUCCESS
+
+        return False
+
+    # Public API
+
+    async def connect(self, host=None, port=None, keepalive=60, timeout=10.0):
+        if host is None:
+            host = getattr(broker_config, 'MQTT_HOST', 'localhost')
+        if port is None:
+            port = getattr(broker_config, 'MQTT_PORT', 1883)
+
+        self.loop = asyncio.get_running_loop()
+        self._closing = False
+        self._connect_future = self.loop.create_future()
+
+        try:
+            await asyncio.wait_for(
+                self.loop.run_in_executor(None, self.client.connect, host, port, keepalive), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out connecting to MQTT broker at {host}:{port}")
+            return False
+        except Exception as e:
+            logger.error(f"Failed to connect to MQTT broker: {e}")
+            return False
+
+        try:
+            return await asyncio.wait_for(self._connect_future, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out waiting for MQTT broker at {host}:{port}")
+            return False
+
+    async def disconnect(self):
+        self._closing = True
+
+        if self.connected:
+            try:
+                self.client.disconnect()
+            except Exception as e:
+                logger.error(f"Error disconnecting from MQTT broker: {e}")
+
+        for stream in list(self.streams):
+            stream.close()
+
+        for pending in (self._pending_publishes, self._pending_subscribes):
+            for future in pending.values():
+                if not future.done():
+                    future.cancel()
+            pending.clear()
+
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            try:
+                await self._misc_task
+            except asyncio.CancelledError:
+                pass
+            self._misc_task = None
+
+        self.connected = False
+
+    async def __aenter__(self):
+        if not await self.connect():
+            raise ConnectionError("Could not connect to MQTT broker")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def subscribe(self, topic, qos=0, callback=None, decoded=False, group=None, timeout=10.0):
+        if not self.connected:
+            logger.warning(f"Not connected to broker, queuing subscription to {topic}")
+
+        self.subscriptions[topic] = qos
+        if group:
+            self.subscription_groups[topic] = group
+
+        if callback:
+            if topic not in self.message_callbacks:
+                self.message_callbacks[topic] = []
+            self.message_callbacks[topic].append(callback)
+            if decoded:
+                self.decoded_callbacks.add(callback)
+
+        if not self.connected:
+            return False
+
+        result, mid = self.client.subscribe([(broker_topic, qos) for broker_topic in self._broker_topics(topic, group)])
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            return False
+
+        future = self.loop.create_future()
+        self._pending_subscribes[mid] = future
+        try:
+            granted_qos = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._pending_subscribes.pop(mid, None)
+            logger.error(f"Timed out waiting for subscription to {topic}")
+            return False
+
+        # 0x80 is the SUBACK failure code (reason codes in MQTT v5)
+        return all(getattr(granted, 'value', granted) < 0x80 for granted in granted_qos)
+
+    async def unsubscribe(self, topic):
+        return self._unsubscribe(topic)
+
+    async def publish(self, topic, payload, qos=0, retain=False, timeout=10.0):
+        """Publish a message; for QoS 1/2 the call completes on broker acknowledgement."""
+        try:
+            topic, payload, properties = self._encode_payload(topic, payload)
+
+            if not self.connected:
+                logger.error("Cannot publish: not connected to broker")
+                return False
+
+            info = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            if qos == 0:
+                return True
+
+            future = self.loop.create_future()
+            self._pending_publishes[info.mid] = future
+            try:
+                await asyncio.wait_for(future, timeout)
+                return True
+            except asyncio.TimeoutError:
+                self._pending_publishes.pop(info.mid, None)
+                logger.error(f"Timed out waiting for acknowledgement of message {info.mid} on {topic}")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error publishing message: {e}")
+            return False
+
+    def messages(self, topic, qos=0, decoded=False, maxsize=1000):
+        stream = MessageStream(self, topic, qos=qos, decoded=decoded, maxsize=maxsize)
+        self.streams.append(stream)
+        return stream
+
+    async def wait_for_message(self, topic, timeout=5.0):
+        stream = self.messages(topic, decoded=True, maxsize=1)
+        try:
+            message = await asyncio.wait_for(stream.__anext__(), timeout)
+            return message.payload
+        except (asyncio.TimeoutError, StopAsyncIteration):
+            return None
+        finally:
+            stream.close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+End-to-end publish-to-callback latency benchmark for the MessageBroker clients.
+
+Runs against the embedded broker by default, so no mosquitto install is needed:
+
+    python benchmark.py --client both --messages 2000 --qos 1
+    python benchmark.py --host localhost --port 1883 --json results.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+from client import MQTTClient
+from async_client import AsyncMQTTClient
+from embedded_broker import EmbeddedBroker
+
+BENCHMARK_TOPIC = "benchmark/latency"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, latencies_ns, sent, elapsed):
+    latencies_us = sorted(value / 1000.0 for value in latencies_ns)
+    return {
+        "client": name,
+        "sent": sent,
+        "received": len(latencies_us),
+        "lost": sent - len(latencies_us),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_msg_s": round(len(latencies_us) / elapsed, 1) if elapsed else None,
+        "latency_us": {
+            "min": latencies_us[0] if latencies_us else None,
+            "p50": percentile(latencies_us, 50),
+            "p95": percentile(latencies_us, 95),
+            "p99": percentile(latencies_us, 99),
+            "max": latencies_us[-1] if latencies_us else None,
+            "mean": sum(latencies_us) / len(latencies_us) if latencies_us else None
+        }
+    }
+
+
+def make_payload(seq, padding):
+    return {"seq": seq, "sent_ns": time.perf_counter_ns(), "pad": padding}
+
+
+def pace(start, index, rate):
+    if rate:
+        delay = start + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_threaded(host, port, args):
+    latencies = []
+    done = threading.Event()
+
+    def on_message(topic, payload, qos):
+        latencies.append(time.perf_counter_ns() - payload["sent_ns"])
+        if len(latencies) >= args.messages:
+            done.set()
+
+    suffix = f"{os.getpid()}_{int(time.time())}"
+    subscriber = MQTTClient(f"bench_sub_{suffix}")
+    publisher = MQTTClient(f"bench_pub_{suffix}")
+    for client in (subscriber, publisher):
+        client.connect(host, port)
+        client.start()
+
+    deadline = time.time() + 10
+    while not (subscriber.connected and publisher.connected) and time.time() < deadline:
+        time.sleep(0.01)
+    if not (subscriber.connected and publisher.connected):
+        raise RuntimeError(f"Could not connect to broker at {host}:{port}")
+
+    subscriber.subscribe(BENCHMARK_TOPIC, args.qos, on_message, decoded=True)
+    time.sleep(0.2)
+
+    padding = "x" * args.payload_size
+    start = time.perf_counter()
+    for i in range(args.messages):
+        pace(start, i, args.rate)
+        publisher.publish(BENCHMARK_TOPIC, make_payload(i, padding), args.qos)
+    done.wait(args.timeout)
+    elapsed = time.perf_counter() - start
+
+    publisher.stop()
+    subscriber.stop()
+    return summarize("MQTTClient", latencies, args.messages, elapsed)
+
+
+async def _run_async(host, port, args):
+    latencies = []
+    done = asyncio.Event()
+
+    def on_message(topic, payload, qos):
+        latencies.append(time.perf_counter_ns() - payload["sent_ns"])
+        if len(latencies) >= args.messages:
+            done.set()
+
+    suffix = f"{os.getpid()}_{int(time.time())}"
+    subscriber = AsyncMQTTClient(f"bench_async_sub_{suffix}")
+    publisher = AsyncMQTTClient(f"bench_async_pub_{suffix}")
+    if not (await subscriber.connect(host, port) and await publisher.connect(host, port)):
+        raise RuntimeError(f"Could not connect to broker at {host}:{port}")
+    try:
+        await subscriber.subscribe(BENCHMARK_TOPIC, args.qos, on_message, decoded=True)
+
+        padding = "x" * args.payload_size
+        start = time.perf_counter()
+        for i in range(args.messages):
+            if args.rate:
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await publisher.publish(BENCHMARK_TOPIC, make_payload(i, padding), args.qos)
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+    finally:
+        await publisher.disconnect()
+        await subscriber.disconnect()
+
+    return summarize("AsyncMQTTClient", latencies, args.messages, elapsed)
+
+
+def run_async(host, port, args):
+    return asyncio.run(_run_async(host, port, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish-to-callback latency benchmark')
+    parser.add_argument('--client', choices=['threaded', 'async', 'both'], default='both')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=0)
+    parser.add_argument('--payload-size', type=int, default=64, help='Padding bytes added to each payload')
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second (0 = as fast as possible)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for outstanding messages')
+    parser.add_argument('--host', help='External broker host (default: start the embedded broker)')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='Write results to this file ("-" for stdout)')
+    args = parser.parse_args()
+
+    broker = None
+    results = {"config": vars(args).copy(), "runs": []}
+    if args.host:
+        host, port = args.host, args.port or 1883
+    else:
+        started = time.perf_counter()
+        broker = EmbeddedBroker("127.0.0.1", args.port).start_in_thread()
+        results["broker_startup_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        host, port = broker.host, broker.port
+
+    try:
+        if args.client in ('threaded', 'both'):
+            results["runs"].append(run_threaded(host, port, args))
+        if args.client in ('async', 'both'):
+            results["runs"].append(run_async(host, port, args))
+    finally:
+        if broker:
+            broker.stop_in_thread()
+
+    if args.json_path == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if "broker_startup_ms" in results:
+        print(f"Embedded broker started in {results['broker_startup_ms']:.1f} ms")
+    for run in results["runs"]:
+        latency = run["latency_us"]
+        if not run["received"]:
+            print(f"{run['client']}: no messages received")
+            continue
+        print(f"{run['client']}: {run['received']}/{run['sent']} msgs, "
+              f"{run['throughput_msg_s']} msg/s, latency us "
+              f"p50={latency['p50']:.0f} p95={latency['p95']:.0f} "
+              f"p99={latency['p99']:.0f} max={latency['max']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
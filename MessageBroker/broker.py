@@ -13,6 +13,7 @@ import string
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import config
+from traffic_stats import TrafficStats
 
 logging.basicConfig(
     filename=config.LOG_FILE,
@@ -30,6 +31,11 @@ logger.addHandler(console)
 class MessageBroker:
     def __init__(self):
         self.running = False
+        self.stats = TrafficStats(
+            max_topics=config.TRAFFIC_STATS_MAX_TOPICS,
+            window=config.TRAFFIC_STATS_WINDOW,
+            sample_rate=config.MESSAGE_SAMPLE_RATE
+        )
         self.broker = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.broker.on_connect = self.on_connect
         self.broker.on_message = self.on_message
@@ -47,9 +53,8 @@ class MessageBroker:
     
     def on_message(self, client, userdata, msg, *args, **kwargs):
         try:
-            logger.debug(f"Received message on topic {msg.topic}")
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"Message content: {payload}")
+            self.stats.record(msg.topic, len(msg.payload))
+            self.stats.sample(msg.topic, msg.payload)
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
@@ -79,9 +84,8 @@ class MessageBroker:
             logger.error(f"Error publishing message: {e}")
             return False
     
-
-    
-
+    def get_stats(self, top=None, sort="messages", prefix=None):
+        return self.stats.snapshot(top=top, sort=sort, prefix=prefix)
     
     def start(self):
         if self.running:
@@ -4,54 +4,198 @@ import json
 import time
 import logging
 import threading
+import functools
 from datetime import datetime
 from queue import Queue, Empty 
 import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import os
 import sys
+import socket
 
 try:
     from messagebroker import config as broker_config
 except ImportError:
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
     try:
-        import config as broker_config
+        # Imported as a package (e.g. MessageBroker.client): a flat `import config`
+        # would return the importing service's own config module
+        from . import config as broker_config
     except ImportError:
-        print("Warning: Could not import message broker config")
-        class MinimalConfig:
-            MQTT_HOST = "localhost"
-            MQTT_PORT = 1883
-            MQTT_USERNAME = ""
-            MQTT_PASSWORD = ""
-            TLS_ENABLED = False
-            VALVE_CONTROL_TOPIC = "valve/control"
-            VALVE_STATUS_TOPIC = "valve/status"
-        broker_config = MinimalConfig()
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        try:
+            import config as broker_config
+        except ImportError:
+            print("Warning: Could not import message broker config")
+            class MinimalConfig:
+                MQTT_HOST = "localhost"
+                MQTT_PORT = 1883
+                MQTT_USERNAME = ""
+                MQTT_PASSWORD = ""
+                TLS_ENABLED = False
+                VALVE_CONTROL_TOPIC = "valve/control"
+                VALVE_STATUS_TOPIC = "valve/status"
+            broker_config = MinimalConfig()
+
+try:
+    from messagebroker import codec as payload_codec
+    from messagebroker import rpc
+    from messagebroker import topics
+    from messagebroker.offline_buffer import OfflineBuffer
+except ImportError:
+    try:
+        from . import codec as payload_codec
+        from . import rpc
+        from . import topics
+        from .offline_buffer import OfflineBuffer
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import codec as payload_codec
+        import rpc
+        import topics
+        from offline_buffer import OfflineBuffer
 
 logger = logging.getLogger('mqtt_client')
 
-class MQTTClient:
+SHARED_SUBSCRIPTION_PREFIX = "$share"
+GROUP_MEMBERSHIP_TOPIC = getattr(broker_config, 'GROUP_MEMBERSHIP_TOPIC', "smartbolt/consumers")
+
+# Concrete topics whose codec is remembered; per-device topics make the
+# number of topics grow with the fleet, so the least recently used are dropped
+TOPIC_CODEC_CACHE_SIZE = 1024
+
+
+def shared_topic(topic, group):
+    return f"{SHARED_SUBSCRIPTION_PREFIX}/{group}/{topic}" if group else topic
+
+
+def stable_client_id(service_name, instance=None):
+    """Client ID that survives restarts: service name plus an instance name.
+
+    The instance defaults to SMARTBOLT_INSTANCE_ID or the host name; set
+    SMARTBOLT_INSTANCE_ID when running several instances on one host.
+    """
+    instance = instance or os.environ.get('SMARTBOLT_INSTANCE_ID') or socket.gethostname()
+    instance = ''.join(c if c.isalnum() or c in '-_' else '_' for c in instance)
+    return f"{service_name}_{instance}"
+
+class PayloadCodecMixin:
+    
+    def _init_codecs(self):
+        self.topic_codecs = getattr(broker_config, 'TOPIC_CODECS', {})
+        self.default_codec = payload_codec.get_codec(getattr(broker_config, 'DEFAULT_CODEC', 'json'))
+        self._topic_codec = functools.lru_cache(maxsize=TOPIC_CODEC_CACHE_SIZE)(self._lookup_topic_codec)
+    
+    def _message_codec(self, msg):
+        if self.protocol_v5:
+            properties = getattr(msg, 'properties', None)
+            content_type = getattr(properties, 'ContentType', None) if properties else None
+            if content_type:
+                return msg.topic, payload_codec.codec_for_content_type(content_type)
+        return payload_codec.split_topic_suffix(msg.topic)
+    
+    def _lookup_topic_codec(self, topic):
+        """Codec configured for topic; called through the _topic_codec LRU cache"""
+        name = self.topic_codecs.get(topic)
+        if name is None:
+            for pattern, pattern_codec in self.topic_codecs.items():
+                if ('+' in pattern or '#' in pattern) and mqtt.topic_matches_sub(pattern, topic):
+                    name = pattern_codec
+                    break
+        
+        return payload_codec.get_codec(name) if name else self.default_codec
+    
+    def _broker_topics(self, topic, group=None):
+        # With v3.1.1 the content type travels as a topic suffix, so every
+        # subscription also covers the suffixed topics of its configured codecs
+        broker_topics = [topic]
+        if self.protocol_v5 or topic.endswith('#'):
+            return [shared_topic(t, group) for t in broker_topics]
+        
+        codecs = {self.default_codec}
+        for pattern, name in self.topic_codecs.items():
+            pattern_wildcard = '+' in pattern or '#' in pattern
+            if (pattern == topic or
+                    (not pattern_wildcard and mqtt.topic_matches_sub(topic, pattern)) or
+                    (pattern_wildcard and mqtt.topic_matches_sub(pattern, topic))):
+                codecs.add(payload_codec.get_codec(name))
+        
+        for codec in codecs:
+            suffixed = payload_codec.topic_with_suffix(topic, codec)
+            if suffixed != topic:
+                broker_topics.append(suffixed)
+        return [shared_topic(t, group) for t in broker_topics]
+    
+    def _encode_payload(self, topic, payload, properties=None):
+        if isinstance(payload, (dict, list)):
+            payload, codec = payload_codec.encode(payload, self._topic_codec(topic))
+            if codec is not payload_codec.DEFAULT_CODEC:
+                if self.protocol_v5:
+                    if properties is None:
+                        properties = Properties(PacketTypes.PUBLISH)
+                    properties.ContentType = codec.content_type
+                else:
+                    topic = payload_codec.topic_with_suffix(topic, codec)
+        return topic, payload, properties
+
+
+class MQTTClient(PayloadCodecMixin):
     
     def __init__(self, client_id=None, clean_session=True):
         if not client_id:
             client_id = f"smartbolt_client_{int(time.time())}"
             
         self.client_id = client_id
-        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        self.protocol_v5 = getattr(broker_config, 'MQTT_V5_ENABLED', False)
+        if self.protocol_v5:
+            self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
         self.connected = False
         self.last_connection_time = None
         
         self.subscriptions = {}
+        self.subscription_groups = {}
         self.message_queue = Queue()
         self.message_callbacks = {}
+        self.decoded_callbacks = set()
+        # Guards the two callback tables: they are changed from other threads
+        # (e.g. resubscriptions after a sector handover) while messages are handled
+        self.callbacks_lock = threading.Lock()
+        # Topics subscribed only for wait_for_message(); unsubscribed when the last wait ends
+        self.wait_subscriptions = set()
+        
+        self._init_codecs()
         
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
         
+        # Consumer group membership is a retained message per client, cleared
+        # on clean shutdown or, via the will, when the connection is lost
+        self.membership_topic = f"{GROUP_MEMBERSHIP_TOPIC}/{client_id}"
+        self.client.will_set(self.membership_topic, b"", qos=1, retain=True)
+        
         self.worker_thread = None
         self.running = False
         
+        self.reply_topic = f"{rpc.REPLY_TOPIC_PREFIX}/{client_id}"
+        self.pending_requests = None
+        self._rpc_lock = threading.Lock()
+        
+        self.offline_buffer = None
+        if getattr(broker_config, 'OFFLINE_BUFFER_ENABLED', False):
+            buffer_dir = getattr(broker_config, 'OFFLINE_BUFFER_DIR', None)
+            self.offline_buffer = OfflineBuffer(
+                policies=getattr(broker_config, 'OFFLINE_BUFFER_POLICIES', None),
+                persist_path=os.path.join(buffer_dir, f"{client_id}.buffer") if buffer_dir else None,
+                ttl=getattr(broker_config, 'OFFLINE_BUFFER_TTL', None)
+            )
+        self.offline_buffer_exclude = getattr(broker_config, 'OFFLINE_BUFFER_EXCLUDE', ())
+        self.replay_rate = getattr(broker_config, 'OFFLINE_REPLAY_RATE', 100)
+        self.replay_thread = None
+        self._replay_lock = threading.Lock()
+        
         mqtt_username = getattr(broker_config, 'MQTT_USERNAME', "")
         mqtt_password = getattr(broker_config, 'MQTT_PASSWORD', "")
         tls_enabled = getattr(broker_config, 'TLS_ENABLED', False)
@@ -62,20 +206,27 @@ class MQTTClient:
         if tls_enabled:
             self.client.tls_set()
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             self.connected = True
             self.last_connection_time = datetime.now()
             logger.info(f"Connected to MQTT broker as {self.client_id}")
             
             for topic, qos in self.subscriptions.items():
-                self.client.subscribe(topic, qos)
+                for broker_topic in self._broker_topics(topic, self.subscription_groups.get(topic)):
+                    self.client.subscribe(broker_topic, qos)
                 logger.debug(f"Resubscribed to {topic} with QoS {qos}")
+            
+            if self.subscription_groups:
+                self._announce_membership()
+            
+            if self.offline_buffer is not None and len(self.offline_buffer):
+                self._start_replay()
         else:
             self.connected = False
             logger.error(f"Failed to connect to MQTT broker with code: {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         self.connected = False
         if rc != 0:
             logger.warning(f"Unexpected disconnection from MQTT broker with code: {rc}")
@@ -103,21 +254,22 @@ class MQTTClient:
     
     def _handle_message(self, msg):
         try:
-            if msg.topic in self.message_callbacks:
-                for callback in self.message_callbacks[msg.topic]:
-                    try:
-                        callback(msg.topic, msg.payload, msg.qos)
-                    except Exception as e:
-                        logger.error(f"Error in callback for topic {msg.topic}: {e}")
+            topic, codec = self._message_codec(msg)
+            message = ReceivedPayload(msg.payload, codec)
             
-            for topic, callbacks in self.message_callbacks.items():
-                if '+' in topic or '#' in topic:
-                    if mqtt.topic_matches_sub(topic, msg.topic):
-                        for callback in callbacks:
-                            try:
-                                callback(msg.topic, msg.payload, msg.qos)
-                            except Exception as e:
-                                logger.error(f"Error in callback for wildcard topic {topic}: {e}")
+            # Callbacks run outside the lock, so they may subscribe themselves
+            with self.callbacks_lock:
+                matched = [(topic, callback, callback in self.decoded_callbacks)
+                           for callback in self.message_callbacks.get(topic, ())]
+                for sub_topic, callbacks in self.message_callbacks.items():
+                    if ('+' in sub_topic or '#' in sub_topic) and mqtt.topic_matches_sub(sub_topic, topic):
+                        matched.extend((sub_topic, callback, callback in self.decoded_callbacks) for callback in callbacks)
+            
+            for sub_topic, callback, decoded in matched:
+                try:
+                    callback(topic, message.for_callback(decoded), msg.qos)
+                except Exception as e:
+                    logger.error(f"Error in callback for topic {sub_topic}: {e}")
         except Exception as e:
             logger.error(f"Error handling message: {e}")
     
@@ -165,49 +317,136 @@ class MQTTClient:
         self.running = False
         if self.worker_thread:
             self.worker_thread.join(timeout=2.0)
+        
+        if self.subscription_groups and self.connected:
+            self.client.publish(self.membership_topic, b"", qos=1, retain=True)
             
         self.disconnect()
         self.client.loop_stop()
         
         logger.info("MQTT client stopped")
     
-    def subscribe(self, topic, qos=0, callback=None):
+    def subscribe(self, topic, qos=0, callback=None, decoded=False, group=None):
+        """Subscribe to topic; with group, join the consumer group so that each
+        message is delivered to only one member ($share/<group>/<topic>)."""
         if not self.connected:
             logger.warning(f"Not connected to broker, queuing subscription to {topic}")
             
         self.subscriptions[topic] = qos
+        if group:
+            self.subscription_groups[topic] = group
         
+        with self.callbacks_lock:
+            self.wait_subscriptions.discard(topic)
         if callback:
-            if topic not in self.message_callbacks:
-                self.message_callbacks[topic] = []
-            self.message_callbacks[topic].append(callback)
+            with self.callbacks_lock:
+                if topic not in self.message_callbacks:
+                    self.message_callbacks[topic] = []
+                self.message_callbacks[topic].append(callback)
+                if decoded:
+                    self.decoded_callbacks.add(callback)
         
         if self.connected:
-            result, _ = self.client.subscribe(topic, qos)
-            return result == mqtt.MQTT_ERR_SUCCESS
+            results = [self.client.subscribe(broker_topic, qos)[0] for broker_topic in self._broker_topics(topic, group)]
+            if group:
+                self._announce_membership()
+            return all(result == mqtt.MQTT_ERR_SUCCESS for result in results)
         
         return False
     
     def unsubscribe(self, topic):
         if topic in self.subscriptions:
             del self.subscriptions[topic]
+        group = self.subscription_groups.pop(topic, None)
         
-        if topic in self.message_callbacks:
-            del self.message_callbacks[topic]
+        with self.callbacks_lock:
+            if topic in self.message_callbacks:
+                for callback in self.message_callbacks[topic]:
+                    self.decoded_callbacks.discard(callback)
+                del self.message_callbacks[topic]
         
         if self.connected:
-            result, _ = self.client.unsubscribe(topic)
+            result, _ = self.client.unsubscribe(self._broker_topics(topic, group))
+            if group:
+                self._announce_membership()
             return result == mqtt.MQTT_ERR_SUCCESS
         
         return False
     
-    def publish(self, topic, payload, qos=0, retain=False):
+    def _announce_membership(self):
+        groups = {}
+        for topic, group in self.subscription_groups.items():
+            groups.setdefault(group, []).append(topic)
+        
+        if not groups:
+            self.client.publish(self.membership_topic, b"", qos=1, retain=True)
+            return
+        
+        membership = {
+            "client_id": self.client_id,
+            "groups": groups,
+            "timestamp": datetime.now().isoformat()
+        }
+        self.client.publish(self.membership_topic, json.dumps(membership), qos=1, retain=True)
+    
+    def get_group_members(self, group=None, timeout=1.0):
+        """Collect announced consumer group memberships.
+
+        Returns {group: [client_id, ...]}, or the member list of one group.
+        Members that disconnect without stopping are removed by their will.
+        """
+        members = {}
+        lock = threading.Lock()
+        
+        def on_membership(recv_topic, payload, qos):
+            if not isinstance(payload, dict):
+                return
+            with lock:
+                for member_group in payload.get("groups", {}):
+                    members.setdefault(member_group, set()).add(payload.get("client_id"))
+        
+        wildcard = f"{GROUP_MEMBERSHIP_TOPIC}/+"
+        already_subscribed = wildcard in self.subscriptions
+        with self.callbacks_lock:
+            self.message_callbacks.setdefault(wildcard, []).append(on_membership)
+            self.decoded_callbacks.add(on_membership)
+        if not already_subscribed:
+            self.subscribe(wildcard, qos=1)
+        
+        # Retained memberships arrive right after the subscription is made
+        time.sleep(timeout)
+        
+        with self.callbacks_lock:
+            self.decoded_callbacks.discard(on_membership)
+            self.message_callbacks[wildcard].remove(on_membership)
+        if not already_subscribed:
+            self.unsubscribe(wildcard)
+        
+        with lock:
+            result = {name: sorted(ids) for name, ids in members.items()}
+        if group is not None:
+            return result.get(group, [])
+        return result
+    
+    def publish(self, topic, payload, qos=0, retain=False, properties=None):
+        """Publish a message. With the offline buffer enabled, a message published
+        while disconnected is buffered for replay and True is returned, unless
+        its topic matches OFFLINE_BUFFER_EXCLUDE."""
         try:
-            if isinstance(payload, (dict, list)):
-                payload = json.dumps(payload)
+            topic, payload, properties = self._encode_payload(topic, payload, properties)
+            
+            # Keep publish order: while a replay is pending, new messages queue behind it
+            if self.offline_buffer is not None and (not self.connected or len(self.offline_buffer)) \
+                    and not self._buffer_excluded(topic):
+                if not self.offline_buffer.add(topic, payload, qos, retain, properties):
+                    logger.warning(f"Offline buffer full, dropped message for {topic}")
+                    return False
+                if self.connected:
+                    self._start_replay()
+                return True
             
             if self.connected:
-                result = self.client.publish(topic, payload, qos=qos, retain=retain)
+                result = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
                 return result.rc == mqtt.MQTT_ERR_SUCCESS
             else:
                 logger.error("Cannot publish: not connected to broker")
@@ -217,40 +456,191 @@ class MQTTClient:
             logger.error(f"Error publishing message: {e}")
             return False
     
+    def _buffer_excluded(self, topic):
+        return any(mqtt.topic_matches_sub(topic_filter, topic) for topic_filter in self.offline_buffer_exclude)
+    
+    def _start_replay(self):
+        with self._replay_lock:
+            if self.replay_thread is None:
+                self.replay_thread = threading.Thread(target=self._replay_buffer)
+                self.replay_thread.daemon = True
+                self.replay_thread.start()
+    
+    def _replay_buffer(self):
+        interval = 1.0 / self.replay_rate if self.replay_rate else 0
+        next_send = time.monotonic()
+        replayed = 0
+        
+        while True:
+            with self._replay_lock:
+                message = self.offline_buffer.peek() if self.connected else None
+                if message is None:
+                    self.replay_thread = None
+                    break
+            
+            result = self.client.publish(
+                message.topic, message.payload,
+                qos=message.qos, retain=message.retain, properties=message.properties
+            )
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                logger.warning(f"Replay of buffered messages interrupted with code: {result.rc}")
+                with self._replay_lock:
+                    self.replay_thread = None
+                break
+            
+            self.offline_buffer.pop(message)
+            replayed += 1
+            
+            if interval:
+                next_send += interval
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_send = time.monotonic()
+        
+        if replayed:
+            logger.info(f"Replayed {replayed} buffered messages")
+    
+    def get_buffer_stats(self):
+        if self.offline_buffer is None:
+            return None
+        return self.offline_buffer.get_stats()
+    
     def wait_for_message(self, topic, timeout=5.0):
+        # Waits alongside the topic's existing callbacks instead of replacing
+        # them; use request() when the reply must match a specific request
         msg_queue = Queue()
-        received = threading.Event()
         
         def temp_callback(recv_topic, payload, qos):
-            if topic == recv_topic:
-                try:
-                    try:
-                        json_payload = json.loads(payload)
-                        msg_queue.put(json_payload)
-                    except json.JSONDecodeError:
-                        msg_queue.put(payload)
-                    received.set()
-                except Exception as e:
-                    logger.error(f"Error in wait_for_message callback: {e}")
+            msg_queue.put(payload)
         
-        previous_callbacks = None
-        if topic in self.message_callbacks:
-            previous_callbacks = self.message_callbacks[topic]
-        
-        self.message_callbacks[topic] = [temp_callback]
-        self.subscribe(topic)
+        subscribed = topic in self.subscriptions
+        with self.callbacks_lock:
+            self.message_callbacks.setdefault(topic, []).append(temp_callback)
+            self.decoded_callbacks.add(temp_callback)
+        if not subscribed:
+            self.subscribe(topic)
+            with self.callbacks_lock:
+                self.wait_subscriptions.add(topic)
         
         try:
-            success = received.wait(timeout)
-            if success:
-                return msg_queue.get(block=False)
-            else:
-                return None
+            return msg_queue.get(timeout=timeout)
+        except Empty:
+            return None
         finally:
-            if previous_callbacks:
-                self.message_callbacks[topic] = previous_callbacks
+            with self.callbacks_lock:
+                self.decoded_callbacks.discard(temp_callback)
+                callbacks = self.message_callbacks.get(topic, [])
+                if temp_callback in callbacks:
+                    callbacks.remove(temp_callback)
+                if not callbacks:
+                    self.message_callbacks.pop(topic, None)
+                # Leave no subscription behind once the last wait on the topic ends
+                unsubscribe = not callbacks and topic in self.wait_subscriptions
+                if unsubscribe:
+                    self.wait_subscriptions.discard(topic)
+            if unsubscribe:
+                self.unsubscribe(topic)
+    
+    def request_async(self, topic, payload, timeout=5.0, qos=1):
+        with self._rpc_lock:
+            if self.pending_requests is None:
+                self.pending_requests = rpc.PendingRequests()
+                self.subscribe(self.reply_topic, qos=1, callback=self._on_rpc_reply, decoded=True)
+        
+        correlation_id, future = self.pending_requests.new_request(timeout)
+        
+        message = dict(payload)
+        message[rpc.REPLY_TO_FIELD] = self.reply_topic
+        message[rpc.CORRELATION_ID_FIELD] = correlation_id
+        
+        properties = None
+        if self.protocol_v5:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ResponseTopic = self.reply_topic
+            properties.CorrelationData = correlation_id.encode('utf-8')
+        
+        if not self.publish(topic, message, qos=qos, properties=properties):
+            self.pending_requests.discard(correlation_id)
+            future.set_exception(ConnectionError(f"Could not publish request to {topic}"))
+        
+        return future
+    
+    def request(self, topic, payload, timeout=5.0, qos=1):
+        future = self.request_async(topic, payload, timeout=timeout, qos=qos)
+        try:
+            return future.result()
+        except TimeoutError:
+            logger.warning(f"Request to {topic} timed out after {timeout}s")
+            return None
+        except Exception as e:
+            logger.error(f"Request to {topic} failed: {e}")
+            return None
+    
+    def _on_rpc_reply(self, topic, payload, qos):
+        if not isinstance(payload, dict):
+            logger.warning(f"Ignoring malformed reply on {topic}")
+            return
+        
+        correlation_id = payload.get(rpc.CORRELATION_ID_FIELD)
+        if correlation_id:
+            self.pending_requests.resolve(correlation_id, payload)
+    
+    def serve(self, topic, handler, qos=1, group=None):
+        """Answer requests on topic; handler(request) returns the response dict."""
+        def on_request(recv_topic, request, msg_qos):
+            if not isinstance(request, dict):
+                logger.warning(f"Ignoring malformed request on {recv_topic}")
+                return
+            
+            reply_to = request.get(rpc.REPLY_TO_FIELD)
+            correlation_id = request.get(rpc.CORRELATION_ID_FIELD)
+            response = handler(request)
+            if not reply_to or response is None:
+                return
+            
+            response = dict(response)
+            response[rpc.CORRELATION_ID_FIELD] = correlation_id
+            
+            properties = None
+            if self.protocol_v5 and correlation_id:
+                properties = Properties(PacketTypes.PUBLISH)
+                properties.CorrelationData = correlation_id.encode('utf-8')
+            
+            self.publish(reply_to, response, qos=qos, properties=properties)
+        
+        return self.subscribe(topic, qos=qos, callback=on_request, decoded=True, group=group)
+
+
+class ReceivedPayload:
+    
+    def __init__(self, raw, codec):
+        self.raw = raw
+        self.codec = codec
+        self._decoded = None
+        self._json = None
+    
+    def decoded(self):
+        if self._decoded is None:
+            if self.codec is not None:
+                self._decoded = self.codec.decode(self.raw)
             else:
-                del self.message_callbacks[topic]
+                try:
+                    self._decoded = payload_codec.DEFAULT_CODEC.decode(self.raw)
+                except (ValueError, UnicodeDecodeError):
+                    self._decoded = self.raw
+        return self._decoded
+    
+    def for_callback(self, decoded):
+        if decoded:
+            return self.decoded()
+        if self.codec is None or self.codec is payload_codec.DEFAULT_CODEC:
+            return self.raw
+        # Legacy callbacks expect JSON bytes regardless of the wire format
+        if self._json is None:
+            self._json = payload_codec.DEFAULT_CODEC.encode(self.decoded())
+        return self._json
 
 
 class ValveControlClient:
@@ -314,7 +704,7 @@ class ValveControlClient:
             "timestamp": datetime.now().isoformat()
         }
         return self.mqtt_client.publish(
-            getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control'), 
+            topics.valve_control_topic(sector_id, getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control')), 
             message, 
             qos=1
         )
@@ -326,7 +716,7 @@ class ValveControlClient:
             "timestamp": datetime.now().isoformat()
         }
         return self.mqtt_client.publish(
-            getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control'), 
+            topics.valve_control_topic(sector_id, getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control')), 
             message, 
             qos=1
         )
@@ -343,7 +733,7 @@ class ValveControlClient:
             "timestamp": datetime.now().isoformat()
         }
         return self.mqtt_client.publish(
-            getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control'), 
+            topics.valve_control_topic(sector_id, getattr(broker_config, 'VALVE_CONTROL_TOPIC', 'valve/control')), 
             message, 
             qos=1
         )
@@ -355,16 +745,12 @@ class ValveControlClient:
             "timestamp": datetime.now().isoformat()
         }
         
-        self.mqtt_client.publish(
+        return self.mqtt_client.request(
             f"{getattr(broker_config, 'VALVE_STATUS_TOPIC', 'valve/status')}/request", 
             request_message, 
+            timeout=timeout,
             qos=1
         )
-        
-        return self.mqtt_client.wait_for_message(
-            getattr(broker_config, 'VALVE_STATUS_TOPIC', 'valve/status'), 
-            timeout=timeout
-        )
     
     def register_status_callback(self, sector_id, callback):
         if sector_id not in self.status_callbacks:
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import json
+import struct
+import logging
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger('mqtt_codec')
+
+# Marker used as the last topic level when content type is signalled through
+# the topic instead of MQTT v5 properties, e.g. "sensor/readings/@struct"
+TOPIC_SUFFIX_MARKER = "@"
+
+
+class JSONCodec:
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, payload):
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode('utf-8')
+        return json.loads(payload)
+
+
+class MsgPackCodec:
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class ReadingsStructCodec:
+    """Fixed-layout binary encoding for sensor reading messages.
+
+    Layout (network byte order):
+        B   layout version
+        B   flags (see FLAG_*)
+        d   timestamp, seconds since epoch
+        B   device_id length, followed by the utf-8 device_id
+        B   sector_id length, followed by the utf-8 sector_id (0 if absent)
+        d   temperature value (if FLAG_TEMPERATURE)
+        d   pressure value (if FLAG_PRESSURE)
+
+    Units are implied by the layout (celsius and hPa). Messages that do not
+    fit the layout raise ValueError so the caller can fall back to another codec.
+    """
+
+    name = "struct"
+    content_type = "application/x-smartbolt-readings"
+
+    VERSION = 1
+    FLAG_TEMPERATURE = 0x01
+    FLAG_PRESSURE = 0x02
+    FLAG_INT_DEVICE_ID = 0x04
+    FLAG_INT_SECTOR_ID = 0x08
+
+    _header = struct.Struct("!BBd")
+    _value = struct.Struct("!d")
+    _length = struct.Struct("!B")
+
+    UNITS = {"temperature": "celsius", "pressure": "hPa"}
+
+    def encode(self, data):
+        if not isinstance(data, dict):
+            raise ValueError("struct codec only encodes sensor reading dicts")
+
+        readings = data.get("readings") or {}
+        extra = set(readings) - set(self.UNITS)
+        if extra:
+            raise ValueError(f"struct codec cannot encode readings: {sorted(extra)}")
+
+        flags = 0
+        values = b""
+        for flag, sensor_type in ((self.FLAG_TEMPERATURE, "temperature"),
+                                  (self.FLAG_PRESSURE, "pressure")):
+            reading = readings.get(sensor_type)
+            if reading is None:
+                continue
+            if isinstance(reading, dict):
+                if reading.get("unit", self.UNITS[sensor_type]) != self.UNITS[sensor_type]:
+                    raise ValueError(f"struct codec requires {sensor_type} in {self.UNITS[sensor_type]}")
+                reading = reading.get("value")
+            if reading is None:
+                continue
+            flags |= flag
+            values += self._value.pack(float(reading))
+
+        if not flags:
+            raise ValueError("struct codec requires at least one reading")
+
+        device_id = data.get("device_id")
+        sector_id = data.get("sector_id")
+        if sector_id is None:
+            sector_id = (data.get("device_info") or {}).get("sector_id")
+        if isinstance(device_id, int):
+            flags |= self.FLAG_INT_DEVICE_ID
+        if isinstance(sector_id, int):
+            flags |= self.FLAG_INT_SECTOR_ID
+
+        timestamp = data.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        elif timestamp is None:
+            timestamp = datetime.now().timestamp()
+
+        return (self._header.pack(self.VERSION, flags, float(timestamp)) +
+                self._pack_str(device_id) +
+                self._pack_str(sector_id) +
+                values)
+
+    def decode(self, payload):
+        version, flags, timestamp = self._header.unpack_from(payload, 0)
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported readings layout version: {version}")
+
+        offset = self._header.size
+        device_id, offset = self._unpack_str(payload, offset, flags & self.FLAG_INT_DEVICE_ID)
+        sector_id, offset = self._unpack_str(payload, offset, flags & self.FLAG_INT_SECTOR_ID)
+
+        readings = {}
+        for flag, sensor_type in ((self.FLAG_TEMPERATURE, "temperature"),
+                                  (self.FLAG_PRESSURE, "pressure")):
+            if flags & flag:
+                value, = self._value.unpack_from(payload, offset)
+                offset += self._value.size
+                readings[sensor_type] = {"value": value, "unit": self.UNITS[sensor_type]}
+
+        data = {
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+            "device_id": device_id,
+            "readings": readings
+        }
+        if sector_id is not None:
+            data["sector_id"] = sector_id
+            data["device_info"] = {"device_id": device_id, "sector_id": sector_id}
+        return data
+
+    def _pack_str(self, value):
+        if value is None:
+            return self._length.pack(0)
+        encoded = str(value).encode('utf-8')
+        if len(encoded) > 255:
+            raise ValueError("struct codec identifiers are limited to 255 bytes")
+        return self._length.pack(len(encoded)) + encoded
+
+    def _unpack_str(self, payload, offset, as_int):
+        length, = self._length.unpack_from(payload, offset)
+        offset += self._length.size
+        if not length:
+            return None, offset
+        value = bytes(payload[offset:offset + length]).decode('utf-8')
+        return (int(value) if as_int else value), offset + length
+
+
+CODECS = {
+    JSONCodec.name: JSONCodec(),
+    ReadingsStructCodec.name: ReadingsStructCodec(),
+}
+if msgpack is not None:
+    CODECS[MsgPackCodec.name] = MsgPackCodec()
+
+DEFAULT_CODEC = CODECS[JSONCodec.name]
+
+_by_content_type = {codec.content_type: codec for codec in CODECS.values()}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+    _by_content_type[codec.content_type] = codec
+
+
+def get_codec(name):
+    if not name:
+        return DEFAULT_CODEC
+    codec = CODECS.get(name)
+    if codec is None:
+        logger.warning(f"Codec '{name}' not available, falling back to {DEFAULT_CODEC.name}")
+        return DEFAULT_CODEC
+    return codec
+
+
+def codec_for_content_type(content_type):
+    return _by_content_type.get(content_type)
+
+
+def topic_with_suffix(topic, codec):
+    if codec is DEFAULT_CODEC:
+        return topic
+    return f"{topic}/{TOPIC_SUFFIX_MARKER}{codec.name}"
+
+
+def split_topic_suffix(topic):
+    base, sep, last = topic.rpartition('/')
+    if sep and last.startswith(TOPIC_SUFFIX_MARKER):
+        codec = CODECS.get(last[len(TOPIC_SUFFIX_MARKER):])
+        if codec is not None:
+            return base, codec
+    return topic, None
+
+
+def encode(data, codec):
+    """Encode data with codec, falling back to JSON when it does not fit."""
+    if codec is not DEFAULT_CODEC:
+        try:
+            return codec.encode(data), codec
+        except (ValueError, TypeError, struct.error) as e:
+            logger.debug(f"{codec.name} codec could not encode payload, using JSON: {e}")
+    return DEFAULT_CODEC.encode(data), DEFAULT_CODEC
@@ -5,16 +5,70 @@ MQTT_CLIENT_ID = "smart_bolt_message_broker"
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
 
+# Sensor readings are published to SENSOR_DATA_TOPIC/<sector>/<device> and
+# valve commands to VALVE_CONTROL_TOPIC/<sector> (see topics.py). The bridge
+# is a migration aid for clients still on the flat legacy topics: it mirrors
+# every message to and from them, doubling broker traffic, so only enable it
+# while such clients exist (all services in this repository use the
+# hierarchical topics).
 VALVE_CONTROL_TOPIC = "valve/control"
 VALVE_STATUS_TOPIC = "valve/status"
 SENSOR_DATA_TOPIC = "sensor/readings"
 SYSTEM_EVENTS_TOPIC = "system/events"
+LEGACY_TOPIC_BRIDGE_ENABLED = False
+
+# Consumer groups: clients subscribing with group=... share the messages of a
+# topic ($share/<group>/<topic>) and announce their membership as a retained
+# message under GROUP_MEMBERSHIP_TOPIC/<client_id>
+GROUP_MEMBERSHIP_TOPIC = "smartbolt/consumers"
+
+# Run the pure-Python broker in-process instead of the mosquitto binary
+# (also available with `python main.py --embedded`)
+EMBEDDED_BROKER_ENABLED = False
+EMBEDDED_BROKER_HOST = "0.0.0.0"
 
 WEBSOCKET_ENABLED = True
 WEBSOCKET_PORT = 9001
 
 PERSISTENCE_ENABLED = False
 
+# Payload codecs: "json", "msgpack" (needs the msgpack package) or "struct"
+# (fixed-layout sensor readings). With MQTT v5 the content type is sent as a
+# publish property, otherwise as a topic suffix such as "sensor/readings/@struct".
+# Publishers and subscribers of a topic must share the same mapping.
+MQTT_V5_ENABLED = False
+DEFAULT_CODEC = "json"
+TOPIC_CODECS = {
+    # f"{SENSOR_DATA_TOPIC}/#": "struct",
+    # f"{VALVE_CONTROL_TOPIC}/#": "msgpack",
+    # VALVE_STATUS_TOPIC: "msgpack",
+}
+
+# Opt-in: outbound messages published while disconnected are buffered per
+# QoS and replayed in order (at OFFLINE_REPLAY_RATE messages/s) after
+# reconnecting, so publish() then returns True for a buffered message.
+# Messages older than OFFLINE_BUFFER_TTL seconds are dropped instead of
+# replayed, and topics matching OFFLINE_BUFFER_EXCLUDE are never buffered:
+# a valve command replayed minutes later may act on superseded state.
+# Set OFFLINE_BUFFER_DIR to persist the buffer across restarts.
+OFFLINE_BUFFER_ENABLED = False
+OFFLINE_BUFFER_TTL = 300
+OFFLINE_BUFFER_EXCLUDE = [f"{VALVE_CONTROL_TOPIC}/#"]
+OFFLINE_BUFFER_POLICIES = {
+    0: {"max_messages": 100, "overflow": "drop_oldest"},
+    1: {"max_messages": 1000, "overflow": "drop_oldest"},
+    2: {"max_messages": 1000, "overflow": "drop_newest"},
+}
+OFFLINE_BUFFER_DIR = None
+OFFLINE_REPLAY_RATE = 100
+
+# Broker traffic statistics: per-topic counters fed by the controller's '#'
+# subscription (or directly by the embedded broker). Payload content is only
+# decoded and logged for a MESSAGE_SAMPLE_RATE fraction of messages (0 = off).
+TRAFFIC_STATS_MAX_TOPICS = 1000
+TRAFFIC_STATS_WINDOW = 60
+MESSAGE_SAMPLE_RATE = 0.0
+
 TLS_ENABLED = False
 TLS_CERT_FILE = "server.crt"
 TLS_KEY_FILE = "server.key"
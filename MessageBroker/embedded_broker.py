@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+import asyncio
+import struct
+import logging
+import threading
+import itertools
+
+logger = logging.getLogger('embedded_broker')
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_PROTOCOL = 1
+CONNACK_BAD_CLIENT_ID = 2
+
+MAX_QOS = 1
+SUBACK_FAILURE = 0x80
+
+SHARED_PREFIX = "$share/"
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT topic filter matching, including the '$' topic exclusion rule."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    if topic.startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def parse_shared(topic_filter):
+    """Split "$share/<group>/<filter>" into (group, filter); (None, filter) otherwise."""
+    if not topic_filter.startswith(SHARED_PREFIX):
+        return None, topic_filter
+    group, _, shared_filter = topic_filter[len(SHARED_PREFIX):].partition('/')
+    return group, shared_filter
+
+
+def valid_filter(topic_filter):
+    group, topic_filter = parse_shared(topic_filter)
+    if group is not None and (not group or '+' in group or '#' in group):
+        return False
+    if not topic_filter:
+        return False
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if '#' in level and (level != '#' or i != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return True
+
+
+class _TopicNode:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = {}
+
+
+class SubscriptionTree:
+    """Topic trie so routing cost depends on topic depth, not subscription count."""
+
+    def __init__(self):
+        self.root = _TopicNode()
+
+    def add(self, topic_filter, session, qos):
+        node = self.root
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, _TopicNode())
+        node.subscribers[session] = qos
+
+    def remove(self, topic_filter, session):
+        path = [self.root]
+        for level in topic_filter.split('/'):
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+
+        removed = path[-1].subscribers.pop(session, None) is not None
+        levels = topic_filter.split('/')
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.children or node.subscribers:
+                break
+            del path[i - 1].children[levels[i - 1]]
+        return removed
+
+    def match(self, topic):
+        """Return {session: max granted qos} for every subscription matching topic."""
+        levels = topic.split('/')
+        matches = {}
+        self._match(self.root, levels, 0, matches, topic.startswith('$'))
+        return matches
+
+    def _match(self, node, levels, index, matches, system_topic):
+        wildcards_allowed = not (index == 0 and system_topic)
+
+        if wildcards_allowed:
+            multi = node.children.get('#')
+            if multi is not None:
+                self._collect(multi, matches)
+
+        if index == len(levels):
+            self._collect(node, matches)
+            return
+
+        child = node.children.get(levels[index])
+        if child is not None:
+            self._match(child, levels, index + 1, matches, system_topic)
+
+        if wildcards_allowed:
+            single = node.children.get('+')
+            if single is not None:
+                self._match(single, levels, index + 1, matches, system_topic)
+
+    @staticmethod
+    def _collect(node, matches):
+        for session, qos in node.subscribers.items():
+            if qos > matches.get(session, -1):
+                matches[session] = qos
+
+
+class _SharedGroup:
+    """Members of one $share/<group>/<filter> subscription; each message goes to one member."""
+
+    __slots__ = ("name", "topic_filter", "members", "next_member")
+
+    def __init__(self, name, topic_filter):
+        self.name = name
+        self.topic_filter = topic_filter
+        self.members = {}
+        self.next_member = 0
+
+    def deliver(self, topic, payload, qos, retain=False):
+        members = [(session, granted) for session, granted in self.members.items() if not session.closed]
+        if not members:
+            return
+        session, granted = members[self.next_member % len(members)]
+        self.next_member += 1
+        session.deliver(topic, payload, min(qos, granted), retain)
+
+
+class _Session:
+
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.keepalive = 0
+        self.subscriptions = {}
+        self.will = None
+        self.packet_ids = itertools.cycle(range(1, 65536))
+        self.pending_qos2 = set()
+        self.closed = False
+
+    @property
+    def peer(self):
+        return self.writer.get_extra_info('peername')
+
+    def send(self, packet):
+        if not self.closed:
+            self.writer.write(packet)
+
+    def deliver(self, topic, payload, qos, retain=False):
+        if qos:
+            self.send(encode_publish(topic, payload, qos, retain, next(self.packet_ids)))
+        else:
+            self.send(encode_publish(topic, payload, 0, retain))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class EmbeddedBroker:
+    """Pure-Python, asyncio based MQTT 3.1.1 broker.
+
+    Supports QoS 0 and 1 (QoS 2 publishes are accepted and delivered at QoS 1),
+    retained messages, wildcard and shared ($share/<group>/...) subscriptions
+    and last will messages.
+    Sessions are not persisted; every connection starts clean.
+    """
+
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.sessions = {}
+        self.subscriptions = SubscriptionTree()
+        self.shared_groups = {}
+        self.retained = {}
+        self.loop = None
+        self.message_listeners = []
+        self._thread = None
+        self._connection_tasks = set()
+        self._client_ids = itertools.count(1)
+
+    # Lifecycle
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if not self.port:
+            self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Embedded MQTT broker listening on {self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for task in list(self._connection_tasks):
+            task.cancel()
+        await asyncio.gather(*self._connection_tasks, return_exceptions=True)
+        await self.server.wait_closed()
+        self.server = None
+        self.sessions.clear()
+        logger.info("Embedded MQTT broker stopped")
+
+    def start_in_thread(self, timeout=5.0):
+        """Run the broker on its own event loop thread; returns once it is listening."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            try:
+                loop.run_forever()
+            finally:
+                loop.run_until_complete(self.stop())
+                loop.close()
+
+        self._thread = threading.Thread(target=run, name="embedded-mqtt-broker", daemon=True)
+        self._thread.start()
+        if not started.wait(timeout):
+            raise TimeoutError("Embedded MQTT broker did not start in time")
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop_in_thread(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def add_message_listener(self, listener):
+        """listener(topic, payload, qos, retain) is called for every PUBLISH received."""
+        self.message_listeners.append(listener)
+
+    # Connection handling
+
+    async def _handle_connection(self, reader, writer):
+        session = _Session(self, reader, writer)
+        task = asyncio.current_task()
+        self._connection_tasks.add(task)
+        try:
+            packet_type, flags, body = await asyncio.wait_for(read_packet(reader), 10.0)
+            if packet_type != CONNECT or not self._on_connect(session, body):
+                return
+
+            while not session.closed:
+                timeout = session.keepalive * 1.5 if session.keepalive else None
+                packet_type, flags, body = await asyncio.wait_for(read_packet(reader), timeout)
+                if packet_type == DISCONNECT:
+                    session.will = None
+                    break
+                self._dispatch(session, packet_type, flags, body)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error in embedded broker session {session.client_id}: {e}")
+        finally:
+            self._connection_tasks.discard(task)
+            self._on_disconnect(session)
+
+    def _on_connect(self, session, body):
+        offset = 0
+        protocol, offset = decode_string(body, offset)
+        level = body[offset]
+        connect_flags = body[offset + 1]
+        session.keepalive, = struct.unpack_from("!H", body, offset + 2)
+        offset += 4
+
+        if (protocol, level) not in (("MQTT", 4), ("MQIsdp", 3)):
+            session.send(encode_connack(CONNACK_BAD_PROTOCOL))
+            session.close()
+            return False
+
+        client_id, offset = decode_string(body, offset)
+        if not client_id:
+            if not connect_flags & 0x02:
+                session.send(encode_connack(CONNACK_BAD_CLIENT_ID))
+                session.close()
+                return False
+            client_id = f"embedded_{next(self._client_ids)}"
+
+        if connect_flags & 0x04:
+            will_topic, offset = decode_string(body, offset)
+            will_length, = struct.unpack_from("!H", body, offset)
+            offset += 2
+            will_payload = bytes(body[offset:offset + will_length])
+            session.will = (will_topic, will_payload, (connect_flags >> 3) & 0x03, bool(connect_flags & 0x20))
+
+        # Username/password are accepted without checks
+
+        previous = self.sessions.get(client_id)
+        if previous is not None:
+            logger.info(f"Client {client_id} reconnected, closing previous session")
+            self._drop_subscriptions(previous)
+            previous.will = None
+            previous.close()
+
+        session.client_id = client_id
+        self.sessions[client_id] = session
+        session.send(encode_connack(CONNACK_ACCEPTED))
+        logger.debug(f"Client {client_id} connected from {session.peer}")
+        return True
+
+    def _on_disconnect(self, session):
+        if session.client_id and self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+            self._drop_subscriptions(session)
+            if session.will is not None:
+                topic, payload, qos, retain = session.will
+                self.publish(topic, payload, qos, retain)
+            logger.debug(f"Client {session.client_id} disconnected")
+        session.close()
+
+    def _drop_subscriptions(self, session):
+        for topic_filter in session.subscriptions:
+            self._remove_subscription(session, topic_filter)
+        session.subscriptions.clear()
+
+    def _add_subscription(self, session, topic_filter, qos):
+        group_name, shared_filter = parse_shared(topic_filter)
+        if group_name is None:
+            self.subscriptions.add(topic_filter, session, qos)
+            return
+
+        group = self.shared_groups.get((group_name, shared_filter))
+        if group is None:
+            group = _SharedGroup(group_name, shared_filter)
+            self.shared_groups[(group_name, shared_filter)] = group
+            # The group is routed like a single subscriber; it picks the member
+            self.subscriptions.add(shared_filter, group, MAX_QOS)
+        group.members[session] = qos
+
+    def _remove_subscription(self, session, topic_filter):
+        group_name, shared_filter = parse_shared(topic_filter)
+        if group_name is None:
+            self.subscriptions.remove(topic_filter, session)
+            return
+
+        group = self.shared_groups.get((group_name, shared_filter))
+        if group is None:
+            return
+        group.members.pop(session, None)
+        if not group.members:
+            del self.shared_groups[(group_name, shared_filter)]
+            self.subscriptions.remove(shared_filter, group)
+
+    def get_shared_groups(self):
+        """{group: {filter: [client_id, ...]}} for every active shared subscription."""
+        groups = {}
+        for (name, topic_filter), group in list(self.shared_groups.items()):
+            groups.setdefault(name, {})[topic_filter] = [session.client_id for session in group.members]
+        return groups
+
+    def _dispatch(self, session, packet_type, flags, body):
+        if packet_type == PUBLISH:
+            self._on_publish(session, flags, body)
+        elif packet_type == PUBREL:
+            packet_id, = struct.unpack_from("!H", body, 0)
+            session.pending_qos2.discard(packet_id)
+            session.send(struct.pack("!BBH", PUBCOMP << 4, 2, packet_id))
+        elif packet_type == SUBSCRIBE:
+            self._on_subscribe(session, body)
+        elif packet_type == UNSUBSCRIBE:
+            self._on_unsubscribe(session, body)
+        elif packet_type == PINGREQ:
+            session.send(bytes((PINGRESP << 4, 0)))
+        elif packet_type in (PUBACK, PUBREC, PUBCOMP):
+            # Outbound QoS 1 messages are not retransmitted, nothing to track
+            pass
+        else:
+            logger.warning(f"Unsupported packet type {packet_type} from {session.client_id}")
+            session.close()
+
+    def _on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic, offset = decode_string(body, 0)
+        packet_id = None
+        if qos:
+            packet_id, = struct.unpack_from("!H", body, offset)
+            offset += 2
+        payload = bytes(body[offset:])
+
+        if qos == 1:
+            session.send(struct.pack("!BBH", PUBACK << 4, 2, packet_id))
+        elif qos == 2:
+            session.send(struct.pack("!BBH", PUBREC << 4, 2, packet_id))
+            if packet_id in session.pending_qos2:
+                return
+            session.pending_qos2.add(packet_id)
+
+        self.publish(topic, payload, qos, retain)
+
+    def _on_subscribe(self, session, body):
+        packet_id, = struct.unpack_from("!H", body, 0)
+        offset = 2
+        return_codes = bytearray()
+        granted = []
+        while offset < len(body):
+            topic_filter, offset = decode_string(body, offset)
+            requested = body[offset] & 0x03
+            offset += 1
+            if not valid_filter(topic_filter):
+                return_codes.append(SUBACK_FAILURE)
+                continue
+            qos = min(requested, MAX_QOS)
+            session.subscriptions[topic_filter] = qos
+            self._add_subscription(session, topic_filter, qos)
+            return_codes.append(qos)
+            # Retained messages are not sent to shared subscriptions
+            if parse_shared(topic_filter)[0] is None:
+                granted.append((topic_filter, qos))
+
+        session.send(encode_packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(return_codes)))
+
+        for topic_filter, qos in granted:
+            for topic, (payload, retained_qos) in self.retained.items():
+                if topic_matches(topic_filter, topic):
+                    session.deliver(topic, payload, min(qos, retained_qos), retain=True)
+
+    def _on_unsubscribe(self, session, body):
+        packet_id, = struct.unpack_from("!H", body, 0)
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = decode_string(body, offset)
+            if session.subscriptions.pop(topic_filter, None) is not None:
+                self._remove_subscription(session, topic_filter)
+        session.send(struct.pack("!BBH", UNSUBACK << 4, 2, packet_id))
+
+    # Routing
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Route a message to subscribers; must be called on the broker loop."""
+        qos = min(qos, MAX_QOS)
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+
+        for listener in self.message_listeners:
+            try:
+                listener(topic, payload, qos, retain)
+            except Exception as e:
+                logger.error(f"Error in embedded broker message listener: {e}")
+
+        for session, granted_qos in self.subscriptions.match(topic).items():
+            session.deliver(topic, payload, min(qos, granted_qos))
+
+
+# Packet encoding helpers
+
+async def read_packet(reader):
+    header = await reader.readexactly(1)
+    multiplier = 1
+    length = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+        if multiplier > 128 ** 3:
+            raise ConnectionError("Malformed remaining length")
+    body = await reader.readexactly(length) if length else b""
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_packet(packet_type, flags, body):
+    return bytes(((packet_type << 4) | flags,)) + encode_length(len(body)) + body
+
+
+def encode_string(value):
+    encoded = value.encode('utf-8')
+    return struct.pack("!H", len(encoded)) + encoded
+
+
+def decode_string(data, offset):
+    length, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_connack(return_code, session_present=False):
+    return bytes((CONNACK << 4, 2, int(session_present), return_code))
+
+
+def encode_publish(topic, payload, qos=0, retain=False, packet_id=None):
+    flags = (qos << 1) | int(retain)
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return encode_packet(PUBLISH, flags, body + payload)
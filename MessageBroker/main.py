@@ -12,8 +12,13 @@ import paho.mqtt.client as mqtt
 import json
 import logging
 import threading
+import argparse
 from datetime import datetime
 import config
+from embedded_broker import EmbeddedBroker
+from traffic_stats import TrafficStats, SORT_KEYS
+from topic_bridge import TopicBridge
+from tracing import SpanCollector, TRACE_TOPIC
 
 logging.basicConfig(
     filename=config.LOG_FILE,
@@ -29,9 +34,18 @@ console.setFormatter(formatter)
 logger.addHandler(console)
 
 class MQTTController:
-    def __init__(self):
+    def __init__(self, embedded=False):
         self.running = False
         self.process = None
+        self.embedded = embedded
+        self.embedded_broker = None
+        self.topic_bridge = None
+        self.traces = SpanCollector("broker")
+        self.stats = TrafficStats(
+            max_topics=config.TRAFFIC_STATS_MAX_TOPICS,
+            window=config.TRAFFIC_STATS_WINDOW,
+            sample_rate=config.MESSAGE_SAMPLE_RATE
+        )
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="controller_" + ''.join(random.choices(string.ascii_letters + string.digits, k=8)))
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
@@ -40,13 +54,21 @@ class MQTTController:
     def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             logger.info(f"Controller connected to MQTT broker with result code {rc}")
-            self.client.subscribe("#")
+            # The embedded broker feeds traffic stats directly
+            if not self.embedded_broker:
+                self.client.subscribe("#")
         else:
             logger.error(f"Failed to connect to MQTT broker with code: {rc}")
     
     def on_message(self, client, userdata, msg, *args, **kwargs):
+        self.record_message(msg.topic, msg.payload)
+    
+    def record_message(self, topic, payload, *args):
         try:
-            logger.debug(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
+            self.stats.record(topic, len(payload))
+            self.stats.sample(topic, payload)
+            if topic == TRACE_TOPIC:
+                self.traces.ingest(json.loads(payload))
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
@@ -77,12 +99,27 @@ class MQTTController:
             logger.error(f"Error starting mosquitto: {e}")
             return False
     
+    def start_embedded_broker(self):
+        try:
+            started = time.perf_counter()
+            self.embedded_broker = EmbeddedBroker(config.EMBEDDED_BROKER_HOST, config.MQTT_PORT)
+            self.embedded_broker.add_message_listener(self.record_message)
+            self.embedded_broker.start_in_thread()
+            logger.info(f"Embedded MQTT broker started in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return True
+        except Exception as e:
+            logger.error(f"Error starting embedded MQTT broker: {e}")
+            return False
+    
     def start(self):
         if self.running:
             logger.warning("MQTT broker already running")
             return False
         
-        if not self.start_mosquitto():
+        if self.embedded:
+            if not self.start_embedded_broker():
+                return False
+        elif not self.start_mosquitto():
             return False
         
         try:
@@ -97,6 +134,10 @@ class MQTTController:
             }
             self.client.publish(config.SYSTEM_EVENTS_TOPIC, json.dumps(startup_message), qos=1)
             
+            if config.LEGACY_TOPIC_BRIDGE_ENABLED:
+                self.topic_bridge = TopicBridge(config.MQTT_HOST, config.MQTT_PORT)
+                self.topic_bridge.start()
+            
             logger.info(f"MQTT controller connected to broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
             return True
         except Exception as e:
@@ -115,6 +156,10 @@ class MQTTController:
             "broker_id": config.MQTT_CLIENT_ID
         }
         
+        if self.topic_bridge:
+            self.topic_bridge.stop()
+            self.topic_bridge = None
+        
         try:
             self.client.publish(config.SYSTEM_EVENTS_TOPIC, json.dumps(shutdown_message), qos=1)
             time.sleep(1)
@@ -131,6 +176,11 @@ class MQTTController:
                 self.process.kill()
             logger.info("Mosquitto broker stopped")
         
+        if self.embedded_broker:
+            self.embedded_broker.stop_in_thread()
+            self.embedded_broker = None
+            logger.info("Embedded MQTT broker stopped")
+        
         return True
 
 class BrokerStatusWebService(object):
@@ -139,12 +189,41 @@ class BrokerStatusWebService(object):
     def __init__(self, controller):
         self.controller = controller
     
+    @cherrypy.tools.json_out()
     def GET(self, *path, **query):
+        if path and path[0] == "stats":
+            top = None
+            if "top" in query:
+                try:
+                    top = int(query["top"])
+                except ValueError:
+                    top = -1
+                if top < 0:
+                    cherrypy.response.status = 400
+                    return {"error": "top must be a non-negative integer"}
+            sort = query.get("sort", "messages")
+            if sort not in SORT_KEYS:
+                cherrypy.response.status = 400
+                return {"error": f"sort must be one of {', '.join(SORT_KEYS)}"}
+            return self.controller.stats.snapshot(
+                top=top,
+                sort=sort,
+                prefix=query.get("prefix")
+            )
+        
+        if path and path[0] == "traces":
+            # Per-hop latency percentiles reported by every service
+            return self.controller.traces.summary()
+        
         status = {
             "status": "running" if self.controller.running else "stopped",
+            "mode": "embedded" if self.controller.embedded else "mosquitto",
             "mqtt_port": config.MQTT_PORT,
-            "broker_id": config.MQTT_CLIENT_ID
+            "broker_id": config.MQTT_CLIENT_ID,
+            "traffic": self.controller.stats.get_totals()
         }
+        if self.controller.topic_bridge:
+            status["topic_bridge"] = self.controller.topic_bridge.get_stats()
         return status
     
     def POST(self, *path, **query):
@@ -161,6 +240,11 @@ class BrokerStatusWebService(object):
         return {"message": "Operation not supported"}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='SmartBolt Message Broker')
+    parser.add_argument('--embedded', action='store_true',
+                        help='Run the built-in Python MQTT broker instead of mosquitto')
+    args = parser.parse_args()
+    
     def signal_handler(sig, frame):
         print("Shutting down MQTT broker...")
         if controller.running:
@@ -172,7 +256,7 @@ if __name__ == "__main__":
     
     print("Starting SmartBolt Message Broker...")
     
-    controller = MQTTController()
+    controller = MQTTController(embedded=args.embedded or config.EMBEDDED_BROKER_ENABLED)
     
     if controller.start():
         print(f"Message broker started on {config.MQTT_HOST}:{config.MQTT_PORT}")
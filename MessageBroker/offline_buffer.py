@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import base64
+import heapq
+import logging
+import time
+import threading
+from collections import deque
+
+logger = logging.getLogger('mqtt_offline_buffer')
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+DEFAULT_POLICIES = {
+    0: {"max_messages": 100, "overflow": DROP_OLDEST},
+    1: {"max_messages": 1000, "overflow": DROP_OLDEST},
+    2: {"max_messages": 1000, "overflow": DROP_NEWEST},
+}
+
+_PERSISTED_PROPERTIES = ("ContentType", "ResponseTopic", "CorrelationData")
+
+
+class BufferedMessage:
+    __slots__ = ("seq", "topic", "payload", "qos", "retain", "properties", "expires")
+
+    def __init__(self, seq, topic, payload, qos, retain, properties=None, expires=None):
+        self.seq = seq
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+        # Wall-clock time after which the message is dropped instead of replayed
+        self.expires = expires
+
+    def __lt__(self, other):
+        return self.seq < other.seq
+
+
+class OfflineBuffer:
+    """Bounded store for messages published while disconnected.
+
+    Each QoS level has its own capacity and overflow policy
+    ("drop_oldest" or "drop_newest"; a capacity of 0 disables buffering for
+    that QoS). Messages are replayed in publish order across QoS levels;
+    with ttl set, messages older than ttl seconds are dropped instead.
+    With persist_path set, buffered and replayed messages are journaled to
+    disk and the remaining ones reloaded on start so they survive a restart.
+    """
+
+    def __init__(self, policies=None, persist_path=None, ttl=None):
+        self.policies = {qos: dict(DEFAULT_POLICIES[qos]) for qos in DEFAULT_POLICIES}
+        for qos, policy in (policies or {}).items():
+            self.policies[int(qos)].update(policy)
+
+        self.queues = {qos: deque() for qos in self.policies}
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        self.persist_path = persist_path
+        self.ttl = ttl
+        self._journal_lines = 0
+
+        self.stats = {
+            "buffered": 0,
+            "dropped": 0,
+            "replayed": 0,
+            "expired": 0,
+            "dropped_by_qos": {qos: 0 for qos in self.policies}
+        }
+
+        if self.persist_path:
+            self._load()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def add(self, topic, payload, qos=0, retain=False, properties=None):
+        policy = self.policies.get(qos, self.policies[0])
+        with self.lock:
+            queue = self.queues[qos]
+            if policy["max_messages"] <= 0:
+                self._count_drop(qos)
+                return False
+
+            if len(queue) >= policy["max_messages"]:
+                self._count_drop(qos)
+                if policy["overflow"] == DROP_NEWEST:
+                    return False
+                queue.popleft()
+
+            self.next_seq += 1
+            expires = time.time() + self.ttl if self.ttl else None
+            message = BufferedMessage(self.next_seq, topic, payload, qos, retain, properties, expires)
+            queue.append(message)
+            self.stats["buffered"] += 1
+            self._journal(self._to_record(message))
+            return True
+
+    def peek(self):
+        """Oldest message still to be replayed; expired ones are dropped on the way."""
+        with self.lock:
+            now = time.time()
+            while True:
+                heads = [queue[0] for queue in self.queues.values() if queue]
+                if not heads:
+                    return None
+                message = min(heads)
+                if message.expires is None or message.expires > now:
+                    return message
+                self.queues[message.qos].popleft()
+                self.stats["expired"] += 1
+                self._remove(message)
+
+    def pop(self, message):
+        """Remove message after it has been handed to the broker connection."""
+        with self.lock:
+            queue = self.queues[message.qos]
+            if queue and queue[0] is message:
+                queue.popleft()
+                self.stats["replayed"] += 1
+                self._remove(message)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["dropped_by_qos"] = dict(self.stats["dropped_by_qos"])
+            stats["pending"] = sum(len(queue) for queue in self.queues.values())
+            stats["pending_by_qos"] = {qos: len(queue) for qos, queue in self.queues.items()}
+            return stats
+
+    def _count_drop(self, qos):
+        self.stats["dropped"] += 1
+        self.stats["dropped_by_qos"][qos] += 1
+        if self.stats["dropped"] % 100 == 1:
+            logger.warning(f"Offline buffer full, {self.stats['dropped']} messages dropped so far")
+
+    # Persistence: append-only journal of buffered messages and of the
+    # sequence numbers replayed or expired since, rewritten whenever it grows
+    # well beyond the live buffer or the buffer drains
+
+    def _remove(self, message):
+        if not self.persist_path:
+            return
+        if any(self.queues.values()):
+            self._journal({"removed": message.seq})
+        else:
+            self._compact()
+
+    def _journal(self, record):
+        if not self.persist_path:
+            return
+        try:
+            with open(self.persist_path, 'a') as journal:
+                journal.write(json.dumps(record) + "\n")
+            self._journal_lines += 1
+            if self._journal_lines > 2 * sum(len(queue) for queue in self.queues.values()) + 100:
+                self._compact()
+        except OSError as e:
+            logger.error(f"Error writing offline buffer journal: {e}")
+
+    def _compact(self):
+        try:
+            messages = list(heapq.merge(*self.queues.values()))
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, 'w') as journal:
+                for message in messages:
+                    journal.write(json.dumps(self._to_record(message)) + "\n")
+            os.replace(tmp_path, self.persist_path)
+            self._journal_lines = len(messages)
+        except OSError as e:
+            logger.error(f"Error compacting offline buffer journal: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            loaded = []
+            with open(self.persist_path) as journal:
+                for line in journal:
+                    if line.strip():
+                        loaded.append(json.loads(line))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading offline buffer journal: {e}")
+            return
+
+        removed = {record["removed"] for record in loaded if "removed" in record}
+        now = time.time()
+        for record in loaded:
+            if "removed" in record or record["seq"] in removed:
+                continue
+            message = self._from_record(record)
+            if message.expires is not None and message.expires <= now:
+                continue
+            queue = self.queues[message.qos]
+            if len(queue) >= self.policies[message.qos]["max_messages"]:
+                queue.popleft()
+            queue.append(message)
+            self.next_seq = max(self.next_seq, message.seq)
+
+        self._compact()
+        if len(self):
+            logger.info(f"Restored {len(self)} buffered messages from {self.persist_path}")
+
+    def _to_record(self, message):
+        payload = message.payload
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b""
+        record = {
+            "seq": message.seq,
+            "topic": message.topic,
+            "payload": base64.b64encode(bytes(payload)).decode('ascii'),
+            "qos": message.qos,
+            "retain": message.retain
+        }
+        if message.expires is not None:
+            record["expires"] = message.expires
+        if message.properties is not None:
+            properties = {}
+            for name in _PERSISTED_PROPERTIES:
+                value = getattr(message.properties, name, None)
+                if value is not None:
+                    if isinstance(value, bytes):
+                        value = {"b64": base64.b64encode(value).decode('ascii')}
+                    properties[name] = value
+            record["properties"] = properties
+        return record
+
+    def _from_record(self, record):
+        properties = record.get("properties")
+        if properties:
+            from paho.mqtt.properties import Properties
+            from paho.mqtt.packettypes import PacketTypes
+            restored = Properties(PacketTypes.PUBLISH)
+            for name, value in properties.items():
+                if isinstance(value, dict):
+                    value = base64.b64decode(value["b64"])
+                setattr(restored, name, value)
+            properties = restored
+        return BufferedMessage(
+            record["seq"],
+            record["topic"],
+            base64.b64decode(record["payload"]),
+            record["qos"],
+            record.get("retain", False),
+            properties or None,
+            record.get("expires")
+        )
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import math
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger('mqtt_rpc')
+
+# Request/response convention (works on MQTT v3.1.1 and v5):
+# the request payload carries "reply_to" and "correlation_id"; the responder
+# publishes its response dict to "reply_to" with the same "correlation_id".
+# With MQTT v5 the same values are also sent as ResponseTopic/CorrelationData.
+REPLY_TO_FIELD = "reply_to"
+CORRELATION_ID_FIELD = "correlation_id"
+REPLY_TOPIC_PREFIX = "rpc/reply"
+
+
+class TimerWheel:
+    """Hashed timer wheel serviced by a single thread.
+
+    schedule() and cancel() are O(1); one thread handles every pending
+    timeout instead of one timer or blocked thread per request.
+    """
+
+    def __init__(self, tick=0.05, slots=512):
+        self.tick = tick
+        self.slots = slots
+        self.wheel = [{} for _ in range(slots)]
+        self.current = 0
+        self.pending = 0
+        self.next_id = 0
+        self.lock = threading.Condition()
+        self.thread = None
+
+    def schedule(self, delay, callback):
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self.lock:
+            self.next_id += 1
+            timer_id = self.next_id
+            slot = (self.current + ticks) % self.slots
+            self.wheel[slot][timer_id] = [(ticks - 1) // self.slots, callback]
+            self.pending += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="mqtt-timer-wheel", daemon=True)
+                self.thread.start()
+            self.lock.notify()
+        return slot, timer_id
+
+    def cancel(self, handle):
+        slot, timer_id = handle
+        with self.lock:
+            if self.wheel[slot].pop(timer_id, None) is not None:
+                self.pending -= 1
+                return True
+        return False
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                    next_tick = time.monotonic()
+
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            for callback in self._advance():
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in timer callback: {e}")
+
+    def _advance(self):
+        expired = []
+        with self.lock:
+            self.current = (self.current + 1) % self.slots
+            bucket = self.wheel[self.current]
+            for timer_id, entry in list(bucket.items()):
+                if entry[0] <= 0:
+                    expired.append(entry[1])
+                    del bucket[timer_id]
+                    self.pending -= 1
+                else:
+                    entry[0] -= 1
+        return expired
+
+
+class PendingRequests:
+    """Correlation table for in-flight requests, each resolved by its own future."""
+
+    def __init__(self, timer_wheel=None):
+        self.timer_wheel = timer_wheel or default_timer_wheel()
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def new_request(self, timeout):
+        correlation_id = uuid.uuid4().hex
+        future = Future()
+        with self.lock:
+            # Registered under the lock so a very short timeout cannot fire
+            # before the entry exists
+            handle = self.timer_wheel.schedule(timeout, lambda: self._expire(correlation_id))
+            self.requests[correlation_id] = (future, handle)
+        return correlation_id, future
+
+    def resolve(self, correlation_id, response):
+        with self.lock:
+            entry = self.requests.pop(correlation_id, None)
+        if entry is None:
+            logger.debug(f"Response for unknown or expired request {correlation_id}")
+            return False
+
+        future, handle = entry
+        self.timer_wheel.cancel(handle)
+        if not future.done():
+            future.set_result(response)
+        return True
+
+    def discard(self, correlation_id):
+        with self.lock:
+            entry = self.requests.pop(correlation_id, None)
+        if entry is not None:
+            self.timer_wheel.cancel(entry[1])
+
+    def _expire(self, correlation_id):
+        with self.lock:
+            entry = self.requests.pop(correlation_id, None)
+        if entry is not None and not entry[0].done():
+            entry[0].set_exception(TimeoutError(f"Request {correlation_id} timed out"))
+
+    def __len__(self):
+        return len(self.requests)
+
+
+_default_timer_wheel = None
+_default_timer_wheel_lock = threading.Lock()
+
+
+def default_timer_wheel():
+    global _default_timer_wheel
+    with _default_timer_wheel_lock:
+        if _default_timer_wheel is None:
+            _default_timer_wheel = TimerWheel()
+        return _default_timer_wheel
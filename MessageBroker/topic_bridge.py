@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import paho.mqtt.client as mqtt
+
+import codec as payload_codec
+import topics
+
+logger = logging.getLogger('topic_bridge')
+
+
+class TopicBridge:
+    """Mirrors messages between the flat legacy topics and the hierarchical ones.
+
+    sensor/readings         <->  sensor/readings/<sector>/<device>
+    valve/control           <->  valve/control/<sector>
+
+    Payloads are forwarded unchanged (codec topic suffixes are carried over);
+    flat messages are only decoded to find their sector and device. Forwarded
+    payloads are remembered for a few seconds so the copy coming back on the
+    other side is not bridged again.
+    """
+
+    def __init__(self, host, port, client_id="smartbolt_topic_bridge",
+                 sensor_root=topics.SENSOR_READINGS_ROOT, valve_root=topics.VALVE_CONTROL_ROOT,
+                 echo_ttl=10.0, max_echoes=10000):
+        self.host = host
+        self.port = port
+        self.sensor_root = sensor_root
+        self.valve_root = valve_root
+        self.echo_ttl = echo_ttl
+        self.max_echoes = max_echoes
+        self.echoes = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"to_hierarchical": 0, "to_legacy": 0, "unroutable": 0}
+
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    def start(self):
+        try:
+            self.client.connect(self.host, self.port)
+            self.client.loop_start()
+            logger.info(f"Topic bridge started for {self.sensor_root} and {self.valve_root}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start topic bridge: {e}")
+            return False
+
+    def stop(self):
+        try:
+            self.client.disconnect()
+            self.client.loop_stop()
+        except Exception as e:
+            logger.error(f"Error stopping topic bridge: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe([(f"{self.sensor_root}/#", 1), (f"{self.valve_root}/#", 1)])
+        else:
+            logger.error(f"Topic bridge failed to connect with code: {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            if self._is_echo(msg.payload):
+                return
+            base, codec = payload_codec.split_topic_suffix(msg.topic)
+            if base.startswith(self.sensor_root):
+                self._bridge_sensor(base, codec, msg)
+            elif base.startswith(self.valve_root):
+                self._bridge_valve(base, codec, msg)
+        except Exception as e:
+            logger.error(f"Error bridging message on {msg.topic}: {e}")
+
+    def _bridge_sensor(self, base, codec, msg):
+        if base == self.sensor_root:
+            data = (codec or payload_codec.DEFAULT_CODEC).decode(msg.payload)
+            sector_id, device_id = topics.reading_route(data) if isinstance(data, dict) else (None, None)
+            if not device_id:
+                self._count("unroutable")
+                return
+            self._forward(topics.sensor_topic(sector_id, device_id, self.sensor_root), codec, msg, "to_hierarchical")
+        elif topics.parse_sensor_topic(base, self.sensor_root):
+            self._forward(self.sensor_root, codec, msg, "to_legacy")
+
+    def _bridge_valve(self, base, codec, msg):
+        if base == self.valve_root:
+            data = (codec or payload_codec.DEFAULT_CODEC).decode(msg.payload)
+            sector_id = data.get("sector_id") if isinstance(data, dict) else None
+            if not sector_id:
+                self._count("unroutable")
+                return
+            self._forward(topics.valve_control_topic(sector_id, self.valve_root), codec, msg, "to_hierarchical")
+        elif topics.parse_valve_control_topic(base, self.valve_root):
+            self._forward(self.valve_root, codec, msg, "to_legacy")
+
+    def _forward(self, topic, codec, msg, direction):
+        if codec is not None:
+            topic = payload_codec.topic_with_suffix(topic, codec)
+        self._remember(msg.payload)
+        self.client.publish(topic, msg.payload, qos=msg.qos)
+        self._count(direction)
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    # Loop prevention
+
+    def _remember(self, payload):
+        now = time.monotonic()
+        with self.lock:
+            self.echoes[hashlib.sha1(payload).digest()] = now
+            while self.echoes:
+                digest, seen = next(iter(self.echoes.items()))
+                if len(self.echoes) <= self.max_echoes and now - seen < self.echo_ttl:
+                    break
+                del self.echoes[digest]
+
+    def _is_echo(self, payload):
+        with self.lock:
+            return self.echoes.pop(hashlib.sha1(payload).digest(), None) is not None
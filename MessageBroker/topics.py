@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Hierarchical topic scheme:
+
+    sensor/readings/<sector_id>/<device_id>
+    valve/control/<sector_id>
+
+Consumers subscribe to the sectors or devices they care about, e.g.
+"sensor/readings/A/+" instead of receiving every reading of the plant.
+The flat legacy topics ("sensor/readings", "valve/control") are kept
+working by topic_bridge.TopicBridge.
+"""
+
+SENSOR_READINGS_ROOT = "sensor/readings"
+VALVE_CONTROL_ROOT = "valve/control"
+
+# Readings from devices without a known sector
+UNASSIGNED_SECTOR = "unassigned"
+
+# Existing sub-topics of the valve control root that are not sectors
+RESERVED_LEVELS = ("ack", "request")
+
+
+def topic_level(value):
+    """Make an ID safe to use as a single topic level."""
+    value = str(value)
+    for char in ('/', '+', '#'):
+        value = value.replace(char, '_')
+    return value or '_'
+
+
+def sensor_topic(sector_id, device_id, root=SENSOR_READINGS_ROOT):
+    return f"{root}/{topic_level(sector_id or UNASSIGNED_SECTOR)}/{topic_level(device_id)}"
+
+
+def sensor_filter(sector_id=None, device_id=None, root=SENSOR_READINGS_ROOT):
+    """Subscription filter for one sector, one device, or all readings.
+
+    Note "sensor/readings/#" would also match the flat legacy topic, so the
+    all-readings filter is "sensor/readings/+/+".
+    """
+    sector = topic_level(sector_id) if sector_id else '+'
+    device = topic_level(device_id) if device_id else '+'
+    return f"{root}/{sector}/{device}"
+
+
+def parse_sensor_topic(topic, root=SENSOR_READINGS_ROOT):
+    """Return (sector_id, device_id) for a hierarchical readings topic, else None."""
+    if not topic.startswith(root + '/'):
+        return None
+    levels = topic[len(root) + 1:].split('/')
+    if len(levels) != 2:
+        return None
+    return levels[0], levels[1]
+
+
+def reading_route(data):
+    """(sector_id, device_id) of a decoded sensor reading message."""
+    device_info = data.get("device_info") or {}
+    sector_info = data.get("sector_info") or {}
+    sector_id = data.get("sector_id") or device_info.get("sector_id") or sector_info.get("sector_id")
+    device_id = data.get("device_id") or device_info.get("device_id")
+    return sector_id, device_id
+
+
+def valve_control_topic(sector_id, root=VALVE_CONTROL_ROOT):
+    return f"{root}/{topic_level(sector_id)}"
+
+
+def valve_control_filter(sector_id=None, root=VALVE_CONTROL_ROOT):
+    return f"{root}/{topic_level(sector_id) if sector_id else '+'}"
+
+
+def parse_valve_control_topic(topic, root=VALVE_CONTROL_ROOT):
+    """Return the sector_id of a hierarchical valve control topic, else None."""
+    if not topic.startswith(root + '/'):
+        return None
+    levels = topic[len(root) + 1:].split('/')
+    if len(levels) != 1 or levels[0] in RESERVED_LEVELS:
+        return None
+    return levels[0]
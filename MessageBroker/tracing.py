@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Lightweight latency tracing across services.
+
+A trace context travels in the message payload under TRACE_FIELD:
+
+    {"trace_id": "...", "origin_ns": <epoch ns>, "sent_ns": <epoch ns>}
+
+origin_ns is when the sensor reading was taken, sent_ns is refreshed on
+every publish so the receiver can record the transit time of that hop.
+Wall-clock nanoseconds are used so spans are comparable across processes;
+hosts must be NTP-synchronised for cross-host hops to be meaningful.
+
+Each process records spans into its SpanCollector and can export them to
+TRACE_TOPIC, where the message broker aggregates percentiles per hop.
+"""
+
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('tracing')
+
+TRACE_FIELD = "trace"
+TRACE_TOPIC = "system/traces"
+
+_local = threading.local()
+
+
+def new_trace(origin_ns=None):
+    return {
+        "trace_id": uuid.uuid4().hex[:16],
+        "origin_ns": origin_ns or time.time_ns(),
+        "sent_ns": None
+    }
+
+
+def maybe_new_trace(sample_rate=1.0, origin_ns=None):
+    if sample_rate >= 1.0 or random.random() < sample_rate:
+        return new_trace(origin_ns)
+    return None
+
+
+def inject(message, context=None):
+    """Stamp the trace context (default: the active one) onto a message dict."""
+    context = context or current()
+    if context is None or not isinstance(message, dict):
+        return message
+    message[TRACE_FIELD] = {
+        "trace_id": context["trace_id"],
+        "origin_ns": context["origin_ns"],
+        "sent_ns": time.time_ns()
+    }
+    return message
+
+
+def extract(message):
+    if not isinstance(message, dict):
+        return None
+    context = message.get(TRACE_FIELD)
+    if isinstance(context, dict) and context.get("trace_id"):
+        return context
+    return None
+
+
+def activate(context):
+    """Make context the active trace of this thread (None clears it)."""
+    _local.context = context
+
+
+def current():
+    return getattr(_local, "context", None)
+
+
+class SpanCollector:
+    """Per-hop latency reservoirs plus a bounded queue of spans awaiting export."""
+
+    def __init__(self, service, window=2048, max_pending=5000):
+        self.service = service
+        self.window = window
+        self.hops = {}
+        self.counts = {}
+        self.pending = deque(maxlen=max_pending)
+        self.lock = threading.Lock()
+        self._exporter = None
+        self._stop_export = threading.Event()
+
+    def record(self, hop, duration_ms, trace_id=None, export=True):
+        with self.lock:
+            durations = self.hops.get(hop)
+            if durations is None:
+                durations = self.hops[hop] = deque(maxlen=self.window)
+                self.counts[hop] = 0
+            durations.append(duration_ms)
+            self.counts[hop] += 1
+            if export:
+                self.pending.append([hop, round(duration_ms, 3), trace_id])
+
+    def record_transit(self, hop, context):
+        """Record the network/broker hop that delivered a message carrying context."""
+        if context and context.get("sent_ns"):
+            self.record(hop, (time.time_ns() - context["sent_ns"]) / 1e6, context["trace_id"])
+
+    def record_since_origin(self, hop, context):
+        if context and context.get("origin_ns"):
+            self.record(hop, (time.time_ns() - context["origin_ns"]) / 1e6, context["trace_id"])
+
+    def span(self, hop, context=None):
+        return _Span(self, hop, context or current())
+
+    def ingest(self, message):
+        """Add spans exported by another process (see start_exporter)."""
+        for hop, duration_ms, trace_id in message.get("spans", []):
+            self.record(f"{message.get('service', 'unknown')}:{hop}", duration_ms, trace_id, export=False)
+
+    def summary(self):
+        with self.lock:
+            snapshot = {hop: (sorted(durations), self.counts[hop]) for hop, durations in self.hops.items()}
+
+        summary = {}
+        for hop, (durations, count) in sorted(snapshot.items()):
+            if not durations:
+                continue
+            summary[hop] = {
+                "count": count,
+                "window": len(durations),
+                "p50_ms": _percentile(durations, 50),
+                "p95_ms": _percentile(durations, 95),
+                "p99_ms": _percentile(durations, 99),
+                "max_ms": round(durations[-1], 3)
+            }
+        return summary
+
+    def drain(self):
+        with self.lock:
+            spans = list(self.pending)
+            self.pending.clear()
+        return spans
+
+    def start_exporter(self, publish, interval=5.0, topic=TRACE_TOPIC):
+        """Periodically call publish(topic, message) with the spans recorded since the last call."""
+        if self._exporter is not None:
+            return
+
+        def run():
+            while not self._stop_export.wait(interval):
+                spans = self.drain()
+                if not spans:
+                    continue
+                try:
+                    publish(topic, {"service": self.service, "timestamp": time.time(), "spans": spans})
+                except Exception as e:
+                    logger.error(f"Error exporting spans: {e}")
+
+        self._exporter = threading.Thread(target=run, name="span-exporter", daemon=True)
+        self._exporter.start()
+
+    def stop_exporter(self):
+        self._stop_export.set()
+
+
+class _Span:
+    __slots__ = ("collector", "hop", "context", "started")
+
+    def __init__(self, collector, hop, context):
+        self.collector = collector
+        self.hop = hop
+        self.context = context
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.context is not None:
+            elapsed_ms = (time.perf_counter() - self.started) * 1000
+            self.collector.record(self.hop, elapsed_ms, self.context["trace_id"])
+        return False
+
+
+def _percentile(sorted_values, pct):
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 3)
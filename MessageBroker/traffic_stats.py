@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger('mqtt_traffic_stats')
+
+# Payload size histogram buckets: upper bounds in bytes, last bucket is open ended
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 4096, 16384, 65536)
+SIZE_BUCKET_LABELS = tuple(f"<={bound}" for bound in SIZE_BUCKETS) + (f">{SIZE_BUCKETS[-1]}",)
+
+# Topics beyond max_topics are accounted under this key
+OTHER_TOPICS = "<other>"
+
+# Counters the per-topic snapshot can be sorted by
+SORT_KEYS = ("messages", "bytes", "avg_size", "message_rate", "byte_rate", "last_seen")
+
+
+def size_bucket(size):
+    for index, bound in enumerate(SIZE_BUCKETS):
+        if size <= bound:
+            return index
+    return len(SIZE_BUCKETS)
+
+
+class TopicCounters:
+    """Fixed-size counters for one topic; rates come from a ring of per-second slots."""
+
+    __slots__ = ("messages", "bytes", "first_seen", "last_seen", "histogram",
+                 "slot_messages", "slot_bytes", "slot_second")
+
+    def __init__(self, window, now):
+        self.messages = 0
+        self.bytes = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.histogram = [0] * (len(SIZE_BUCKETS) + 1)
+        self.slot_messages = [0] * window
+        self.slot_bytes = [0] * window
+        self.slot_second = [0] * window
+
+    def add(self, size, now):
+        self.messages += 1
+        self.bytes += size
+        self.last_seen = now
+        self.histogram[size_bucket(size)] += 1
+
+        second = int(now)
+        slot = second % len(self.slot_second)
+        if self.slot_second[slot] != second:
+            self.slot_second[slot] = second
+            self.slot_messages[slot] = 0
+            self.slot_bytes[slot] = 0
+        self.slot_messages[slot] += 1
+        self.slot_bytes[slot] += size
+
+    def rates(self, now):
+        """Messages/s and bytes/s over the completed seconds of the window."""
+        window = len(self.slot_second)
+        current = int(now)
+        oldest = current - window
+        messages = 0
+        size = 0
+        for slot in range(window):
+            if oldest <= self.slot_second[slot] < current:
+                messages += self.slot_messages[slot]
+                size += self.slot_bytes[slot]
+        span = min(window, max(1, current - int(self.first_seen)))
+        return messages / span, size / span
+
+    def snapshot(self, now):
+        message_rate, byte_rate = self.rates(now)
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "avg_size": round(self.bytes / self.messages, 1) if self.messages else 0,
+            "message_rate": round(message_rate, 3),
+            "byte_rate": round(byte_rate, 1),
+            "last_seen": self.last_seen,
+            "size_histogram": dict(zip(SIZE_BUCKET_LABELS, self.histogram))
+        }
+
+
+class TrafficStats:
+    """Per-topic message/byte counters fed from the broker's '#' subscription.
+
+    Only the payload length is looked at; payload content is decoded and
+    logged for a random sample_rate fraction of messages (0 disables it).
+    Memory is bounded: at most max_topics topics are tracked individually.
+    """
+
+    def __init__(self, max_topics=1000, window=60, sample_rate=0.0):
+        self.max_topics = max_topics
+        self.window = window
+        self.sample_rate = sample_rate
+        self.topics = {}
+        self.totals = TopicCounters(window, time.time())
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, topic, size, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            counters = self.topics.get(topic)
+            if counters is None:
+                if len(self.topics) >= self.max_topics:
+                    topic = OTHER_TOPICS
+                    counters = self.topics.get(topic)
+                if counters is None:
+                    counters = TopicCounters(self.window, now)
+                    self.topics[topic] = counters
+            counters.add(size, now)
+            self.totals.add(size, now)
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def sample(self, topic, payload):
+        """Log payload content if this message is picked for sampling."""
+        if not self.should_sample():
+            return
+        try:
+            logger.info(f"Sampled message on {topic}: {payload.decode('utf-8')}")
+        except UnicodeDecodeError:
+            logger.info(f"Sampled binary message on {topic}: {len(payload)} bytes")
+
+    def snapshot(self, top=None, sort="messages", prefix=None):
+        now = time.time()
+        with self.lock:
+            items = [(topic, counters.snapshot(now)) for topic, counters in self.topics.items()
+                     if prefix is None or topic.startswith(prefix)]
+            totals = self.totals.snapshot(now)
+
+        items.sort(key=lambda item: item[1].get(sort, 0), reverse=True)
+        if top is not None:
+            items = items[:top]
+
+        return {
+            "timestamp": now,
+            "uptime": round(now - self.started, 1),
+            "window_seconds": self.window,
+            "sample_rate": self.sample_rate,
+            "topic_count": len(self.topics),
+            "totals": totals,
+            "topics": dict(items)
+        }
+
+    def get_totals(self):
+        now = time.time()
+        with self.lock:
+            return self.totals.snapshot(now)
+
+    def reset(self):
+        with self.lock:
+            self.topics.clear()
+            self.totals = TopicCounters(self.window, time.time())
+            self.started = time.time()